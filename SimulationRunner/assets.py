@@ -0,0 +1,156 @@
+"""Module implementing a content-addressed store for files shared between simulation directories.
+
+Every simulation in a suite needs a TREECOOL file, a copy of cambpower.py and the MP-Gadget binaries.
+Rather than copying them into each run directory, each distinct file is stored once,
+named by the hash of its contents, and the run directories get hard links (or symlinks) to it.
+
+Layout of the store:
+    root/objects/ab/abcdef0123... (sha256 of the contents)"""
+
+import argparse
+import hashlib
+import os
+import os.path
+import shutil
+import tempfile
+
+#Cache of file hashes, keyed by (path, size, mtime), so that unchanged files are not re-read.
+_HASH_CACHE = {}
+
+def file_hash(fname, blocksize=1<<20, use_cache=True):
+    """Get the sha256 hash of a file's contents.
+    If use_cache is False the file is always read: use this to check for corruption,
+    as an in-place rewrite of the same size may keep the modification time."""
+    st = os.stat(fname)
+    key = (os.path.realpath(fname), st.st_size, st.st_mtime_ns)
+    if use_cache:
+        try:
+            return _HASH_CACHE[key]
+        except KeyError:
+            pass
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as fh:
+        block = fh.read(blocksize)
+        while block:
+            sha.update(block)
+            block = fh.read(blocksize)
+    _HASH_CACHE[key] = sha.hexdigest()
+    return _HASH_CACHE[key]
+
+class AssetStore(object):
+    """A content-addressed file store.
+    Arguments:
+        root - directory containing the store. Created if it does not exist.
+        link - 'hard' to hard link files into run directories, 'symlink' to symlink them.
+               Hard links fall back to symlinks if the run directory is on a different filesystem."""
+    def __init__(self, root, link="hard"):
+        assert link in ("hard", "symlink")
+        self.root = os.path.realpath(os.path.expanduser(root))
+        self.link = link
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+
+    def object_path(self, digest):
+        """Path in the store for a given content hash."""
+        return os.path.join(os.path.join(self.root, "objects"), os.path.join(digest[:2], digest))
+
+    def add(self, fname):
+        """Add a file to the store, if it is not already there. Returns the path of the stored object."""
+        digest = file_hash(fname)
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            return obj
+        objdir = os.path.dirname(obj)
+        os.makedirs(objdir, exist_ok=True)
+        #Copy to a temporary file and rename, so a partially written object is never visible.
+        (fd, tmpname) = tempfile.mkstemp(dir=objdir)
+        os.close(fd)
+        try:
+            shutil.copy2(fname, tmpname)
+            os.replace(tmpname, obj)
+        except:
+            os.remove(tmpname)
+            raise
+        return obj
+
+    def install(self, src, dest):
+        """Store src and make dest a link to the stored copy. Any existing dest is replaced."""
+        obj = self.add(src)
+        if os.path.lexists(dest):
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                raise OSError("File:",dest," is a directory. Not replacing")
+            os.remove(dest)
+        if self.link == "hard":
+            try:
+                os.link(obj, dest)
+                return dest
+            except OSError:
+                pass
+        os.symlink(obj, dest)
+        return dest
+
+    def verify(self):
+        """Check that every object in the store still matches its hash.
+        Returns a list of corrupted object paths."""
+        corrupt = []
+        for (dirpath, _, filenames) in os.walk(os.path.join(self.root, "objects")):
+            for ff in filenames:
+                obj = os.path.join(dirpath, ff)
+                if file_hash(obj, use_cache=False) != ff:
+                    corrupt.append(obj)
+        return corrupt
+
+def install_file(src, dest, asset_store=None):
+    """Copy src to dest, or link it from an asset store if one is given.
+    An existing dest is replaced, not written through: it may be a link into a store shared by other runs."""
+    if asset_store is None:
+        (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)))
+        os.close(fd)
+        try:
+            shutil.copy(src, tmpname)
+            os.replace(tmpname, dest)
+        except:
+            os.remove(tmpname)
+            raise
+        return dest
+    return AssetStore(asset_store).install(src, dest)
+
+def verify_links(rundir, store=None):
+    """Find broken links in a suite directory.
+    Reports symlinks whose target is missing and, if a store is given,
+    links into the store whose contents no longer match their hash.
+    Returns a list of (path, problem) tuples."""
+    rundir = os.path.realpath(os.path.expanduser(rundir))
+    problems = []
+    for (dirpath, dirnames, filenames) in os.walk(rundir):
+        if store is not None and os.path.realpath(dirpath) == store.root:
+            dirnames[:] = []
+            continue
+        for ff in filenames + dirnames:
+            fname = os.path.join(dirpath, ff)
+            if os.path.islink(fname) and not os.path.exists(fname):
+                problems.append((fname, "broken symlink"))
+                continue
+            if store is None or not os.path.isfile(fname):
+                continue
+            target = os.path.realpath(fname)
+            st = os.stat(fname)
+            if target.startswith(store.root+os.path.sep):
+                if file_hash(target, use_cache=False) != os.path.basename(target):
+                    problems.append((fname, "store object modified"))
+            elif st.st_nlink > 1 and not os.path.exists(store.object_path(file_hash(fname))):
+                #A hard link whose contents no longer match any stored object.
+                problems.append((fname, "hard link does not match store"))
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify links into an asset store")
+    parser.add_argument('rundir', type=str, help='Suite directory to check')
+    parser.add_argument('--store', type=str, default=None, help='Asset store directory', required=False)
+    args = parser.parse_args()
+    astore = None
+    if args.store is not None:
+        astore = AssetStore(args.store)
+        for bad in astore.verify():
+            print("CORRUPT: ",bad)
+    for (path, problem) in verify_links(args.rundir, astore):
+        print(path," : ",problem)
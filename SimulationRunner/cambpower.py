@@ -1,6 +1,8 @@
 """Module containing a stand-alone script which compares the power spectrum of ICs
 to the power spectrum fed into MP-GenIC, read from CLASS format files."""
 import argparse
+import collections
+import hashlib
 import os
 import scipy.interpolate as interp
 import numpy as np
@@ -9,61 +11,165 @@ matplotlib.use("PDF")
 import matplotlib.pyplot as plt
 from nbodykit.lab import BigFileCatalog,FFTPower
 
+def _rebin_bounds(kk, modes, minmodes=250, ndesired=200):
+    """Find the bins [istart, iend) so that each bin has at least minmodes modes
+    and is at least 1/ndesired of the k range wide in log space.
+    The first k bin is kept on its own, and a trailing bin which is too small is dropped.
+    Each bin edge is found by a binary search on the cumulative mode count,
+    so the cost scales with the number of output bins rather than the number of input bins.
+    kk must be sorted."""
+    logkk=np.log10(kk)
+    mdlogk = (np.max(logkk) - np.min(logkk))/ndesired
+    cummodes = np.concatenate([[0,], np.cumsum(modes)])
+    nk = np.size(logkk)
+    starts = []
+    ends = []
+    istart = 1
+    while istart < nk-1:
+        #First bin end with enough modes
+        imodes = np.searchsorted(cummodes, cummodes[istart]+minmodes, side='left')
+        #First bin end with a wide enough bin
+        iwidth = np.searchsorted(logkk, logkk[istart]+mdlogk, side='left')+1
+        iend = max(imodes, iwidth, istart+1)
+        if iend > nk-1:
+            break
+        starts.append(istart)
+        ends.append(iend)
+        istart = iend
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def _rebin_weighted(values, modes, starts, ends):
+    """Mode-weighted average of values in each bin. Bins must be contiguous."""
+    if np.size(starts) == 0:
+        return np.array([])
+    weighted = np.add.reduceat((modes*values)[:ends[-1]], starts)
+    count = np.add.reduceat(modes[:ends[-1]], starts)
+    return weighted / count
+
 def modecount_rebin(kk, pk, modes, pkc, minmodes=250, ndesired=200):
     """Rebins a power spectrum so that there are sufficient modes in each bin"""
+    (k_list, pk_list, _) = modecount_rebin_multi(kk, {0: pk}, modes, {0: pkc}, minmodes=minmodes, ndesired=ndesired)
+    return (k_list, pk_list[0])
+
+def modecount_rebin_multi(kk, pks, modes, pkcs, minmodes=250, ndesired=200):
+    """Rebin several power spectra measured on the same k bins (eg, for different species) in one pass.
+    The ratio to the reference spectrum is averaged, which removes most of the slope within each bin.
+    Arguments:
+        kk - k bins (sorted)
+        pks - dictionary of power spectra, one per species.
+        modes - number of modes in each k bin.
+        pkcs - dictionary of callable reference power spectra (eg, from CLASSPowerSpectrum), with the same keys as pks.
+    Returns (rebinned k, dictionary of rebinned power, dictionary of rebinned power divided by the reference)."""
     assert np.all(kk) > 0
-    logkk=np.log10(kk)
-    mdlogk = (np.max(logkk) - np.min(logkk))/ndesired
-    istart=iend=1
-    count=0
-    pk_div = pk /pkc(kk)
-    k_list=[kk[0]]
-    pk_list=[pk_div[0]]
-    targetlogk=mdlogk+logkk[istart]
-    while iend < np.size(logkk)-1:
-        count+=modes[iend]
-        iend+=1
-        if count >= minmodes and logkk[iend-1] >= targetlogk:
-            pk1 = np.sum(modes[istart:iend]*pk_div[istart:iend])/count
-            kk1 = np.sum(modes[istart:iend]*kk[istart:iend])/count
-            k_list.append(kk1)
-            pk_list.append(pk1)
-            istart=iend
-            targetlogk=mdlogk+logkk[istart]
-            count=0
-    k_list = np.array(k_list)
-    pk_list = np.array(pk_list) * pkc(k_list)
-    return (k_list, pk_list)
+    modes = np.asarray(modes, dtype=np.float64)
+    (starts, ends) = _rebin_bounds(kk, modes, minmodes=minmodes, ndesired=ndesired)
+    k_list = np.concatenate([[kk[0],], _rebin_weighted(kk, modes, starts, ends)])
+    pk_list = {}
+    ratio_list = {}
+    for sp in pks.keys():
+        pk_div = pks[sp] / pkcs[sp](kk)
+        ratio_list[sp] = np.concatenate([[pk_div[0],], _rebin_weighted(pk_div, modes, starts, ends)])
+        pk_list[sp] = ratio_list[sp] * pkcs[sp](k_list)
+    return (k_list, pk_list, ratio_list)
+
+#Process-wide caches of loaded CLASS tables and built interpolators,
+#keyed by the hash of the file contents. Many runs in a suite share identical
+#CLASS output, and these are then only loaded and interpolated once.
+#Only the most recently used entries are kept, so a long-running process does not accumulate every table it has seen.
+_CACHE_SIZE = 8
+_TABLE_CACHE = collections.OrderedDict()
+_INTERP_CACHE = collections.OrderedDict()
+
+def clear_cache():
+    """Forget all cached tables and interpolators."""
+    _TABLE_CACHE.clear()
+    _INTERP_CACHE.clear()
+
+def _cached(cache, key, build):
+    """Return cache[key], calling build() to make it if absent and discarding the least recently used entry if full."""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = build()
+    cache[key] = value
+    while len(cache) > _CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+def _load_table(fname):
+    """Load a text table, returning (hash of the file contents, array)."""
+    with open(fname, 'rb') as fh:
+        digest = hashlib.sha1(fh.read()).hexdigest()
+    return digest, _cached(_TABLE_CACHE, digest, lambda: np.loadtxt(fname))
+
+class LogInterpolator(object):
+    """Cubic interpolator for a power spectrum, built in log(k) - log(P) space.
+    This is more accurate than interpolating linearly for a given number of knots.
+    If the power is not positive everywhere (eg, a species with no transfer function), P itself is interpolated in log(k),
+    as log(P) would be infinite.
+    Can be evaluated on arrays of k."""
+    def __init__(self, kk, pk):
+        self._logpk = np.all(pk > 0)
+        if self._logpk:
+            pk = np.log(pk)
+        self._interp = interp.interp1d(np.log(kk), pk, kind='cubic')
+
+    def __call__(self, kk):
+        pk = self._interp(np.log(kk))
+        if self._logpk:
+            return np.exp(pk)
+        return pk
 
 class CLASSPowerSpectrum(object):
-    """Class to store some routines for manipulating and storing power spectra as generated by CLASS."""
+    """Class to store some routines for manipulating and storing power spectra as generated by CLASS.
+    The files are read and the interpolators for each species built only when first needed,
+    and are shared between instances reading files with the same contents."""
     def __init__(self, camb_matter, camb_transfer, omega0, omegab, omeganu=0):
-        pk_camb = np.loadtxt(camb_matter)
-        assert np.shape(pk_camb)[1] == 2
-        # Build an interpolator for the matter power spectrum
-        self.dpk = interp.interp1d(pk_camb[:, 0], pk_camb[:, 1], kind='cubic')
-        # Build interpolators for various species of transfer functions.
-        tk_camb = np.loadtxt(camb_transfer)
-        self.dtk = {}
-        omegacdm = omega0 - omegab - omeganu
-        tdmby = (omegab * tk_camb[:,2] + omegacdm * tk_camb[:,3])
-        ttot = np.array(tdmby)
-        if omeganu > 0:
-            ttot += omeganu * tk_camb[:,6]
-        ttot /= omega0
-        tdmby /= (omegab + omegacdm)
+        self.camb_matter = camb_matter
+        self.camb_transfer = camb_transfer
+        self.omega0 = omega0
+        self.omegab = omegab
+        self.omeganu = omeganu
+        #(hash, table) pairs, loaded on first use
+        self._matter = None
+        self._transfer = None
 
-        self.dtk[1] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 3]/ttot)**2, kind='cubic')
-        #Baryons
-        self.dtk[0] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tk_camb[:, 2]/ttot)**2, kind='cubic')
-        #DM + baryon
-        self.dtk[3] = interp.interp1d(tk_camb[:,0], pk_camb[:,1] * (tdmby/ttot)**2, kind='cubic')
+    def _species_power(self, tk_camb, pk_camb, species):
+        """Power spectrum for a single species: the matter power times the squared ratio of transfer functions."""
+        omegacdm = self.omega0 - self.omegab - self.omeganu
+        tdmby = (self.omegab * tk_camb[:,2] + omegacdm * tk_camb[:,3])
+        ttot = np.array(tdmby)
+        if self.omeganu > 0:
+            ttot += self.omeganu * tk_camb[:,6]
+        ttot /= self.omega0
+        tdmby /= (self.omegab + omegacdm)
+        #Baryons, DM and DM + baryon
+        tspecies = {0: tk_camb[:,2], 1: tk_camb[:,3], 3: tdmby}
+        return pk_camb[:,1] * (tspecies[species]/ttot)**2
 
     def get_class_power(self, species=-1):
-        """Get a matter power spectrum for DM, baryons from CAMB."""
+        """Get a matter power spectrum for DM (1), baryons (0), DM + baryons (3) or all matter (-1) from CLASS."""
+        if self._matter is None:
+            self._matter = _load_table(self.camb_matter)
+        (mhash, pk_camb) = self._matter
+        assert np.shape(pk_camb)[1] == 2
         if species < 0:
-            return self.dpk
-        return self.dtk[species]
+            return _cached(_INTERP_CACHE, (mhash,), lambda: LogInterpolator(pk_camb[:, 0], pk_camb[:, 1]))
+        if self._transfer is None:
+            self._transfer = _load_table(self.camb_transfer)
+        (thash, tk_camb) = self._transfer
+        key = (mhash, thash, self.omega0, self.omegab, self.omeganu, species)
+        return _cached(_INTERP_CACHE, key, lambda: LogInterpolator(tk_camb[:,0], self._species_power(tk_camb, pk_camb, species)))
+
+    @property
+    def dpk(self):
+        """Interpolator for the total matter power spectrum."""
+        return self.get_class_power(species=-1)
+
+    @property
+    def dtk(self):
+        """Dictionary of interpolators for baryons (0), DM (1) and DM + baryons (3)."""
+        return {sp: self.get_class_power(species=sp) for sp in (0, 1, 3)}
 
 def plot_ic_power(kk_ic, Pk_ic, Pk_camb, npart, sp=1, outdir="."):
     """Make the plot"""
@@ -109,6 +215,8 @@ def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m
     npart = int(np.round(np.cbrt(cats[1].attrs['TotNumPart'][1])))
     assert npart > 0
     cambpow = CLASSPowerSpectrum(matterpow, transfer,omega0=omega0, omegab=omegab, omeganu=m_nu/93.14/hubble**2)
+    pks = {}
+    pkcs = {}
     for sp in cats.keys():
         #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
         cats[sp].to_mesh(Nmesh=npart*2, window='cic', compensated=True, interlaced=True)
@@ -116,21 +224,23 @@ def check_ic_power_spectra(genicfileout, camb_zstr, outdir=".", accuracy=0.07, m
         #GenPK output is at PK-[nu,by,DM]-basename(genicfileout)
         #Load the power spectra
         #Convert units from kpc/h to Mpc/h
-        kk_ic = pk.power['k'][1:]*1e3
-        Pk_ic = pk.power['power'][1:].real/1e9
-        modes_ic = pk.power['modes'][1:]
-        ii = np.isfinite(kk_ic)
-        kk_ic = kk_ic[ii]
-        Pk_ic = Pk_ic[ii]
+        kk_sp = pk.power['k'][1:]*1e3
+        ii = np.isfinite(kk_sp)
+        pks[sp] = pk.power['power'][1:][ii].real/1e9
+        #The k bins are the same for every species, as the mesh is the same.
+        kk_ic = kk_sp[ii]
+        modes_ic = pk.power['modes'][1:][ii]
         #Load the power spectrum. Note that DM may be total.
         ccsp = sp
         if len(cats) == 1:
             ccsp = -1
             if m_nu > 0:
                 ccsp = 3
-        Pk_camb = cambpow.get_class_power(species=ccsp)
-        (kk_ic, Pk_ic) = modecount_rebin(kk_ic, Pk_ic, modes_ic[ii], Pk_camb, ndesired=npart//2)
-        error = plot_ic_power(kk_ic, Pk_ic, Pk_camb(kk_ic), sp=sp, npart=npart, outdir=outdir)
+        pkcs[sp] = cambpow.get_class_power(species=ccsp)
+    #Rebin all species at once
+    (kk_ic, Pk_ics, _) = modecount_rebin_multi(kk_ic, pks, modes_ic, pkcs, ndesired=npart//2)
+    for sp in cats.keys():
+        error = plot_ic_power(kk_ic, Pk_ics[sp], pkcs[sp](kk_ic), sp=sp, npart=npart, outdir=outdir)
         #Don't worry too much about one failing mode.
         if np.size(np.where(error > accuracy)) > 3:
             raise RuntimeError("Pk accuracy check failed for "+str(sp)+". Max error: "+str(np.max(error)))
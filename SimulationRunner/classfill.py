@@ -0,0 +1,79 @@
+"""Module to fill in the CLASS output of a suite made with make_simulation(dry_run=True), in batches.
+
+A dry run writes every parameter file and submission script of a suite without running CLASS.
+This stage then runs CLASS once for each distinct cosmology in the suite, and copies the output to
+every other run with the same cosmology (for example, runs which differ only in resolution or seed, and paired partners).
+Runs with the same CLASS parameters up to the maximum k are grouped, and CLASS is run for the run with the largest k.
+Groups are computed in a pool of threads: start a CLASS worker (classworker.py) with several processes
+so they are computed in parallel. Runs which are already filled are skipped, so this can be rerun after a failure.
+Run it on the design of mpiprep.py with:
+    python -m SimulationRunner.classfill design.json --nworkers 4"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os.path
+from . import mpiprep
+
+def is_pending(outdir):
+    """True if a run was made by a dry run and its CLASS output has not yet been filled."""
+    try:
+        with open(os.path.join(outdir, "SimulationICs.json"), 'r') as jsin:
+            return bool(json.load(jsin).get("class_pending", False))
+    except (IOError, ValueError):
+        return False
+
+def class_key(sim):
+    """Hash of the CLASS parameters of a simulation, other than the maximum k, and of its output redshifts."""
+    (pre_params, camb_zz) = sim.class_params()
+    params = {kk: str(vv) for (kk, vv) in pre_params.items() if kk != 'P_k_max_h/Mpc'}
+    key = json.dumps([params, [repr(float(zz)) for zz in camb_zz], bool(sim.rescale_growth)], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def group_by_class(sims):
+    """Group simulations which can share their CLASS output.
+    Returns a list of groups, each sorted so that the first simulation has the largest maximum k."""
+    groups = {}
+    for sim in sims:
+        groups.setdefault(class_key(sim), []).append(sim)
+    return [sorted(group, key=lambda sim: -sim.class_params()[0]['P_k_max_h/Mpc']) for group in groups.values()]
+
+def _fill_group(group):
+    """Run CLASS for the first simulation of a group and copy its output to the others.
+    Returns a dictionary from run directory to status."""
+    status = {}
+    try:
+        camb_output = group[0].fill_class()
+    except Exception as err: # pylint: disable=broad-except
+        return {sim.outdir: "failed: "+repr(err) for sim in group}
+    status[group[0].outdir] = "done"
+    class_dir = os.path.join(group[0].outdir, camb_output)
+    for sim in group[1:]:
+        try:
+            sim.fill_class(class_dir=class_dir)
+            status[sim.outdir] = "done"
+        except Exception as err: # pylint: disable=broad-except
+            status[sim.outdir] = "failed: "+repr(err)
+    return status
+
+def fill_suite(sims, nworkers=4):
+    """Fill the CLASS output of every pending simulation. Returns a dictionary from run directory to status."""
+    groups = group_by_class([sim for sim in sims if is_pending(sim.outdir)])
+    status = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as pool:
+        for part in pool.map(_fill_group, groups):
+            status.update(part)
+    return status
+
+def fill_design(design, nworkers=4):
+    """Fill the CLASS output of every point of a design, prepared by mpiprep with dry_run."""
+    sims = [mpiprep.point_simulation(design, ii) for ii in range(len(design["points"]))]
+    return fill_suite(sims, nworkers=nworkers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('design', type=str, help='JSON file describing the suite')
+    parser.add_argument('--nworkers', type=int, default=4, help='Number of cosmologies computed at once', required=False)
+    args = parser.parse_args()
+    mpiprep.print_status(fill_design(mpiprep.load_design(args.design), nworkers=args.nworkers))
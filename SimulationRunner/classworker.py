@@ -0,0 +1,229 @@
+"""Module for a long-lived local worker which keeps CLASS loaded and computes linear theory on request.
+
+Importing classylss and setting up an engine with the high precision parameters of SimulationICs.cambfile
+is slow, and is repeated by every script which needs linear theory. The worker listens on a Unix socket
+and computes requests in a pool of processes which have already imported classylss, so several
+cosmologies are computed in parallel. Start it with:
+    python -m SimulationRunner.classworker --nworkers 4
+compute_linear uses the worker if it is running, and otherwise computes in-process.
+The socket is by default in a private (mode 0700) directory in the temporary directory, named for the user,
+or set by SR_CLASS_WORKER. Requests are pickled, so only the user running the worker may send them:
+the directory holding the socket must be owned by this user and not writable by anyone else,
+and each connection must prove it knows a random key, stored next to the socket with mode 0600."""
+
+import argparse
+import concurrent.futures
+import os
+import os.path
+import tempfile
+import stat
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, answer_challenge, deliver_challenge
+import numpy as np
+
+def default_address():
+    """Path of the worker socket."""
+    if "SR_CLASS_WORKER" in os.environ:
+        return os.environ["SR_CLASS_WORKER"]
+    return os.path.join(tempfile.gettempdir(), "simulationrunner-"+str(os.getuid()), "class.sock")
+
+def key_file(address):
+    """Path of the file holding the key clients use to authenticate."""
+    return address+".key"
+
+def _check_private(path, mask):
+    """Raise PermissionError unless path is owned by this user and has none of the permission bits in mask."""
+    info = os.lstat(path)
+    if info.st_uid != os.getuid() or stat.S_ISLNK(info.st_mode) or info.st_mode & mask:
+        raise PermissionError("CLASS worker: "+path+" is not private to this user")
+
+def _private_dir(address):
+    """Make the directory for the socket if needed (mode 0700), and check nobody else can write to it."""
+    dirname = os.path.dirname(os.path.abspath(address))
+    try:
+        os.mkdir(dirname, 0o700)
+    except FileExistsError:
+        pass
+    _check_private(dirname, stat.S_IWGRP | stat.S_IWOTH)
+
+def _read_key(address):
+    """Read the authentication key of the worker, checking that only this user could have written it."""
+    fname = key_file(address)
+    _check_private(fname, stat.S_IRWXG | stat.S_IRWXO)
+    with open(fname, 'rb') as fh:
+        return fh.read()
+
+def _write_key(address):
+    """Write a new random authentication key, readable only by this user."""
+    fname = key_file(address)
+    if os.path.exists(fname):
+        os.remove(fname)
+    authkey = os.urandom(32)
+    fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(authkey)
+    return authkey
+
+def _load_class():
+    """Import classylss once in each worker process."""
+    #Imported here so that the module can be used without classylss when a worker is running.
+    import classylss.binding
+    return classylss.binding
+
+def _compute_linear(params, redshifts):
+    """Compute CLASS transfer functions and the linear matter power at each redshift, in this process.
+    Returns a list of (transfer function structured array, linear power array) for each redshift."""
+    CLASS = _load_class()
+    engine = CLASS.ClassEngine(params)
+    powspec = CLASS.Spectra(engine)
+    results = []
+    for zz in redshifts:
+        trans = powspec.get_transfer(z=zz)
+        #fp-roundoff
+        trans['k'][-1] *= 0.9999
+        pk_lin = powspec.get_pklin(k=trans['k'], z=zz)
+        results.append((trans, pk_lin))
+    return results
+
+def _compute_background(params, redshifts):
+    """Compute the scale-independent growth factor D, growth rate f and E(z) = H(z)/H0 at each redshift, in this process.
+    Returns a dictionary of arrays."""
+    CLASS = _load_class()
+    engine = CLASS.ClassEngine(params)
+    back = CLASS.Background(engine)
+    zz = np.array(redshifts, dtype=np.float64)
+    return {"z": zz, "D": back.scale_independent_growth_factor(zz), "f": back.scale_independent_growth_rate(zz), "E": back.efunc(zz)}
+
+def _connect(address):
+    """Connect to the worker, or return None if it is not running.
+    Raises PermissionError if the socket or its key belong to another user."""
+    try:
+        _check_private(os.path.dirname(os.path.abspath(address)), stat.S_IWGRP | stat.S_IWOTH)
+        _check_private(address, stat.S_IRWXG | stat.S_IRWXO)
+        authkey = _read_key(address)
+        return Client(address, family="AF_UNIX", authkey=authkey)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+def _request(conn, request):
+    """Send a request and wait for the reply. Errors from the worker are raised here."""
+    conn.send(request)
+    (status, result) = conn.recv()
+    if status == "error":
+        raise result
+    return result
+
+def compute_linear(params, redshifts, address=None):
+    """Transfer functions and linear power for a dictionary of CLASS parameters at each redshift.
+    Uses the worker if it is running, and otherwise computes in this process.
+    Returns a list of (transfer function structured array, linear power array) for each redshift."""
+    if address is None:
+        address = default_address()
+    conn = _connect(address)
+    if conn is None:
+        return _compute_linear(params, list(redshifts))
+    with conn:
+        return _request(conn, ("linear", dict(params), list(redshifts)))
+
+def compute_background(params, redshifts, address=None):
+    """Growth factor, growth rate and H(z)/H0 at each redshift, for a dictionary of CLASS parameters.
+    Uses the worker if it is running, and otherwise computes in this process."""
+    if address is None:
+        address = default_address()
+    conn = _connect(address)
+    if conn is None:
+        return _compute_background(params, list(redshifts))
+    with conn:
+        return _request(conn, ("background", dict(params), list(redshifts)))
+
+def ping(address=None):
+    """True if the worker is running."""
+    conn = _connect(address if address is not None else default_address())
+    if conn is None:
+        return False
+    with conn:
+        return _request(conn, ("ping",)) == "pong"
+
+def shutdown(address=None):
+    """Stop the worker, if it is running."""
+    address = address if address is not None else default_address()
+    conn = _connect(address)
+    if conn is None:
+        return
+    with conn:
+        _request(conn, ("shutdown",))
+
+def _handle(conn, pool, stop, address, authkey):
+    """Serve requests on a single connection until the client closes it.
+    Nothing is unpickled until the client has shown it knows the key."""
+    with conn:
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+        except (AuthenticationError, EOFError, OSError):
+            return
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if request[0] == "linear":
+                    reply = ("ok", pool.submit(_compute_linear, request[1], request[2]).result())
+                elif request[0] == "background":
+                    reply = ("ok", pool.submit(_compute_background, request[1], request[2]).result())
+                elif request[0] == "ping":
+                    reply = ("ok", "pong")
+                elif request[0] == "shutdown":
+                    stop.set()
+                    reply = ("ok", None)
+                else:
+                    raise ValueError("Unknown request: "+str(request[0]))
+            except Exception as err: # pylint: disable=broad-except
+                reply = ("error", err)
+            try:
+                conn.send(reply)
+            except (TypeError, AttributeError):
+                #Unpicklable exception
+                conn.send(("error", RuntimeError(repr(reply[1]))))
+            if stop.is_set():
+                #Wake up the accept loop so it sees the stop flag
+                wake = _connect(address)
+                if wake is not None:
+                    wake.close()
+                return
+
+def serve(address=None, nworkers=4):
+    """Run the worker, until a shutdown request is received."""
+    if address is None:
+        address = default_address()
+    _private_dir(address)
+    if os.path.exists(address):
+        if ping(address):
+            raise RuntimeError("CLASS worker already running at "+address)
+        os.remove(address)
+    authkey = _write_key(address)
+    #Clients authenticate in their own thread, so a client which never answers does not block the others.
+    listener = Listener(address, family="AF_UNIX")
+    os.chmod(address, 0o600)
+    stop = threading.Event()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nworkers, initializer=_load_class) as pool:
+            while not stop.is_set():
+                conn = listener.accept()
+                threading.Thread(target=_handle, args=(conn, pool, stop, address, authkey), daemon=True).start()
+    finally:
+        listener.close()
+        os.remove(key_file(address))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nworkers', type=int, default=4, help='Number of CLASS processes', required=False)
+    parser.add_argument('--address', type=str, default=None, help='Socket path', required=False)
+    parser.add_argument('--stop', action='store_true', help='Stop a running worker')
+    args = parser.parse_args()
+    if args.stop:
+        shutdown(args.address)
+    else:
+        serve(args.address, nworkers=args.nworkers)
@@ -1,11 +1,24 @@
 """Specialised module to contain functions to specialise the simulation run to different clusters"""
+import math
 import os.path
+import shutil
+from . import remake
 
 class ClusterClass:
     """Generic class implementing some general defaults for cluster submissions."""
-    def __init__(self, gadget="MP-Gadget", genic="MP-GenIC", param="mpgadget.param", genicparam="_genic_params.ini", nproc=256, timelimit=24):
+    #MPI processes (nproc) per node, to convert between nproc and nodes.
+    nproc_per_node = 16
+    #Largest number of nodes a job may use. None for no limit.
+    max_nodes = None
+    #True if the scheduler is PBS Pro rather than Torque (only matters for PBS job arrays).
+    pbs_pro = False
+
+    def __init__(self, gadget="MP-Gadget", genic="MP-GenIC", param="mpgadget.param", genicparam="_genic_params.ini", nproc=256, timelimit=24, telemetry=False, chain=0):
         """CPU parameters (walltime, number of cpus, etc):
-        these are specified to a default here, but should be over-ridden in a machine-specific decorator."""
+        these are specified to a default here, but should be over-ridden in a machine-specific decorator.
+        If telemetry is True, the submission scripts record the cost of each job (see telemetry.py).
+        If chain > 0, a Gadget job which stops before TimeMax resubmits itself with the restart flag,
+        up to chain times (see jobchain.py)."""
         self.nproc = nproc
         self.email = "sbird@ucr.edu"
         self.timelimit = timelimit
@@ -15,6 +28,8 @@ class ClusterClass:
         self.gadgetparam = param
         self.genicexe=genic
         self.genicparam=genicparam
+        self.telemetry = telemetry
+        self.chain = chain
 
     def generate_mpi_submit(self, outdir):
         """Generate a sample mpi_submit file.
@@ -24,7 +39,15 @@ class ClusterClass:
         with open(os.path.join(outdir, "mpi_submit"),'w') as mpis:
             mpis.write("#!/bin/bash\n")
             mpis.write(self._queue_directive(name, timelimit=self.timelimit, nproc=self.nproc))
-            mpis.write(self._mpi_program(command=self.gadgetexe+" "+self.gadgetparam))
+            mpis.write(self._instrument(self._mpi_program(command=self.gadgetexe+" "+self.gadgetparam), stage="gadget"))
+        self._copy_telemetry(outdir)
+        if self.chain > 0:
+            shutil.copy(os.path.join(os.path.dirname(__file__),"jobchain.py"), os.path.join(outdir,"jobchain.py"))
+            #A new script starts a new chain
+            try:
+                os.remove(os.path.join(outdir, ".chain_count"))
+            except FileNotFoundError:
+                pass
 
     def generate_mpi_submit_genic(self, outdir, extracommand=None):
         """Generate a sample mpi_submit file for MP-GenIC.
@@ -34,9 +57,84 @@ class ClusterClass:
         with open(os.path.join(outdir, "mpi_submit_genic"),'w') as mpis:
             mpis.write("#!/bin/bash\n")
             mpis.write(self._queue_directive(name, timelimit=0.5, nproc=self.nproc))
-            mpis.write(self._mpi_program(command=self.genicexe+" "+self.genicparam))
+            mpis.write(self._instrument(self._mpi_program(command=self.genicexe+" "+self.genicparam), stage="genic"))
             if extracommand is not None:
                 mpis.write(extracommand+"\n")
+        self._copy_telemetry(outdir)
+
+    def generate_prep_submit(self, outdir, designfile, timelimit=4):
+        """Generate a submission script which prepares a suite with MPI, one design slice per rank (see mpiprep.py).
+        The script is written to outdir and run there."""
+        name = os.path.basename(os.path.normpath(outdir))+"_prep"
+        with open(os.path.join(outdir, "mpi_submit_prep"),'w') as mpis:
+            mpis.write("#!/bin/bash\n")
+            mpis.write(self._queue_directive(name, timelimit=timelimit, nproc=self.nproc))
+            mpis.write(self._mpi_program(command="python -m SimulationRunner.mpiprep "+designfile))
+
+    def generate_array_submit(self, outdir, rundirs, script_file="mpi_submit", timelimit=None, max_concurrent=None):
+        """Generate a job array script in outdir which runs script_file in each of rundirs, so a suite is launched
+        with one submission (see remake.write_array_submit). Each task has the resources of a single run on this cluster:
+        use timelimit=0.5 for mpi_submit_genic. Returns the path of the script, which is named script_file+"_array",
+        or None if rundirs is empty."""
+        if not rundirs:
+            return None
+        if timelimit is None:
+            timelimit = self.timelimit
+        name = os.path.basename(os.path.normpath(outdir))
+        directives = remake.directive_lines(self._queue_directive(name, timelimit=timelimit, nproc=self.nproc))
+        return remake.write_array_submit(outdir, rundirs, directives, script_file=script_file, array_file=script_file+"_array", name=name, max_concurrent=max_concurrent, pbs_pro=self.pbs_pro)
+
+    def _instrument(self, program, stage):
+        """Wrap the program lines of a submission script so that the job writes a telemetry record
+        with its start and end time and exit status, and so that a Gadget job which exits cleanly
+        resubmits itself if chaining is on. Does nothing unless one of these is on."""
+        chain = self.chain > 0 and stage == "gadget"
+        if not self.telemetry and not chain:
+            return program
+        qstring = ""
+        if self.telemetry:
+            qstring += "SR_START=$(date +%s.%N)\n"
+        qstring += program
+        qstring += "SR_STATUS=$?\n"
+        if self.telemetry:
+            qstring += "python telemetry.py --stage "+stage+" --start $SR_START --end $(date +%s.%N) --status $SR_STATUS --nproc "+str(self.nproc)+"\n"
+        if chain:
+            qstring += "if [ $SR_STATUS -eq 0 ]; then\n"
+            qstring += "    python jobchain.py --script mpi_submit --paramfile "+self.gadgetparam+" --max-chain "+str(self.chain)+"\n"
+            qstring += "fi\n"
+        #The job exits with the status of the program, not of the telemetry or chaining.
+        qstring += "exit $SR_STATUS\n"
+        return qstring
+
+    def nodes(self):
+        """Number of nodes used by a job."""
+        return max(1, int(self.nproc // self.nproc_per_node))
+
+    def set_resources(self, node_hours, safety=1.2, max_nodes=None):
+        """Set the node count and time limit from a predicted cost.
+        The node count is kept unless the simulation would not fit in the time limit,
+        in which case it is increased (up to max_nodes, or the cluster's own max_nodes).
+        The node count never exceeds the cluster's max_nodes. The time limit is then reduced
+        to the predicted wall time times the safety factor, rounded up to a quarter hour.
+        Returns (nodes, timelimit)."""
+        needed = node_hours * safety
+        nodes = self.nodes()
+        limits = [mm for mm in (max_nodes, self.max_nodes) if mm is not None]
+        newnodes = nodes
+        if needed / nodes > self.timelimit and limits:
+            newnodes = max(nodes, min(min(limits), int(math.ceil(needed / self.timelimit))))
+        if self.max_nodes is not None:
+            newnodes = min(newnodes, self.max_nodes)
+        if newnodes != nodes:
+            nodes = newnodes
+            self.nproc = nodes * self.nproc_per_node
+        self.timelimit = min(self.timelimit, max(0.5, math.ceil(4 * needed / nodes) / 4.))
+        return nodes, self.timelimit
+
+    def _copy_telemetry(self, outdir):
+        """Copy the telemetry recording script into the run directory."""
+        if self.telemetry:
+            shutil.copy(os.path.join(os.path.dirname(__file__),"telemetry.py"), os.path.join(outdir,"telemetry.py"))
 
     def _mpi_program(self, command):
         """String for MPI program to execute"""
@@ -85,6 +183,8 @@ class ClusterClass:
 class HipatiaClass(ClusterClass):
     """Subclassed for specific properties of the Hipatia cluster in Barcelona.
     __init__ and _queue_directive are changed."""
+    nproc_per_node = 16
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.memory = 2500
@@ -112,6 +212,8 @@ class MARCCClass(ClusterClass):
     This has 24 cores per node, shared memory of 128GB pr node.
     Ask for complete nodes.
     Uses SLURM."""
+    nproc_per_node = 24
+
     def __init__(self, *args, nproc=48,timelimit=8,**kwargs):
         #Complete nodes!
         assert nproc % 24 == 0
@@ -157,6 +259,8 @@ class BIOClass(ClusterClass):
     This has 32 cores per node, shared memory of 128GB per node.
     Ask for complete nodes.
     Uses SLURM."""
+    nproc_per_node = 32
+
     def __init__(self, *args, nproc=256,timelimit=2,**kwargs):
         #Complete nodes!
         assert nproc % 32 == 0
@@ -208,15 +312,18 @@ class BIOClass(ClusterClass):
         name = os.path.basename(os.path.normpath(outdir))
         with open(os.path.join(outdir, "spectra_submit"),'w') as mpis:
             mpis.write("#!/bin/bash\n")
-            mpis.write("""#SBATCH --partition=short\n#SBATCH --job-name="""+pdir+"\n")
+            mpis.write("""#SBATCH --partition=short\n#SBATCH --job-name="""+name+"\n")
             mpis.write("""#SBATCH --time=1:55:00\n#SBATCH --nodes=1\n#SBATCH --ntasks-per-node=1\n#SBATCH --cpus-per-task=32\n#SBATCH --mem-per-cpu=4G\n""")
             mpis.write( """#SBATCH --mail-type=end\n#SBATCH --mail-user=sbird@ucr.edu\nexport OMP_NUM_THREADS=32\n""")
-            mpis.write("python flux_power.py "+pdir+"/output\n")
+            mpis.write("python flux_power.py output\n")
 
 class StampedeClass(ClusterClass):
     """Subclassed for Stampede2's Skylake nodes.
     This has 48 cores (96 threads) per node, each with two sockets, shared memory of 192GB per node, 96 GB per socket.
     Charged in node-hours, uses SLURM and icc."""
+    #nproc is the number of nodes
+    nproc_per_node = 1
+
     def __init__(self, *args, nproc=2,timelimit=3,**kwargs):
         super().__init__(*args, nproc=nproc,timelimit=timelimit, **kwargs)
 
@@ -229,7 +336,7 @@ class StampedeClass(ClusterClass):
         qstring += prefix+" --nodes="+str(int(nproc))+"\n"
         #Number of tasks (processes) per node:
         #currently optimal is 2 processes per socket.
-        qstring += prefix+" --ntasks-per-node="+int(ntasks)+"\n"
+        qstring += prefix+" --ntasks-per-node="+str(int(ntasks))+"\n"
         qstring += prefix+" --mail-type=end\n"
         qstring += prefix+" --mail-user="+self.email+"\n"
         qstring += prefix+"-A TG-ASTJOBID\n"
@@ -268,6 +375,10 @@ class StampedeClass(ClusterClass):
 
 class HypatiaClass(ClusterClass):
     """Subclass for Hypatia cluster in UCL"""
+    #Jobs run on a single shared-memory node
+    nproc_per_node = 256
+    max_nodes = 1
+
     def _queue_directive(self, name, timelimit, nproc=256, prefix="#PBS"):
         """Generate Hypatia-specific mpi_submit"""
         _ = timelimit
@@ -0,0 +1,148 @@
+"""Module to estimate how long running simulations will take to finish.
+
+The wall-clock time used so far is fit as a function of log(scale factor) and extrapolated to TimeMax.
+The history comes from cpu.txt if it is available, otherwise from the modification times of the snapshots."""
+
+import glob
+import math
+import os
+import os.path
+import re
+import configobj
+import numpy as np
+from . import cpulog
+from . import remake
+
+def _read_limits(odir, paramfile="mpgadget.param"):
+    """Get the final scale factor and the per-job wall time limit (in seconds) from the parameter file."""
+    config = configobj.ConfigObj(os.path.join(odir, paramfile))
+    return float(config['TimeMax']), float(config['TimeLimitCPU'])
+
+def count_nodes(odir, script_file="mpi_submit"):
+    """Get the number of nodes requested by a submission script.
+    Understands SLURM --nodes= and PBS nodes= directives. Returns 1 if neither is found."""
+    try:
+        with open(os.path.join(odir, script_file), 'r') as fh:
+            for line in fh:
+                mm = re.search(r"^#.*nodes=([0-9]+)", line)
+                if mm is not None:
+                    return int(mm.group(1))
+    except FileNotFoundError:
+        pass
+    return 1
+
+def snapshot_history(odir, output_file="output", snap="PART_", max_gap=None):
+    """Scale factor and wall-clock time (relative to the first snapshot) at which each snapshot was written.
+    The modification times include any time spent waiting in the queue between restarts.
+    If max_gap (eg, the job time limit in seconds) is given, an interval between snapshots longer than this
+    must span a queue wait: it is dropped, and replaced by the mean rate per e-fold of the other intervals."""
+    written = glob.glob(os.path.join(os.path.join(odir, output_file), snap+"[0-9][0-9][0-9]"))
+    times = []
+    for wr in written:
+        header = os.path.join(wr, "Header/attr-v2")
+        try:
+            times.append((1./(1+remake._get_redshift_snapshot(wr)), os.stat(header).st_mtime))
+        except IOError:
+            continue
+    times = np.array(sorted(times)).reshape(-1, 2)
+    if np.size(times) == 0:
+        return times[:,0], times[:,1]
+    dwall = np.diff(times[:,1])
+    if max_gap is not None:
+        dlna = np.diff(np.log(times[:,0]))
+        gap = dwall > max_gap
+        if np.any(gap) and np.any(~gap) and np.sum(dlna[~gap]) > 0:
+            dwall[gap] = np.sum(dwall[~gap]) / np.sum(dlna[~gap]) * dlna[gap]
+    return times[:,0], np.concatenate([[0.,], np.cumsum(dwall)])
+
+def fit_rate(atime, wall, window=0.5):
+    """Fit the wall-clock time per e-fold of the scale factor.
+    Only the most recent fraction 'window' of the history (in log a) is used,
+    since the cost per step rises as structure forms."""
+    lna = np.log(atime)
+    ii = np.where(lna >= lna[-1] - window*(lna[-1]-lna[0]))
+    if np.size(ii) < 2:
+        ii = slice(-2, None)
+    if np.size(lna[ii]) < 2 or lna[ii][-1] <= lna[ii][0]:
+        return np.nan
+    slope = np.polyfit(lna[ii], wall[ii], 1)[0]
+    if slope <= 0:
+        return np.nan
+    return slope
+
+def estimate_completion(odir, output_file="output", paramfile="mpgadget.param", script_file="mpi_submit", nodes=None, log=None, window=0.5):
+    """Estimate the remaining wall time, node-hours and number of jobs needed for a simulation to reach TimeMax.
+    Arguments:
+        odir - simulation directory
+        nodes - number of nodes per job. By default read from the submission script.
+        log - a cpulog.CpuLog for this run, to allow incremental updates.
+    Returns a dictionary with keys:
+        time - current scale factor
+        timemax - final scale factor
+        wallclock - wall time used so far (seconds)
+        remaining - estimated remaining wall time (seconds)
+        node_hours - estimated remaining node-hours
+        jobs - estimated number of further jobs (ie, restarts) needed."""
+    timemax, timelimit = _read_limits(odir, paramfile)
+    if nodes is None:
+        nodes = count_nodes(odir, script_file)
+    if log is None:
+        log = cpulog.load_cpu_log(odir, output_file)
+    else:
+        log.update()
+    if len(log) >= 2:
+        atime = log.time
+        wall = log.wallclock()
+    else:
+        atime, wall = snapshot_history(odir, output_file, max_gap=timelimit)
+    est = {"time": np.nan, "timemax": timemax, "wallclock": 0., "remaining": np.nan, "node_hours": np.nan, "jobs": np.nan}
+    if np.size(atime) == 0:
+        return est
+    est["time"] = atime[-1]
+    est["wallclock"] = wall[-1]
+    if atime[-1] >= timemax:
+        est.update({"remaining": 0., "node_hours": 0., "jobs": 0})
+        return est
+    if np.size(atime) < 2:
+        return est
+    rate = fit_rate(atime, wall, window=window)
+    remaining = rate * (np.log(timemax) - np.log(atime[-1]))
+    est["remaining"] = remaining
+    est["node_hours"] = remaining / 3600. * nodes
+    if np.isfinite(remaining):
+        est["jobs"] = int(math.ceil(remaining / timelimit))
+    return est
+
+def estimate_suite(rundir, output_file="output", paramfile="mpgadget.param", script_file="mpi_submit", logs=None):
+    """Estimate completion for every simulation in a suite.
+    Returns a dictionary of per-run estimates and a dictionary of suite totals.
+    Runs for which no estimate is possible are not included in the totals."""
+    rundir = os.path.expanduser(rundir)
+    odirs = glob.glob(os.path.join(rundir, "*"+os.path.sep))
+    if not odirs:
+        raise IOError(rundir +" is empty.")
+    if logs is None:
+        logs = {}
+    estimates = {}
+    for odir in odirs:
+        if not os.path.exists(os.path.join(odir, paramfile)):
+            continue
+        if odir not in logs:
+            logs[odir] = cpulog.CpuLog(os.path.join(os.path.join(odir, output_file), "cpu.txt"))
+        estimates[odir] = estimate_completion(odir, output_file=output_file, paramfile=paramfile, script_file=script_file, log=logs[odir])
+    totals = {"node_hours": 0., "jobs": 0, "unknown": 0}
+    for est in estimates.values():
+        if np.isfinite(est["node_hours"]):
+            totals["node_hours"] += est["node_hours"]
+            totals["jobs"] += est["jobs"]
+        else:
+            totals["unknown"] += 1
+    return estimates, totals
+
+def print_estimates(rundir, output_file="output"):
+    """Print the estimated remaining cost of every simulation in a suite."""
+    estimates, totals = estimate_suite(rundir, output_file)
+    for odir in sorted(estimates.keys()):
+        est = estimates[odir]
+        print(odir," : z=%.3g" % (1./est["time"]-1), "remaining node-hours: %.1f jobs: %s" % (est["node_hours"], est["jobs"]))
+    print("Total remaining node-hours: %.1f jobs: %d (%d runs unknown)" % (totals["node_hours"], totals["jobs"], totals["unknown"]))
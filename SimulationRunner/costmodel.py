@@ -0,0 +1,125 @@
+"""Module to predict the cost in node-hours of a simulation before it is run.
+
+The analytic model assumes the cost is proportional to the number of particles,
+weighted by how expensive each particle type is, times the number of e-folds of expansion simulated.
+It is normalised to a reference simulation.
+
+The fitted model corrects the analytic model using the measured cost of completed simulations,
+read from SimulationICs.json and cpu.txt."""
+
+import glob
+import json
+import math
+import os.path
+import numpy as np
+from . import outputs
+from . import completion
+
+#Cost of a reference simulation: 2x512^3 particles from z=99 to z=2.2.
+REFERENCE = {"npart": 512, "separate_gas": True, "nu_ngrid": 0, "redshift": 99, "redend": 2.2, "node_hours": 1500.}
+#Relative cost per particle of gas (hydrodynamics, cooling) and neutrino particles compared to DM.
+GAS_FACTOR = 2.
+NU_FACTOR = 1.
+
+def sim_params(sim):
+    """Extract the parameters the cost model needs from a SimulationICs object."""
+    return {"npart": sim.npart, "separate_gas": sim.separate_gas, "nu_ngrid": sim._nu_ngrid(), "redshift": sim.redshift, "redend": sim.redend, "box": sim.box, "m_nu": sim.m_nu}
+
+class AnalyticCostModel(object):
+    """Predict node-hours by scaling a reference simulation by the number of particles and e-folds simulated.
+    Arguments:
+        reference - dictionary with npart, separate_gas, nu_ngrid, redshift, redend and node_hours of a reference run.
+        gas_factor, nu_factor - cost per gas and neutrino particle relative to a DM particle."""
+    def __init__(self, reference=None, gas_factor=GAS_FACTOR, nu_factor=NU_FACTOR):
+        if reference is None:
+            reference = REFERENCE
+        self.reference = reference
+        self.gas_factor = gas_factor
+        self.nu_factor = nu_factor
+
+    def work(self, params):
+        """Amount of work (weighted particles times e-folds) for a simulation with the given parameters."""
+        counts = outputs.particle_counts(params["npart"], params["separate_gas"], params.get("nu_ngrid", 0))
+        weighted = self.gas_factor * counts[0] + counts[1] + self.nu_factor * counts[2]
+        return float(weighted) * math.log((1 + params["redshift"]) / (1 + params["redend"]))
+
+    def predict(self, params):
+        """Predicted node-hours. params is a dictionary (see sim_params) or a SimulationICs object."""
+        if not isinstance(params, dict):
+            params = sim_params(params)
+        return self.reference["node_hours"] * self.work(params) / self.work(self.reference)
+
+def json_params(odir):
+    """Cost model parameters of a finished or running simulation, from its SimulationICs.json."""
+    with open(os.path.join(odir, "SimulationICs.json"), 'r') as jsin:
+        desc = json.load(jsin)
+    params = {nn: desc[nn] for nn in ("npart", "separate_gas", "redshift", "redend", "box", "m_nu")}
+    #Neutrino particle simulations store the ratio of neutrino to DM particle grids.
+    params["nu_ngrid"] = int(desc["npart"] * desc.get("npartnufac", 0))
+    return params
+
+def measured_node_hours(odir, output_file="output"):
+    """Node-hours a simulation has used, plus the estimated node-hours it needs to finish, from cpu.txt.
+    Returns NaN if the run has not got far enough to estimate."""
+    est = completion.estimate_completion(odir, output_file=output_file)
+    return est["wallclock"] / 3600. * completion.count_nodes(odir) + est["node_hours"]
+
+def training_data(rundirs, output_file="output"):
+    """Parameters and node-hours of every simulation in a list of suite directories with usable cpu.txt files.
+    Returns a list of (parameter dictionary, node-hours)."""
+    data = []
+    for rundir in rundirs:
+        rundir = os.path.expanduser(rundir)
+        for odir in sorted(glob.glob(os.path.join(rundir, "*", "SimulationICs.json"))):
+            odir = os.path.dirname(odir)
+            try:
+                params = json_params(odir)
+                node_hours = measured_node_hours(odir, output_file)
+            except (IOError, KeyError, ValueError):
+                continue
+            if np.isfinite(node_hours) and node_hours > 0:
+                data.append((params, node_hours))
+    return data
+
+class FittedCostModel(AnalyticCostModel):
+    """Cost model learned from completed simulations.
+    The prediction is the analytic model times a correction, exp(features . coefficients), where the features are
+    the log of the particle number and box size, whether there is gas, the neutrino mass and the log of the end scale factor.
+    The coefficients are found by least squares on the log of the measured node-hours, with a ridge penalty,
+    so that with few or no training runs the model falls back to the analytic model.
+    Arguments:
+        data - list of (parameter dictionary, node-hours), as from training_data.
+        ridge - strength of the penalty on the correction coefficients.
+        Other arguments are as for AnalyticCostModel."""
+    def __init__(self, data=(), ridge=1., **kwargs):
+        super().__init__(**kwargs)
+        self.ridge = ridge
+        self.coefficients = np.zeros(6)
+        #RMS scatter in log node-hours about the fit
+        self.scatter = np.nan
+        if len(data) > 0:
+            self.fit(data)
+
+    @classmethod
+    def from_suites(cls, rundirs, output_file="output", **kwargs):
+        """Train on all simulations in a list of suite directories."""
+        return cls(training_data(rundirs, output_file), **kwargs)
+
+    def features(self, params):
+        """Features the correction depends on."""
+        return np.array([1., math.log(params["npart"]), math.log(params.get("box", 1.)), float(params["separate_gas"]), params.get("m_nu", 0.), math.log(1 + params["redend"])])
+
+    def fit(self, data):
+        """Fit the correction coefficients to a list of (parameter dictionary, node-hours)."""
+        feat = np.array([self.features(pp) for (pp, _) in data])
+        resid = np.array([math.log(nh / super(FittedCostModel, self).predict(pp)) for (pp, nh) in data])
+        penalty = self.ridge * np.eye(np.shape(feat)[1])
+        self.coefficients = np.linalg.solve(np.dot(feat.T, feat) + penalty, np.dot(feat.T, resid))
+        self.scatter = np.sqrt(np.mean((resid - np.dot(feat, self.coefficients))**2))
+        return self.coefficients
+
+    def predict(self, params):
+        """Predicted node-hours. params is a dictionary (see sim_params) or a SimulationICs object."""
+        if not isinstance(params, dict):
+            params = sim_params(params)
+        return super().predict(params) * math.exp(np.dot(self.features(params), self.coefficients))
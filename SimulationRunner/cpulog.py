@@ -0,0 +1,266 @@
+"""Module to parse the cpu.txt performance log written by MP-Gadget.
+
+Each timestep MP-Gadget appends a block of the form:
+
+Step 10, Time: 0.0123, MPIs: 64 Threads: 4 Elapsed: 123.4
+/                          123.40 100.0%   ...
+/Domain                     10.20   8.3%   ...
+/PM                         20.10  16.3%   ...
+/PM/Force                   ...
+
+The first number after each section name is the cumulative wall time spent in that section
+since the code (re)started. When the code restarts the file is appended to and the timers are reset.
+
+The parser converts the file into columnar arrays and can be re-run
+incrementally: only the bytes appended since the last read are parsed."""
+
+import os
+import os.path
+import glob
+import json
+import re
+import numpy as np
+
+#Map from a short phase name to the MP-Gadget timer sections which make it up.
+#Different MP-Gadget versions name the hydro and I/O timers differently.
+PHASES = {"pm": ("/PM",), "tree": ("/Tree",), "domain": ("/Domain",), "hydro": ("/SPH", "/Hydro"), "io": ("/Snapshot", "/IO", "/Petaio"), "fof": ("/FOF",), "cooling": ("/Cooling", "/Sfr")}
+
+_STEP_RE = re.compile(rb"^Step ([0-9]+), Time: ([-+0-9.eE]+), MPIs: ([0-9]+) Threads: ([0-9]+) Elapsed: ([-+0-9.eE]+)")
+
+class CpuLog(object):
+    """Columnar view of an MP-Gadget cpu.txt file, updated incrementally.
+
+    After update() the following arrays are available:
+        step - timestep number
+        time - scale factor
+        mpis - number of MPI ranks
+        threads - number of OpenMP threads
+        elapsed - wall time in seconds since the code (re)started
+        sections - dictionary from timer name (eg, "/PM") to cumulative seconds spent in it.
+                   NaN if the timer was not present for a step.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        #Byte offset of the first block which has not yet been completely parsed.
+        self.offset = 0
+        self._records = []
+        #The last block in the file may still be being written, so we re-read it next time.
+        self._provisional = False
+        self._arrays = None
+
+    def update(self):
+        """Parse any blocks appended to the file since the last call.
+        Returns the number of new (final or provisional) records."""
+        try:
+            size = os.stat(self.fname).st_size
+        except FileNotFoundError:
+            return 0
+        #File has been truncated or replaced: start again.
+        if size < self.offset:
+            self.offset = 0
+            self._records = []
+            self._provisional = False
+        if self._provisional:
+            self._records.pop()
+            self._provisional = False
+        with open(self.fname, 'rb') as fh:
+            fh.seek(self.offset)
+            data = fh.read()
+        #Only parse complete lines.
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._arrays = None
+            return 0
+        data = data[:end+1]
+        starts = [mm.start() for mm in re.finditer(rb"^Step ", data, flags=re.MULTILINE)]
+        new = 0
+        for i, start in enumerate(starts):
+            stop = starts[i+1] if i+1 < len(starts) else len(data)
+            record = _parse_block(data[start:stop])
+            if record is None:
+                continue
+            self._records.append(record)
+            new += 1
+            #The final block may be incomplete: it is replaced when re-read.
+            self._provisional = i+1 == len(starts)
+        if starts:
+            #Remember where the final block started, so it is re-read next time.
+            self.offset += starts[-1]
+        self._arrays = None
+        return new
+
+    def __len__(self):
+        return len(self._records)
+
+    def _build_arrays(self):
+        """Convert the list of records to columnar arrays."""
+        if self._arrays is not None:
+            return self._arrays
+        arrays = {}
+        for (ii, name) in enumerate(("step", "mpis", "threads")):
+            arrays[name] = np.array([rr[0][ii] for rr in self._records], dtype=np.int64)
+        arrays["time"] = np.array([rr[1][0] for rr in self._records])
+        arrays["elapsed"] = np.array([rr[1][1] for rr in self._records])
+        names = set()
+        for rr in self._records:
+            names.update(rr[2].keys())
+        sections = {}
+        for nn in names:
+            sections[nn] = np.array([rr[2].get(nn, np.nan) for rr in self._records])
+        arrays["sections"] = sections
+        self._arrays = arrays
+        return arrays
+
+    @property
+    def step(self):
+        """Timestep number"""
+        return self._build_arrays()["step"]
+
+    @property
+    def time(self):
+        """Scale factor"""
+        return self._build_arrays()["time"]
+
+    @property
+    def mpis(self):
+        """Number of MPI ranks"""
+        return self._build_arrays()["mpis"]
+
+    @property
+    def threads(self):
+        """Number of OpenMP threads"""
+        return self._build_arrays()["threads"]
+
+    @property
+    def elapsed(self):
+        """Wall time since the code (re)started"""
+        return self._build_arrays()["elapsed"]
+
+    @property
+    def sections(self):
+        """Dictionary of cumulative time per timer section"""
+        return self._build_arrays()["sections"]
+
+    def segments(self):
+        """Index of the first record after each (re)start of the code.
+        A restart is detected by the elapsed time decreasing."""
+        elapsed = self.elapsed
+        if np.size(elapsed) == 0:
+            return np.array([], dtype=np.int64)
+        restarts = np.where(elapsed[1:] < elapsed[:-1])[0] + 1
+        return np.concatenate([[0,], restarts])
+
+    def wallclock(self):
+        """Total wall time used at each record, summed over all restarts."""
+        return _accumulate(self.elapsed, self.segments())
+
+    def section_wallclock(self, name):
+        """Cumulative time spent in a timer section, summed over all restarts."""
+        return _accumulate(np.nan_to_num(self.sections[name]), self.segments())
+
+    def phase_totals(self, phases=None):
+        """Total seconds spent in each phase (see PHASES), summed over restarts.
+        Also includes the total elapsed time as 'total'."""
+        if phases is None:
+            phases = PHASES
+        totals = {}
+        sections = self.sections
+        for (phase, names) in phases.items():
+            totals[phase] = 0.
+            for nn in names:
+                if nn in sections:
+                    totals[phase] += self.section_wallclock(nn)[-1]
+        wall = self.wallclock()
+        totals["total"] = wall[-1] if np.size(wall) > 0 else 0.
+        return totals
+
+    def save_state(self, statefile):
+        """Save the parsed records and file offset, so that a later process can continue incrementally."""
+        state = {"fname": self.fname, "offset": self.offset, "provisional": self._provisional, "records": self._records}
+        with open(statefile, 'w') as jsout:
+            json.dump(state, jsout)
+
+    @classmethod
+    def load_state(cls, statefile):
+        """Load a CpuLog saved by save_state. Call update() to read any new data."""
+        with open(statefile, 'r') as jsin:
+            state = json.load(jsin)
+        log = cls(state["fname"])
+        log.offset = state["offset"]
+        log._provisional = state["provisional"]
+        log._records = [(tuple(rr[0]), tuple(rr[1]), rr[2]) for rr in state["records"]]
+        return log
+
+def _accumulate(values, segments):
+    """Turn a quantity which resets at each restart into a monotonic total."""
+    total = np.array(values, dtype=np.float64)
+    for nseg in segments[1:]:
+        #Everything after the restart gets the final value from before it.
+        total[nseg:] += total[nseg-1]
+    return total
+
+def _parse_block(block):
+    """Parse a single step block. Returns ((step, mpis, threads), (time, elapsed), sections),
+    or None if the header line is malformed."""
+    lines = block.split(b"\n")
+    mm = _STEP_RE.match(lines[0])
+    if mm is None:
+        return None
+    ints = (int(mm.group(1)), int(mm.group(3)), int(mm.group(4)))
+    floats = (float(mm.group(2)), float(mm.group(5)))
+    sections = {}
+    for line in lines[1:]:
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].startswith(b"/"):
+            continue
+        try:
+            sections[fields[0].decode()] = float(fields[1])
+        except ValueError:
+            continue
+    return (ints, floats, sections)
+
+def load_cpu_log(odir, output_file="output", fname="cpu.txt"):
+    """Parse the cpu.txt file for a single simulation directory."""
+    log = CpuLog(os.path.join(os.path.join(odir, output_file), fname))
+    log.update()
+    return log
+
+def suite_cpu_logs(rundir, output_file="output", fname="cpu.txt", logs=None):
+    """Parse the cpu.txt files for every simulation in a suite.
+    If logs (a dictionary returned by a previous call) is passed,
+    existing logs are updated incrementally and new directories added."""
+    rundir = os.path.expanduser(rundir)
+    odirs = glob.glob(os.path.join(rundir, "*"+os.path.sep))
+    if not odirs:
+        raise IOError(rundir +" is empty.")
+    if logs is None:
+        logs = {}
+    for odir in odirs:
+        if odir not in logs:
+            logs[odir] = CpuLog(os.path.join(os.path.join(odir, output_file), fname))
+        logs[odir].update()
+    return logs
+
+def suite_phase_table(logs, phases=None):
+    """Aggregate the phase totals for a suite of logs into one table.
+    Returns (run directories, column names, array of seconds with shape (nruns, ncolumns)).
+    The last column is the total elapsed time."""
+    if phases is None:
+        phases = PHASES
+    odirs = sorted(logs.keys())
+    columns = list(phases.keys()) + ["total",]
+    table = np.zeros((len(odirs), len(columns)))
+    for (ii, odir) in enumerate(odirs):
+        if len(logs[odir]) == 0:
+            continue
+        totals = logs[odir].phase_totals(phases)
+        table[ii,:] = [totals[cc] for cc in columns]
+    return odirs, columns, table
+
+def print_phase_table(rundir, output_file="output"):
+    """Print the fraction of the wall time spent in each phase for every run in a suite."""
+    odirs, columns, table = suite_phase_table(suite_cpu_logs(rundir, output_file))
+    print("run", *columns)
+    for (odir, row) in zip(odirs, table):
+        frac = row[:-1] / np.maximum(row[-1], 1e-30)
+        print(odir, *["%.3f" % ff for ff in frac], "%.1f" % row[-1])
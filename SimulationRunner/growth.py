@@ -0,0 +1,116 @@
+"""Module to derive CLASS transfer functions at late redshifts by rescaling, rather than extracting each one.
+
+Once the baryons have caught up with the CDM, and without massive neutrinos, the matter transfer functions
+at different redshifts differ only by the scale-independent growth factor D(z). So we extract the
+full CLASS output at the initial redshift (which must be exact, for the ICs) and at one anchor redshift,
+and rescale the anchor to the other output redshifts:
+    - density columns (d_b, d_cdm, d_tot, d_ncdm, h) by D,
+    - velocity columns (t_b, t_tot, t_ncdm, h_prime) by D f a H,
+    - potentials (phi, psi) by D / a.
+Radiation columns (d_g, d_ur, t_g, t_ur) and eta are not rescalable and are copied from the anchor:
+they are not used for late-time outputs. The linear power is rescaled by the square of the total matter column.
+
+With massive neutrinos the growth is scale-dependent, so we extract two anchors, at the highest and lowest
+late redshifts, and interpolate each column between them with a k-dependent exponent in ln D:
+    T(k, z) = T(k, z_1) (T(k, z_2) / T(k, z_1))^x,  x = ln(D(z)/D(z_1)) / ln(D(z_2)/D(z_1)).
+
+The result is checked against a full CLASS extraction at one redshift which is not an anchor.
+If it does not agree, every redshift is extracted in full."""
+
+import numpy as np
+from . import classworker
+
+#Columns which are not rescaled
+_FIXED = ("k", "d_g", "d_ur", "t_g", "t_ur", "eta", "eta_prime")
+
+def column_kind(name):
+    """How a transfer function column scales with redshift: 'density', 'velocity', 'potential' or 'fixed'."""
+    if name in _FIXED:
+        return "fixed"
+    if name in ("phi", "psi"):
+        return "potential"
+    if name.startswith("t_") or name == "h_prime":
+        return "velocity"
+    if name.startswith("d_") or name == "h":
+        return "density"
+    return "fixed"
+
+def growth_ratios(back, zz, zanchor):
+    """Ratios of the density, velocity and potential growth between redshift zz and the anchor.
+    back is a growth table from classworker.compute_background."""
+    table = {key: dict(zip(back["z"], back[key])) for key in ("D", "f", "E")}
+    (D1, f1, E1) = (table["D"][zz], table["f"][zz], table["E"][zz])
+    (D0, f0, E0) = (table["D"][zanchor], table["f"][zanchor], table["E"][zanchor])
+    (a1, a0) = (1./(1+zz), 1./(1+zanchor))
+    return {"density": D1 / D0, "velocity": (D1 * f1 * a1 * E1) / (D0 * f0 * a0 * E0), "potential": (D1 / a1) / (D0 / a0), "fixed": 1.}
+
+def rescale(trans, pk_lin, ratios):
+    """Rescale a transfer function (structured array) and linear power from an anchor redshift, given growth ratios."""
+    new = np.array(trans, copy=True)
+    for name in trans.dtype.names:
+        new[name] = trans[name] * ratios[column_kind(name)]
+    return new, pk_lin * ratios["density"]**2
+
+def interpolate(anchor1, anchor2, xx):
+    """Interpolate transfer functions and linear power between two anchors, with a k-dependent exponent.
+    xx is the fractional distance in ln D from the first anchor to the second.
+    Columns which change sign between the anchors are interpolated linearly."""
+    (trans1, pk1) = anchor1
+    (trans2, pk2) = anchor2
+    new = np.array(trans1, copy=True)
+    for name in trans1.dtype.names:
+        if name == "k":
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = trans2[name] / trans1[name]
+        good = np.isfinite(ratio) * (ratio > 0)
+        new[name] = np.where(good, trans1[name] * np.abs(ratio)**xx, trans1[name] + xx * (trans2[name] - trans1[name]))
+    return new, pk1 * (pk2 / pk1)**xx
+
+def _agrees(approx, exact, rtol):
+    """Check a rescaled transfer function and power spectrum against a full extraction.
+    Only the matter columns and the power are checked."""
+    (trans, pk_lin) = approx
+    (trans_ex, pk_ex) = exact
+    if np.max(np.abs(pk_lin / pk_ex - 1)) > rtol:
+        return False
+    for name in trans.dtype.names:
+        if column_kind(name) != "density" or name == "h":
+            continue
+        scale = np.max(np.abs(trans_ex[name]))
+        if scale > 0 and np.max(np.abs(trans[name] - trans_ex[name])) > rtol * scale:
+            return False
+    return True
+
+def rescaled_linear(params, redshifts, massive_nu=False, rtol=2e-3):
+    """Transfer functions and linear power at each redshift, extracting CLASS output only at the first (initial) redshift,
+    the anchor(s) and a check redshift, and rescaling the rest. Falls back to a full extraction if the check fails.
+    Returns (list of (transfer function, linear power) for each redshift, True if rescaling was used)."""
+    zinit = redshifts[0]
+    late = sorted(set([zz for zz in redshifts if zz != zinit]), reverse=True)
+    nanchor = 2 if massive_nu else 1
+    if len(late) <= nanchor + 1:
+        return classworker.compute_linear(params, redshifts), False
+    anchors = [late[0], late[-1]] if massive_nu else [late[-1],]
+    back = classworker.compute_background(params, late)
+    lnD = dict(zip(back["z"], np.log(back["D"])))
+    #Check at the redshift furthest (in ln D) from the anchors.
+    others = [zz for zz in late if zz not in anchors]
+    check = others[np.argmax([min([abs(lnD[zz] - lnD[aa]) for aa in anchors]) for zz in others])]
+    extract = [zinit,] + anchors + [check,]
+    exact = dict(zip(extract, classworker.compute_linear(params, extract)))
+    derived = {}
+    for zz in late:
+        if zz in anchors:
+            derived[zz] = exact[zz]
+        elif massive_nu:
+            xx = (lnD[zz] - lnD[anchors[0]]) / (lnD[anchors[1]] - lnD[anchors[0]])
+            derived[zz] = interpolate(exact[anchors[0]], exact[anchors[1]], xx)
+        else:
+            derived[zz] = rescale(exact[anchors[0]][0], exact[anchors[0]][1], growth_ratios(back, zz, anchors[0]))
+    if not _agrees(derived[check], exact[check], rtol):
+        print("Rescaled transfer function at z=",check," does not match CLASS: extracting all redshifts")
+        return classworker.compute_linear(params, redshifts), False
+    derived[check] = exact[check]
+    derived[zinit] = exact[zinit]
+    return [derived[zz] for zz in redshifts], True
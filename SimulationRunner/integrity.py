@@ -0,0 +1,172 @@
+"""Module to check that BigFile snapshots and initial conditions were completely written.
+
+A snapshot written when the job ran out of wall time may be truncated.
+Restarting from it wastes a full queue wait, so we check:
+    - that the Header exists and every particle type with particles has a Position block.
+    - that each block contains TotNumPart rows and each data file has the size given in the block header.
+    - optionally, that the checksum of each data file matches the one in the block header.
+
+BigFile block headers have the format:
+DTYPE: <f8
+NMEMB: 3
+NFILE: 2
+000000: 50 : 154078 : 23008
+000001: 50 : 155518 : 24448
+where each file line is: file number (hex) : number of rows : sum of all bytes : folded checksum.
+
+Results are cached in a JSON file next to the snapshots, keyed by the modification times of the block headers."""
+
+import concurrent.futures
+import json
+import os
+import os.path
+import re
+import numpy as np
+
+_CACHE_NAME = ".integrity.json"
+
+def read_header_attrs(snapdir, header="Header"):
+    """Read all attributes of a BigFile block (by default the snapshot Header).
+    Returns a dictionary from attribute name to numpy array (or string)."""
+    attrs = {}
+    with open(os.path.join(os.path.join(snapdir, header), "attr-v2"), 'r') as fh:
+        for line in fh:
+            mm = re.match(r"^(\S+) (\S+) ([0-9]+) ([0-9A-Fa-f]*) #HUMANE \[ (.*) \]", line)
+            if mm is None:
+                continue
+            (name, dtype, _, hexdata, humane) = mm.groups()
+            try:
+                value = np.frombuffer(bytes.fromhex(hexdata), dtype=np.dtype(dtype))
+                if value.dtype.kind == 'S':
+                    value = value.tobytes().decode().rstrip('\0')
+            except (TypeError, ValueError):
+                value = humane
+            attrs[name] = value
+    return attrs
+
+def read_block_header(blockdir):
+    """Read the header of a BigFile block.
+    Returns (dtype, nmemb, list of (data file name, rows, byte sum))."""
+    with open(os.path.join(blockdir, "header"), 'r') as fh:
+        lines = fh.readlines()
+    dtype = np.dtype(lines[0].split(":")[1].strip())
+    nmemb = int(lines[1].split(":")[1])
+    nfile = int(lines[2].split(":")[1])
+    files = []
+    for line in lines[3:3+nfile]:
+        fields = line.split(":")
+        files.append((fields[0].strip(), int(fields[1]), int(fields[2])))
+    if len(files) != nfile:
+        raise IOError("Truncated header for "+blockdir)
+    return dtype, nmemb, files
+
+def _blocks(snapdir):
+    """List all (particle type, block directory) pairs in a snapshot."""
+    blocks = []
+    for ptype in os.scandir(snapdir):
+        if not ptype.is_dir() or not ptype.name.isdigit():
+            continue
+        for block in os.scandir(ptype.path):
+            if block.is_dir():
+                blocks.append((int(ptype.name), block.path))
+    return blocks
+
+def _signature(snapdir, blocks):
+    """Modification times of everything which changes when a snapshot is (re)written."""
+    mtimes = [os.stat(os.path.join(snapdir, "Header/attr-v2")).st_mtime]
+    for (_, blockdir) in blocks:
+        try:
+            mtimes.append(os.stat(os.path.join(blockdir, "header")).st_mtime)
+        except FileNotFoundError:
+            mtimes.append(-1)
+    return [len(blocks), max(mtimes)]
+
+def file_checksum(fname, blocksize=1<<24):
+    """Sum of all bytes in a file, modulo 2^32, as stored in BigFile block headers."""
+    total = 0
+    with open(fname, 'rb') as fh:
+        data = fh.read(blocksize)
+        while data:
+            total += int(np.frombuffer(data, dtype=np.uint8).sum(dtype=np.uint64))
+            data = fh.read(blocksize)
+    return total % 2**32
+
+def _check_block(ptype, blockdir, totnumpart):
+    """Check the file sizes of a single block against its header and the particle count.
+    Returns (list of problems, list of (data file, expected checksum))."""
+    problems = []
+    try:
+        (dtype, nmemb, files) = read_block_header(blockdir)
+    except (IOError, IndexError, ValueError):
+        return (["bad header: "+blockdir], [])
+    rows = sum([ff[1] for ff in files])
+    if ptype < np.size(totnumpart) and rows != totnumpart[ptype]:
+        problems.append(blockdir+": "+str(rows)+" rows, expected "+str(totnumpart[ptype]))
+    checks = []
+    for (fname, nrow, checksum) in files:
+        path = os.path.join(blockdir, fname)
+        expected = nrow * nmemb * dtype.itemsize
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            problems.append(path+": missing")
+            continue
+        if size != expected:
+            problems.append(path+": "+str(size)+" bytes, expected "+str(expected))
+            continue
+        checks.append((path, checksum))
+    return (problems, checks)
+
+def verify_snapshot(snapdir, checksum=False, nworkers=8):
+    """Check a snapshot (or IC) directory. Returns a list of problems, empty if it looks complete."""
+    try:
+        attrs = read_header_attrs(snapdir)
+        totnumpart = np.array(attrs["TotNumPart"], dtype=np.int64)
+    except (IOError, KeyError) as err:
+        return ["bad Header: "+str(err)]
+    blocks = _blocks(snapdir)
+    problems = []
+    checks = []
+    for ptype in np.where(totnumpart > 0)[0]:
+        if not os.path.isdir(os.path.join(os.path.join(snapdir, str(ptype)), "Position")):
+            problems.append(snapdir+": no Position for type "+str(ptype))
+    for (ptype, blockdir) in blocks:
+        (bprob, bcheck) = _check_block(ptype, blockdir, totnumpart)
+        problems += bprob
+        checks += bcheck
+    if checksum and not problems:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as pool:
+            sums = pool.map(file_checksum, [cc[0] for cc in checks])
+            for ((path, expected), actual) in zip(checks, sums):
+                if expected != actual:
+                    problems.append(path+": checksum "+str(actual)+", expected "+str(expected))
+    return problems
+
+def snapshot_ok(snapdir, checksum=False, nworkers=8, use_cache=True):
+    """Check whether a snapshot is complete, using a cached result if nothing has changed since the last check."""
+    snapdir = os.path.normpath(snapdir)
+    if not os.path.exists(os.path.join(snapdir, "Header/attr-v2")):
+        return False
+    cachefile = os.path.join(os.path.dirname(snapdir), _CACHE_NAME)
+    name = os.path.basename(snapdir)
+    signature = _signature(snapdir, _blocks(snapdir))
+    cache = {}
+    if use_cache:
+        try:
+            with open(cachefile, 'r') as jsin:
+                cache = json.load(jsin)
+        except (IOError, ValueError):
+            cache = {}
+        entry = cache.get(name)
+        #A checksummed result is also good for a check without checksums.
+        if entry is not None and entry["signature"] == signature and (entry["checksum"] or not checksum):
+            return entry["problems"] == []
+    problems = verify_snapshot(snapdir, checksum=checksum, nworkers=nworkers)
+    if use_cache:
+        cache[name] = {"signature": signature, "checksum": checksum, "problems": problems}
+        try:
+            with open(cachefile, 'w') as jsout:
+                json.dump(cache, jsout)
+        except IOError:
+            pass
+    return problems == []
@@ -0,0 +1,140 @@
+"""Module containing a stand-alone script which chains simulation jobs through the queue.
+
+A submission script generated with chaining on calls this script when MP-Gadget exits cleanly.
+If the simulation has not yet reached TimeMax (ie, it stopped because of TimeLimitCPU),
+it writes a copy of the submission script with the restart flag and latest snapshot number added
+to the MP-Gadget command line, and submits it. The number of jobs in a chain is limited.
+
+For testing, the submit command 'fake' appends the script to a local queue file,
+which run_fake_queue then executes in order."""
+import argparse
+import glob
+import os
+import os.path
+import re
+import shutil
+import subprocess
+
+_COUNT_FILE = ".chain_count"
+_FAKE_QUEUE = ".fake_queue"
+
+def last_time(outdir, output_file="output", fname="cpu.txt"):
+    """Scale factor of the last step recorded in cpu.txt, or 0 if there is none."""
+    try:
+        with open(os.path.join(os.path.join(outdir, output_file), fname), 'rb') as fh:
+            fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, fh.tell() - 2**16))
+            data = fh.read().decode(errors='ignore')
+    except FileNotFoundError:
+        return 0.
+    times = re.findall(r"Step [0-9]*, Time: ([-+0-9.eE]*)", data)
+    if not times:
+        return 0.
+    return float(times[-1])
+
+def time_max(outdir, paramfile="mpgadget.param"):
+    """Final scale factor from the MP-Gadget parameter file."""
+    with open(os.path.join(outdir, paramfile), 'r') as fh:
+        for line in fh:
+            mm = re.match(r"\s*TimeMax\s*=\s*(\S+)", line)
+            if mm is not None:
+                return float(mm.group(1))
+    raise IOError("No TimeMax in "+paramfile)
+
+def find_snap(outdir, output_file="output", snap="PART_"):
+    """Number of the last written snapshot, or None if there are none."""
+    written = glob.glob(os.path.join(os.path.join(outdir, output_file), snap+"[0-9][0-9][0-9]"))
+    if not written:
+        return None
+    return max([int(re.search(snap+"([0-9][0-9][0-9])", wr).group(1)) for wr in written])
+
+def restart_script(script, paramfile, rest):
+    """Add the restart arguments after the parameter file on the MPI launch line of a submission script."""
+    lines = []
+    found = False
+    for line in script.splitlines(True):
+        if re.search("mpirun|mpiexec|ibrun", line):
+            nline = re.sub(re.escape(paramfile), paramfile+rest, line)
+            found = found or nline != line
+            line = nline
+        lines.append(line)
+    if not found:
+        raise ValueError("No MPI launch line with "+paramfile+" found")
+    return "".join(lines)
+
+def detect_submit():
+    """Auto-detect the submission command."""
+    for cmd in ('sbatch', 'qsub'):
+        if shutil.which(cmd) is not None:
+            return cmd
+    raise ValueError("Could not find sbatch or qsub")
+
+def chain_count(outdir):
+    """Number of jobs submitted by the chain so far."""
+    try:
+        with open(os.path.join(outdir, _COUNT_FILE), 'r') as fh:
+            return int(fh.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def chain(outdir=".", script_file="mpi_submit", paramfile="mpgadget.param", max_chain=10, restart=2, submit_command=None, output_file="output", snap="PART_"):
+    """Submit the next job in the chain, if the simulation is not finished.
+    Returns 'finished', 'limit' (maximum chain length reached) or 'submitted'."""
+    if last_time(outdir, output_file) >= time_max(outdir, paramfile)*(1-1e-6):
+        return "finished"
+    count = chain_count(outdir)
+    if count >= max_chain:
+        print("Chain limit of ",max_chain," jobs reached: not resubmitting")
+        return "limit"
+    rest = " "+str(restart)
+    if restart == 2:
+        snapnum = find_snap(outdir, output_file, snap)
+        if snapnum is None:
+            raise IOError("No snapshot to restart from in "+outdir)
+        rest += " "+str(snapnum)
+    with open(os.path.join(outdir, script_file), 'r') as fh:
+        script = restart_script(fh.read(), paramfile, rest)
+    script_chain = script_file+"_chain"
+    with open(os.path.join(outdir, script_chain), 'w') as fh:
+        fh.write(script)
+    with open(os.path.join(outdir, _COUNT_FILE), 'w') as fh:
+        fh.write(str(count+1))
+    if submit_command is None:
+        submit_command = os.environ.get("SR_SUBMIT", None)
+    if submit_command is None:
+        submit_command = detect_submit()
+    if submit_command == "fake":
+        with open(os.path.join(outdir, _FAKE_QUEUE), 'a') as fh:
+            fh.write(script_chain+"\n")
+    else:
+        subprocess.check_call([submit_command, script_chain], cwd=outdir)
+    return "submitted"
+
+def run_fake_queue(outdir, script_file="mpi_submit", max_jobs=100):
+    """A fake scheduler for testing: run the submission script, then every job it queues, in order.
+    Jobs are run with bash in outdir, with SR_SUBMIT=fake so that they queue further jobs here.
+    Returns the list of scripts which were run."""
+    env = dict(os.environ)
+    env["SR_SUBMIT"] = "fake"
+    queue = os.path.join(outdir, _FAKE_QUEUE)
+    ran = []
+    pending = [script_file,]
+    while pending and len(ran) < max_jobs:
+        job = pending.pop(0)
+        subprocess.call(["bash", job], cwd=outdir, env=env)
+        ran.append(job)
+        if os.path.exists(queue):
+            with open(queue, 'r') as fh:
+                pending += [line.strip() for line in fh if line.strip()]
+            os.remove(queue)
+    return ran
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--script', type=str, default="mpi_submit", help='Submission script to resubmit', required=False)
+    parser.add_argument('--paramfile', type=str, default="mpgadget.param", help='MP-Gadget parameter file', required=False)
+    parser.add_argument('--max-chain', type=int, default=10, help='Maximum number of chained jobs', required=False)
+    parser.add_argument('--restart', type=int, default=2, help='MP-Gadget RestartFlag', required=False)
+    parser.add_argument('--submit', type=str, default=None, help='Submission command (sbatch, qsub or fake)', required=False)
+    args = parser.parse_args()
+    chain(".", script_file=args.script, paramfile=args.paramfile, max_chain=args.max_chain, restart=args.restart, submit_command=args.submit)
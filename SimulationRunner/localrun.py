@@ -0,0 +1,156 @@
+"""Module to run small simulations on the local machine, without a batch queue.
+
+Each prepared simulation directory (as made by SimulationICs.make_simulation) is run through
+MP-GenIC, the IC power spectrum check and MP-Gadget. Several simulations run concurrently,
+as long as the total number of cores in use stays within a budget.
+Output of each stage is appended to a log file in the simulation directory."""
+
+import asyncio
+import os
+import os.path
+import re
+import sys
+import configobj
+
+class LocalExecutor(object):
+    """Run prepared simulation directories concurrently on the local machine.
+    Arguments:
+        total_cores - maximum number of cores in use at once.
+        mpirun - MPI launcher. If None, programs are run directly, with one process.
+        genic - path to the MP-GenIC binary. By default MP-GenIC in the simulation directory,
+                or ~/codes/MP-Gadget/genic/MP-GenIC if there is none.
+        gadget - path to the MP-Gadget binary. By default MP-Gadget in the simulation directory.
+        stages - which of "genic", "check" (the IC power spectrum check) and "gadget" to run.
+        logname - name of the log file in each simulation directory."""
+    def __init__(self, total_cores, mpirun="mpirun", genic=None, gadget=None, stages=("genic", "check", "gadget"), genicparam="_genic_params.ini", gadgetparam="mpgadget.param", logname="local_run.log"):
+        assert total_cores > 0
+        self.total_cores = total_cores
+        self.mpirun = mpirun
+        self.genic = genic
+        self.gadget = gadget
+        self.stages = stages
+        self.genicparam = genicparam
+        self.gadgetparam = gadgetparam
+        self.logname = logname
+        self._free = total_cores
+        self._cond = None
+        self._loop = None
+        self._tasks = []
+
+    def _binary(self, rundir, given, name, default):
+        """Find the binary to run."""
+        if given is not None:
+            return given
+        local = os.path.join(rundir, name)
+        if os.path.exists(local):
+            return local
+        return os.path.expanduser(default)
+
+    def _launch(self, nproc, command):
+        """Prefix a command with the MPI launcher."""
+        if self.mpirun is None:
+            return command
+        return [self.mpirun, "-np", str(nproc)] + command
+
+    def commands(self, rundir, nproc):
+        """The list of (stage, command) to run for a simulation directory."""
+        commands = []
+        if "genic" in self.stages:
+            genic = self._binary(rundir, self.genic, "MP-GenIC", "~/codes/MP-Gadget/genic/MP-GenIC")
+            commands.append(("genic", self._launch(nproc, [genic, self.genicparam])))
+        if "check" in self.stages:
+            commands.append(("check", [sys.executable, "cambpower.py"] + _check_ics_args(os.path.join(rundir, self.genicparam))))
+        if "gadget" in self.stages:
+            gadget = self._binary(rundir, self.gadget, "MP-Gadget", "~/codes/MP-Gadget/gadget/MP-Gadget")
+            commands.append(("gadget", self._launch(nproc, [gadget, self.gadgetparam])))
+        return commands
+
+    async def _acquire(self, nproc):
+        """Wait until nproc cores are free, then take them."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._free >= nproc)
+            self._free -= nproc
+
+    async def _release(self, nproc):
+        """Return cores to the pool."""
+        async with self._cond:
+            self._free += nproc
+            self._cond.notify_all()
+
+    async def _run_stage(self, rundir, logfile, stage, command, ncores):
+        """Run one stage on ncores cores, once they are free. Returns the exit code."""
+        await self._acquire(ncores)
+        try:
+            logfile.write("#Running "+stage+": "+" ".join(command)+"\n")
+            logfile.flush()
+            proc = await asyncio.create_subprocess_exec(*command, cwd=rundir, stdout=logfile, stderr=asyncio.subprocess.STDOUT)
+            try:
+                return await proc.wait()
+            except asyncio.CancelledError:
+                proc.terminate()
+                await proc.wait()
+                logfile.write("#Cancelled during "+stage+"\n")
+                raise
+        finally:
+            await self._release(ncores)
+
+    async def _run_one(self, rundir, nproc):
+        """Run all stages for one simulation. Returns a status string.
+        The serial IC check only holds one core, so other simulations can use the rest meanwhile."""
+        with open(os.path.join(rundir, self.logname), 'a') as logfile:
+            for (stage, command) in self.commands(rundir, nproc):
+                ncores = 1 if stage == "check" else nproc
+                retcode = await self._run_stage(rundir, logfile, stage, command, ncores)
+                if retcode != 0:
+                    logfile.write("#"+stage+" failed with code "+str(retcode)+"\n")
+                    return "failed: "+stage
+        return "done"
+
+    async def run_async(self, rundirs, nproc=1):
+        """Run every simulation directory, nproc cores each.
+        Returns a dictionary from directory to status: 'done', 'failed: <stage>' or 'cancelled'."""
+        assert nproc <= self.total_cores
+        self._loop = asyncio.get_running_loop()
+        self._cond = asyncio.Condition()
+        self._free = self.total_cores
+        rundirs = [os.path.realpath(os.path.expanduser(rr)) for rr in rundirs]
+        self._tasks = [asyncio.ensure_future(self._run_one(rr, nproc)) for rr in rundirs]
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        status = {}
+        for (rr, res) in zip(rundirs, results):
+            if isinstance(res, asyncio.CancelledError):
+                status[rr] = "cancelled"
+            elif isinstance(res, BaseException):
+                status[rr] = "failed: "+repr(res)
+            else:
+                status[rr] = res
+        return status
+
+    def run(self, rundirs, nproc=1):
+        """Run every simulation directory, blocking until all have finished. See run_async."""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run_async(rundirs, nproc))
+        finally:
+            self._loop = None
+            loop.close()
+
+    def cancel(self):
+        """Cancel all running and queued simulations. Safe to call from another thread."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        for task in self._tasks:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                #The loop closed while we were cancelling: everything has already finished.
+                return
+
+def _check_ics_args(genicparam):
+    """Arguments for cambpower.py, read from the MP-GenIC parameter file."""
+    config = configobj.ConfigObj(genicparam)
+    genicout = os.path.join(config['OutputDir'], config['FileBase'])
+    zstr = re.search(r"ics_matterpow_(.*)\.dat", config['FileWithInputSpectrum']).group(1)
+    m_nu = float(config['MNue']) + float(config['MNum']) + float(config['MNut'])
+    return [genicout, "--czstr", zstr, "--mnu", str(m_nu)]
@@ -0,0 +1,116 @@
+"""Module to prepare the simulations of a suite in parallel with MPI.
+
+Preparing a suite is dominated by CLASS, which takes minutes per cosmology. Each MPI rank takes
+a round-robin slice of the parameter design and runs make_simulation for its slice into shared storage.
+Rank 0 gathers a table of which runs succeeded and writes it to prep_status.json in the suite directory.
+Without mpi4py, or with one rank, the whole design is prepared serially.
+
+The design is a JSON file:
+    {"outdir": suite directory,
+     "sim_class": "SimulationRunner.lyasimulation.LymanAlphaSim" (default SimulationRunner.simulationics.SimulationICs),
+     "common": {arguments for every simulation, eg "box": 20, "npart": 256},
+     "points": [{arguments for each simulation, eg "ns": 0.95, optionally "name": directory name}, ...]}
+Run it with:
+    mpirun -np 16 python -m SimulationRunner.mpiprep design.json
+With --dry-run only the parameter files are written, which takes seconds per run, and CLASS is run later by classfill.
+or generate a submission script with ClusterClass.generate_prep_submit."""
+
+import argparse
+import importlib
+import json
+import os
+import os.path
+from . import provenance
+
+def _get_comm(comm=None):
+    """The MPI communicator, or None if mpi4py is not available."""
+    if comm is not None:
+        return comm
+    try:
+        #Imported here so that this module can be used without MPI.
+        from mpi4py import MPI
+    except ImportError:
+        return None
+    return MPI.COMM_WORLD
+
+def load_design(designfile):
+    """Load a design from a JSON file."""
+    with open(designfile, 'r') as jsin:
+        design = json.load(jsin)
+    design["outdir"] = os.path.realpath(os.path.expanduser(design["outdir"]))
+    return design
+
+def _sim_class(name):
+    """Get a simulation class from its full dotted name."""
+    (module, cls) = name.rsplit(".", 1)
+    return getattr(importlib.import_module(module), cls)
+
+def run_dirs(design):
+    """Directory of each design point."""
+    return [os.path.join(design["outdir"], str(pp.get("name", ii))) for (ii, pp) in enumerate(design["points"])]
+
+def my_slice(npoints, rank, size):
+    """Indices of the design points prepared by a rank: a round-robin slice."""
+    return list(range(rank, npoints, size))
+
+def point_simulation(design, ii):
+    """The simulation object of a single design point."""
+    sim_class = _sim_class(design.get("sim_class", "SimulationRunner.simulationics.SimulationICs"))
+    params = dict(design.get("common", {}))
+    params.update(design["points"][ii])
+    params.pop("name", None)
+    return sim_class(outdir=run_dirs(design)[ii], **params)
+
+def prepare_point(design, ii, pkaccuracy=0.05, do_build=False, dry_run=False):
+    """Prepare a single design point. Returns a status string: 'done' or 'failed: <error>'."""
+    try:
+        sim = point_simulation(design, ii)
+        sim.make_simulation(pkaccuracy=pkaccuracy, do_build=do_build, dry_run=dry_run)
+    except Exception as err: # pylint: disable=broad-except
+        return "failed: "+repr(err)
+    return "done"
+
+def prepare_suite(design, comm=None, pkaccuracy=0.05, do_build=False, dry_run=False):
+    """Prepare every point of the design, sharing the points between MPI ranks.
+    If dry_run is true, CLASS is not run: fill it in later with classfill.
+    Returns, on rank 0, a dictionary from run directory to status. Other ranks return None."""
+    comm = _get_comm(comm)
+    (rank, size) = (0, 1) if comm is None else (comm.Get_rank(), comm.Get_size())
+    if rank == 0:
+        if not os.path.exists(design["outdir"]):
+            os.makedirs(design["outdir"])
+        #Written once, before any rank makes a simulation.
+        provenance.record_suite(design["outdir"], gadget_dir=os.path.expanduser(design.get("gadget_dir", "~/codes/MP-Gadget/")))
+    if comm is not None:
+        comm.Barrier()
+    rundirs = run_dirs(design)
+    mine = {rundirs[ii]: prepare_point(design, ii, pkaccuracy=pkaccuracy, do_build=do_build, dry_run=dry_run) for ii in my_slice(len(rundirs), rank, size)}
+    if comm is not None:
+        gathered = comm.gather(mine, root=0)
+    else:
+        gathered = [mine,]
+    if rank != 0:
+        return None
+    status = {}
+    for part in gathered:
+        status.update(part)
+    with open(os.path.join(design["outdir"], "prep_status.json"), 'w') as jsout:
+        json.dump(status, jsout, indent=1)
+    return status
+
+def print_status(status):
+    """Print the table of preparation results."""
+    for rundir in sorted(status):
+        print(os.path.basename(rundir), ":", status[rundir])
+    nfail = len([ss for ss in status.values() if ss != "done"])
+    print(len(status) - nfail, "prepared,", nfail, "failed")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('design', type=str, help='JSON file describing the suite')
+    parser.add_argument('--pkaccuracy', type=float, default=0.05, help='Accuracy of the IC power spectrum check', required=False)
+    parser.add_argument('--dry-run', action='store_true', help='Write the parameter files without running CLASS')
+    args = parser.parse_args()
+    result = prepare_suite(load_design(args.design), pkaccuracy=args.pkaccuracy, dry_run=args.dry_run)
+    if result is not None:
+        print_status(result)
@@ -0,0 +1,179 @@
+"""Module to generate a multi-fidelity simulation suite for an emulator.
+
+Every point of a parameter design gets a low resolution simulation.
+As many points as a node-hour budget allows also get a high resolution simulation,
+with the same seed, so that the pair differ only in resolution.
+High resolution points are chosen to spread out over the design, by farthest-point sampling.
+CLASS is run once per pair, at the resolution of the high resolution run, and the output copied to the low resolution run.
+The pairing is recorded in suite.json in the suite directory."""
+
+import inspect
+import json
+import os
+import os.path
+import numpy as np
+from . import costmodel
+from . import provenance
+
+def farthest_point_order(points):
+    """Order design points so that each is as far as possible from all earlier points.
+    Each parameter is first rescaled to the unit interval.
+    The first point is the one nearest the centre of the design.
+    Arguments:
+        points - array of shape (npoints, nparams)
+    Returns an array of indices into points."""
+    points = np.array(points, dtype=np.float64)
+    if np.size(points) == 0:
+        return np.array([], dtype=np.int64)
+    if points.ndim == 1:
+        points = points.reshape(-1, 1)
+    span = np.max(points, axis=0) - np.min(points, axis=0)
+    span[span == 0] = 1
+    unit = (points - np.min(points, axis=0)) / span
+    first = np.argmin(np.sum((unit - np.mean(unit, axis=0))**2, axis=1))
+    order = [first,]
+    mindist = np.sum((unit - unit[first])**2, axis=1)
+    for _ in range(1, np.shape(unit)[0]):
+        nxt = np.argmax(mindist)
+        order.append(nxt)
+        mindist = np.minimum(mindist, np.sum((unit - unit[nxt])**2, axis=1))
+    return np.array(order)
+
+def allocate_budget(low_costs, high_costs, order, budget):
+    """Decide which points get a high resolution simulation.
+    Every point gets a low resolution run. High resolution runs are then added
+    in the given order until the next one would exceed the budget.
+    Arguments:
+        low_costs, high_costs - predicted node-hours of each point at low and high resolution.
+        order - order in which to add high resolution points (see farthest_point_order).
+        budget - total node-hours.
+    Returns (indices of high resolution points, predicted total node-hours)."""
+    total = float(np.sum(low_costs))
+    if total > budget:
+        raise ValueError("Low resolution runs need "+str(total)+" node-hours, budget is "+str(budget))
+    high = []
+    for ii in order:
+        if total + high_costs[ii] > budget:
+            break
+        total += high_costs[ii]
+        high.append(int(ii))
+    return high, total
+
+def class_defaults(sim_class):
+    """Default values of the keyword arguments of a simulation class, including those of its base classes."""
+    defaults = {}
+    for cls in reversed(inspect.getmro(sim_class)):
+        if "__init__" not in vars(cls):
+            continue
+        for param in inspect.signature(cls.__init__).parameters.values():
+            if param.default is not inspect.Parameter.empty:
+                defaults[param.name] = param.default
+    return defaults
+
+class MultiFidelitySuite(object):
+    """A suite of low resolution simulations, some paired with a high resolution simulation.
+    Arguments:
+        outdir - suite directory. Runs are made in subdirectories lf_N and hf_N, where N is the design point.
+        design - list of dictionaries of SimulationICs arguments for each design point (eg, ns, hubble).
+        npart_low, npart_high - cube root of the number of particles at low and high resolution.
+        budget - total node-hours for the suite.
+        sim_class - simulation class, by default SimulationICs.
+        cost_model - object with a predict method giving node-hours for a simulation. By default costmodel.AnalyticCostModel.
+        seeds - if not None, a seed for each design point. Otherwise all points use the default seed of sim_class.
+        Other keyword arguments (eg, box, redend) are passed to every simulation."""
+    def __init__(self, *, outdir, design, npart_low, npart_high, budget, sim_class=None, cost_model=None, seeds=None, **kwargs):
+        assert npart_high > npart_low
+        if sim_class is None:
+            from .simulationics import SimulationICs
+            sim_class = SimulationICs
+        if cost_model is None:
+            cost_model = costmodel.AnalyticCostModel()
+        self.outdir = os.path.realpath(os.path.expanduser(outdir))
+        self.design = [dict(dd) for dd in design]
+        if seeds is not None:
+            assert len(seeds) == len(self.design)
+            for (dd, seed) in zip(self.design, seeds):
+                dd["seed"] = seed
+        self.npart_low = npart_low
+        self.npart_high = npart_high
+        self.budget = budget
+        self.sim_class = sim_class
+        self.cost_model = cost_model
+        self.kwargs = kwargs
+        self.high = None
+        self.predicted = None
+        self.low_costs = None
+        self.high_costs = None
+        self.low_sims = []
+        self.high_sims = {}
+
+    def rundir(self, ii, high=False):
+        """Directory for the simulation at design point ii."""
+        return os.path.join(self.outdir, ("hf_" if high else "lf_")+str(ii))
+
+    def _make_sim(self, ii, high):
+        """Construct the simulation object for design point ii."""
+        params = dict(self.kwargs)
+        params.update(self.design[ii])
+        params["npart"] = self.npart_high if high else self.npart_low
+        return self.sim_class(outdir=self.rundir(ii, high), **params)
+
+    def _design_array(self):
+        """Numeric parameters which vary over the design, as an array of shape (npoints, nparams)."""
+        names = sorted(set().union(*[dd.keys() for dd in self.design]) - set(["seed",]))
+        names = [nn for nn in names if all([isinstance(dd.get(nn), (int, float)) for dd in self.design])]
+        return np.array([[dd[nn] for nn in names] for dd in self.design], dtype=np.float64).reshape(len(self.design), len(names))
+
+    def cost_params(self, ii, high=False):
+        """Cost model parameters of the simulation at design point ii, found from its arguments
+        and the defaults of the simulation class, without constructing the simulation."""
+        params = class_defaults(self.sim_class)
+        params.update(self.kwargs)
+        params.update(self.design[ii])
+        npart = self.npart_high if high else self.npart_low
+        #Neutrino particle simulations set the ratio of neutrino to DM particle grids.
+        nu_ngrid = int(npart * params.get("npartnufac", 0))
+        return {"npart": npart, "separate_gas": params["separate_gas"], "nu_ngrid": nu_ngrid, "redshift": params["redshift"], "redend": params["redend"], "box": params["box"], "m_nu": params["m_nu"]}
+
+    def allocate(self):
+        """Choose the high resolution points using the cost model.
+        Nothing is written: the simulations are made by make_suite.
+        Returns the list of high resolution design points."""
+        npoints = len(self.design)
+        self.low_costs = np.array([self.cost_model.predict(self.cost_params(ii)) for ii in range(npoints)])
+        self.high_costs = np.array([self.cost_model.predict(self.cost_params(ii, high=True)) for ii in range(npoints)])
+        order = farthest_point_order(self._design_array())
+        (self.high, self.predicted) = allocate_budget(self.low_costs, self.high_costs, order, self.budget)
+        return self.high
+
+    def make_suite(self, pkaccuracy=0.05, do_build=False):
+        """Make every simulation in the suite, then write suite.json."""
+        if self.high is None:
+            self.allocate()
+        if not os.path.exists(self.outdir):
+            os.mkdir(self.outdir)
+        self.low_sims = [self._make_sim(ii, False) for ii in range(len(self.design))]
+        self.high_sims = {ii: self._make_sim(ii, True) for ii in self.high}
+        provenance.record_suite(self.outdir, gadget_dir=self.low_sims[0].gadget_dir)
+        for (ii, low) in enumerate(self.low_sims):
+            class_dir = None
+            if ii in self.high_sims:
+                high = self.high_sims[ii]
+                high.make_simulation(pkaccuracy=pkaccuracy, do_build=do_build)
+                class_dir = os.path.join(high.outdir, "camb_linear")
+            low.make_simulation(pkaccuracy=pkaccuracy, do_build=do_build, class_dir=class_dir)
+        self.write_metadata()
+
+    def write_metadata(self):
+        """Record the design, the pairing and the predicted cost in suite.json."""
+        points = []
+        for (ii, low) in enumerate(self.low_sims):
+            point = {"index": ii, "params": self.design[ii], "seed": low.seed, "low": low.outdir, "low_node_hours": float(self.low_costs[ii]), "high": None, "high_node_hours": None}
+            if ii in self.high_sims:
+                point["high"] = self.high_sims[ii].outdir
+                point["high_node_hours"] = float(self.high_costs[ii])
+            points.append(point)
+        suite = {"npart_low": self.npart_low, "npart_high": self.npart_high, "budget": self.budget, "predicted_node_hours": self.predicted, "high_points": self.high, "points": points}
+        with open(os.path.join(self.outdir, "suite.json"), 'w') as jsout:
+            json.dump(suite, jsout, indent=1)
+        return suite
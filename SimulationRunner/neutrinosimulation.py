@@ -1,22 +1,33 @@
 """Specialization of the Simulation class to Lyman-alpha forest simulations."""
 
+import itertools
+import math
 import numpy as np
+import scipy.integrate
+import scipy.optimize
 from . import simulationics
+from . import outputs
 
 class NeutrinoPartICs(simulationics.SimulationICs):
-    """Specialise the initial conditions for particle neutrinos."""
+    """Specialise the initial conditions for particle neutrinos.
+    npartnufac - cube root of the ratio of neutrino particles to CDM particles."""
     __doc__ = __doc__+simulationics.SimulationICs.__doc__
-    def __init__(self, *, m_nu=0.1, separate_gas=False, **kwargs):
+    def __init__(self, *, m_nu=0.1, separate_gas=False, npartnufac=1, **kwargs):
         #Set neutrino mass
         #Note that omega0 does remains constant if we change m_nu.
         #This does mean that omegab/omegac will increase, but not by much.
         assert m_nu > 0
+        self.npartnufac = npartnufac
         super().__init__(m_nu = m_nu, separate_gas=separate_gas, **kwargs)
         self.separate_nu = True
 
+    def _nu_ngrid(self):
+        """Cube root of the number of neutrino particles."""
+        return int(self.npart*self.npartnufac)
+
     def _genicfile_child_options(self, config):
         """Set up particle neutrino parameters for GenIC"""
-        config['NgridNu'] = self.npart
+        config['NgridNu'] = self._nu_ngrid()
         #Degenerate neutrinos
         return config
 
@@ -36,10 +47,14 @@ class NeutrinoHybridICs(simulationics.SimulationICs):
         self.zz_transition = zz_transition
         super().__init__(**kwargs)
 
+    def _nu_ngrid(self):
+        """Cube root of the number of neutrino particles."""
+        return int(self.npart*self.npartnufac)
+
     def _genicfile_child_options(self, config):
         """Set up hybrid neutrino parameters for GenIC."""
         #Degenerate neutrinos
-        config['NgridNu'] = int(self.npart*self.npartnufac)
+        config['NgridNu'] = self._nu_ngrid()
         config['Max_nuvel'] = self.vcrit
         return config
 
@@ -49,3 +64,101 @@ class NeutrinoHybridICs(simulationics.SimulationICs):
         config['Vcrit'] = self.vcrit
         config['NuPartTime'] = 1./(1+self.zz_transition)
         return config
+
+#The hybrid neutrino error model used by select_hybrid_params has no default coefficients:
+#they must be calibrated against particle neutrino runs, with fit_error_model. The coefficients are:
+#v_nl - neutrinos slower than this (in km/s at z=0) cluster non-linearly.
+#lin - error from slow neutrinos which are never made into particles.
+#late - error from slow neutrinos being followed linearly until the transition redshift.
+#shot - shot noise error of the neutrino particles.
+#Only the scaling of each term with the parameters is fixed, by the following arguments; the coefficients absorb
+#the scale and redshift at which the error is measured, and are taken from the data.
+#lin: neutrinos suppress the matter power by a fraction proportional to f_nu, the neutrino fraction of the matter
+#     (Delta P/P ~ -8 f_nu, Hu, Eisenstein & Tegmark 1998, PRL 80, 5255). The error from following a fraction
+#     of the neutrinos only linearly is taken to be that fraction of the suppression, for neutrinos slow enough to cluster.
+#late: the non-linear part of the neutrino clustering grows with the square of the growth factor, ~ a^2 in matter domination,
+#     so the part which had formed before the particles are made at zz_transition is (1+zz_transition)^-2 of the final.
+#shot: N neutrino particles in the box add Poisson noise P_shot = box^3/N to their power spectrum, which enters
+#     the matter power weighted by the square of their mass fraction, f_nu^2 f_slow^2. The fractional error is this
+#     divided by the matter power, which is absorbed into the coefficient.
+#Neutrino temperature today, kT in eV, and the speed of light in km/s.
+_KT_NU0 = 1.6763e-4
+_LIGHT = 299792.458
+
+def slow_fraction(vcrit, m_nu):
+    """Fraction of neutrinos (by number or, as they are non-relativistic, by mass) with velocity today below vcrit (km/s),
+    for three degenerate neutrinos with a Fermi-Dirac distribution."""
+    x_c = m_nu / 3. * vcrit / _LIGHT / _KT_NU0
+    fermi_dirac = lambda x: x**2 * np.exp(-x) / (1 + np.exp(-x))
+    return scipy.integrate.quad(fermi_dirac, 0, x_c)[0] / scipy.integrate.quad(fermi_dirac, 0, np.inf)[0]
+
+def _error_terms(m_nu, box, npart, npartnufac, vcrit, zz_transition, v_nl, omega0=0.288, hubble=0.7):
+    """The three terms of the hybrid error model, for unit coefficients: (lin, late, shot)."""
+    f_nu = m_nu / 93.14 / hubble**2 / omega0
+    f_slow = slow_fraction(vcrit, m_nu)
+    f_cluster = slow_fraction(min(vcrit, v_nl), m_nu)
+    e_lin = f_nu * max(0, slow_fraction(v_nl, m_nu) - f_slow)
+    e_late = f_nu * f_cluster / (1 + zz_transition)**2
+    ngrid = max(int(npart*npartnufac), 1)
+    e_shot = (f_nu * f_slow)**2 * (box / ngrid)**3
+    return (e_lin, e_late, e_shot)
+
+def hybrid_error(m_nu, box, npart, npartnufac, vcrit, zz_transition, error_model, omega0=0.288, hubble=0.7):
+    """Estimated fractional error in the total matter power spectrum at z=0 for a hybrid neutrino simulation.
+    error_model is a dictionary of the coefficients v_nl, lin, late and shot, from fit_error_model.
+    The error is the sum in quadrature of:
+        - slow but clustering neutrinos above vcrit, which are only followed linearly.
+        - clustering neutrinos below vcrit, which are followed linearly until zz_transition.
+        - shot noise in the neutrino particles, which grows with the mass they carry and their spacing."""
+    terms = _error_terms(m_nu, box, npart, npartnufac, vcrit, zz_transition, error_model["v_nl"], omega0=omega0, hubble=hubble)
+    coeffs = (error_model["lin"], error_model["late"], error_model["shot"])
+    return math.sqrt(sum([(cc * tt)**2 for (cc, tt) in zip(coeffs, terms)]))
+
+def fit_error_model(runs, v_nl):
+    """Calibrate the coefficients of the hybrid error model against measured errors.
+    runs is a list of dictionaries, each with the arguments of hybrid_error (m_nu, box, npart, npartnufac, vcrit, zz_transition,
+    and optionally omega0 and hubble) and "error", the measured fractional difference in the z=0 matter power
+    between the hybrid simulation and a particle neutrino simulation with the same ICs.
+    As the terms add in quadrature, the squared coefficients are a non-negative least squares fit.
+    Returns an error model for hybrid_error."""
+    terms = np.array([_error_terms(rr["m_nu"], rr["box"], rr["npart"], rr["npartnufac"], rr["vcrit"], rr["zz_transition"], v_nl, omega0=rr.get("omega0", 0.288), hubble=rr.get("hubble", 0.7)) for rr in runs])
+    errors = np.array([rr["error"] for rr in runs])
+    (coeff2, _) = scipy.optimize.nnls(terms**2, errors**2)
+    return {"v_nl": v_nl, "lin": math.sqrt(coeff2[0]), "late": math.sqrt(coeff2[1]), "shot": math.sqrt(coeff2[2])}
+
+def hybrid_cost(npart, npartnufac, zz_transition, redshift=99, redend=0, separate_gas=False, memory_per_particle=None):
+    """Estimated cost of a hybrid neutrino simulation.
+    Returns a dictionary with the number of neutrino particles, the total number of particles,
+    the runtime relative to the same simulation without neutrino particles, and the memory in bytes
+    (None unless memory_per_particle, the bytes used by MP-Gadget per particle on the target machine, is given).
+    Runtime is taken to scale with the number of active particles times the number of e-folds of expansion,
+    neutrino particles being active only after zz_transition."""
+    counts = outputs.particle_counts(npart, separate_gas, int(npart*npartnufac))
+    nother = counts[0] + counts[1]
+    efolds = math.log((1 + redshift) / (1 + redend))
+    nu_efolds = math.log((1 + max(min(zz_transition, redshift), redend)) / (1 + redend))
+    runtime = 1 + float(counts[2]) * nu_efolds / (nother * efolds)
+    particles = int(nother + counts[2])
+    memory = None if memory_per_particle is None else int(particles * memory_per_particle)
+    return {"nu_particles": int(counts[2]), "particles": particles, "memory": memory, "runtime": runtime}
+
+def select_hybrid_params(m_nu, box, npart, error_model, tolerance=1e-3, redshift=99, redend=0, separate_gas=False, omega0=0.288, hubble=0.7, npartnufacs=(0.25, 0.5, 0.75, 1.), vcrits=(300, 500, 850, 1200, 2000), zz_transitions=(0, 0.5, 1, 2, 4), memory_per_particle=None):
+    """Choose the cheapest hybrid neutrino parameters (npartnufac, vcrit, zz_transition) for NeutrinoHybridICs
+    whose estimated error (see hybrid_error, with the calibrated error_model) on the matter power is below tolerance.
+    Candidates are ranked by runtime, then number of particles.
+    Returns a dictionary of the parameters plus the estimated error and cost.
+    Raises ValueError if no candidate meets the tolerance."""
+    best = None
+    for (npartnufac, vcrit, zz_transition) in itertools.product(npartnufacs, vcrits, zz_transitions):
+        if zz_transition < redend or zz_transition > redshift:
+            continue
+        error = hybrid_error(m_nu, box, npart, npartnufac, vcrit, zz_transition, error_model, omega0=omega0, hubble=hubble)
+        if error > tolerance:
+            continue
+        cost = hybrid_cost(npart, npartnufac, zz_transition, redshift=redshift, redend=redend, separate_gas=separate_gas, memory_per_particle=memory_per_particle)
+        if best is None or (cost["runtime"], cost["particles"]) < (best["runtime"], best["particles"]):
+            best = {"npartnufac": npartnufac, "vcrit": vcrit, "zz_transition": zz_transition, "error": error}
+            best.update(cost)
+    if best is None:
+        raise ValueError("No hybrid neutrino parameters have estimated error below "+str(tolerance))
+    return best
@@ -0,0 +1,95 @@
+"""Module to plan the snapshot output schedule of a simulation so that it fits within a disk budget.
+
+Snapshot sizes are estimated from the particle counts and the blocks MP-Gadget writes for each particle type.
+The estimates are for PART snapshots; the FOF (PIG) outputs are much smaller and are ignored."""
+
+import numpy as np
+
+#Approximate bytes per particle in an MP-Gadget PART snapshot.
+#Every particle has Position (3 x f8), Velocity (3 x f4), ID (u8) and Mass (f4).
+BYTES_COMMON = 48
+#With FOF enabled there is also a GroupID (u4).
+BYTES_FOF = 4
+#Gas particles also store Density, InternalEnergy, ElectronAbundance, NeutralHydrogenFraction,
+#SmoothingLength, StarFormationRate, Metallicity and EgyWtDensity (all f4).
+BYTES_GAS = 32
+
+def particle_counts(npart, separate_gas=True, nu_ngrid=0):
+    """Number of particles of each type: gas (0), DM (1) and neutrinos (2).
+    npart and nu_ngrid are cube roots."""
+    return np.array([int(separate_gas)*npart**3, npart**3, nu_ngrid**3], dtype=np.int64)
+
+def snapshot_bytes(npart, separate_gas=True, nu_ngrid=0, fof=True):
+    """Estimated size in bytes of one snapshot."""
+    counts = particle_counts(npart, separate_gas, nu_ngrid)
+    common = BYTES_COMMON + BYTES_FOF*int(fof)
+    return int(np.sum(counts) * common + counts[0] * BYTES_GAS)
+
+def ics_bytes(npart, separate_gas=True, nu_ngrid=0):
+    """Estimated size in bytes of the initial conditions.
+    These contain only positions, velocities, IDs and masses."""
+    return int(np.sum(particle_counts(npart, separate_gas, nu_ngrid)) * BYTES_COMMON)
+
+def plan_outputs(times, snapbytes, budget, required_times=(), astart=None, aend=None, tol=1e-4):
+    """Choose the output times for a simulation so that the snapshots fit in a disk budget.
+    Arguments:
+        times - candidate output scale factors
+        snapbytes - bytes per snapshot
+        budget - disk budget in bytes for snapshots
+        required_times - scale factors which must be output, whether or not they are candidates.
+        astart, aend - start and end scale factors of the simulation.
+                       Optional snapshots are spread as evenly as possible in log(a) between them.
+    Returns the sorted array of output scale factors.
+    Raises ValueError if the required outputs alone do not fit in the budget."""
+    times = np.sort(np.asarray(times, dtype=np.float64))
+    required = np.sort(np.asarray(required_times, dtype=np.float64))
+    nmax = int(budget // snapbytes)
+    if np.size(required) > nmax:
+        raise ValueError("Required outputs need "+str(np.size(required)*snapbytes)+" bytes, budget is "+str(budget))
+    #Drop candidates which are the same as a required output
+    if np.size(required) > 0:
+        dist = np.min(np.abs(times[:,np.newaxis] - required[np.newaxis,:]), axis=1)
+        times = times[dist > tol]
+    if np.size(required) + np.size(times) <= nmax:
+        return np.sort(np.concatenate([required, times]))
+    if astart is None:
+        astart = np.min(np.concatenate([times, required]))
+    if aend is None:
+        aend = np.max(np.concatenate([times, required]))
+    #Greedily add the candidate furthest (in log a) from every output already chosen.
+    chosen = list(required)
+    lncand = np.log(times)
+    lnchosen = np.log(np.concatenate([[astart, aend], required]))
+    mindist = np.min(np.abs(lncand[:,np.newaxis] - lnchosen[np.newaxis,:]), axis=1)
+    while len(chosen) < nmax:
+        ii = np.argmax(mindist)
+        chosen.append(times[ii])
+        mindist = np.minimum(mindist, np.abs(lncand - lncand[ii]))
+        mindist[ii] = -1
+    return np.sort(np.array(chosen))
+
+def plan_suite_outputs(sims, budget):
+    """Share a disk budget for a whole suite between simulations.
+    Every simulation gets the same number of snapshots (or all its candidate outputs, if fewer),
+    chosen to be as large as the budget allows. Sets the output_budget attribute of each simulation,
+    so that the plan is applied when the parameter files are written.
+    Arguments:
+        sims - list of SimulationICs objects
+        budget - total disk budget in bytes, including ICs
+    Returns a dictionary from output directory to projected storage report."""
+    snapbytes = np.array([sim.snapshot_bytes() for sim in sims])
+    icbytes = np.array([sim.ics_bytes() for sim in sims])
+    required = np.array([np.size(sim.required_output_times()) for sim in sims])
+    #Required outputs may also be candidates: they are only written once.
+    ncand = np.array([np.size(np.unique(np.concatenate([sim.generate_times(), sim.required_output_times()]))) for sim in sims])
+    cost = lambda nsnap: np.sum(icbytes + snapbytes * np.minimum(np.maximum(nsnap, required), ncand))
+    if cost(0) > budget:
+        raise ValueError("Required outputs for the suite need "+str(cost(0))+" bytes, budget is "+str(budget))
+    nsnap = 0
+    while nsnap < np.max(ncand) and cost(nsnap+1) <= budget:
+        nsnap += 1
+    reports = {}
+    for (ii, sim) in enumerate(sims):
+        sim.output_budget = int(icbytes[ii] + snapbytes[ii] * np.minimum(np.maximum(nsnap, required[ii]), ncand[ii]))
+        reports[sim.outdir] = sim.storage_report()
+    return reports
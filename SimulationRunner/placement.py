@@ -0,0 +1,162 @@
+"""Module to spread a suite of simulations over several clusters.
+
+Each cluster we have an allocation on is described by a ClusterTarget: a cluster class from clusters.py,
+the node-hours left in the allocation, how many nodes we can expect to use at once, and a probe which
+estimates how long new jobs will wait in the queue. Runs are assigned greedily, largest first,
+to the target on which they would finish earliest (longest processing time scheduling),
+without exceeding any allocation. Each simulation is then made with the cluster class of its target,
+and the assignment is written to placement.json."""
+
+import json
+import os
+import os.path
+import subprocess
+from . import costmodel
+from . import provenance
+
+class StaticProbe(object):
+    """Queue probe which always returns the same wait, in hours. Useful for testing, or if the queue is known."""
+    def __init__(self, wait=0.):
+        self.wait = wait
+
+    def __call__(self, target):
+        return self.wait
+
+class SlurmProbe(object):
+    """Queue probe for SLURM: the node-hours of pending jobs in the target's partition, divided by the nodes in the partition.
+    The partition and login host are those of the target, unless given here.
+    squeue is run on the login host with ssh, or locally if there is no host.
+    Returns infinity if squeue cannot be run, so that a cluster we cannot reach is never chosen."""
+    def __init__(self, partition=None, partition_nodes=100, host=None):
+        self.partition = partition
+        self.partition_nodes = partition_nodes
+        self.host = host
+
+    def command(self, target):
+        """The squeue command which lists the pending jobs of a target."""
+        command = ["squeue", "-h", "-t", "PD", "-o", "%D %l"]
+        partition = self.partition if self.partition is not None else target.partition
+        if partition is not None:
+            command += ["-p", partition]
+        host = self.host if self.host is not None else target.host
+        if host is not None:
+            command = ["ssh", "-o", "BatchMode=yes", host] + command
+        return command
+
+    def __call__(self, target):
+        try:
+            output = subprocess.check_output(self.command(target), universal_newlines=True, stderr=subprocess.DEVNULL, timeout=60)
+        except (OSError, subprocess.SubprocessError):
+            return float('inf')
+        pending = 0.
+        for line in output.splitlines():
+            try:
+                (nodes, limit) = line.split()
+                pending += int(nodes) * _slurm_hours(limit)
+            except ValueError:
+                continue
+        return pending / self.partition_nodes
+
+def _slurm_hours(limit):
+    """Convert a SLURM time limit ([days-]hours:minutes:seconds) to hours."""
+    days = 0
+    if "-" in limit:
+        (days, limit) = limit.split("-")
+    fields = [int(ff) for ff in limit.split(":")]
+    while len(fields) < 3:
+        fields = [0,] + fields
+    return 24*int(days) + fields[0] + fields[1]/60. + fields[2]/3600.
+
+class ClusterTarget(object):
+    """A cluster we can run on.
+    Arguments:
+        name - label for the target.
+        cluster_class - class from clusters.py.
+        allocation - node-hours left in the allocation.
+        concurrent_nodes - number of nodes our jobs can expect to use at once.
+        queue_probe - callable taking the target and returning the expected queue wait in hours. By default no wait.
+                      A target with an infinite wait (eg, its queue could not be probed) is not used.
+        cost_scale - node-hours on this cluster per node-hour predicted by the cost model (eg, for slower nodes).
+        cluster_kwargs - extra arguments for cluster_class, eg nproc or timelimit.
+        partition - queue partition our jobs run in, for the queue probe.
+        host - login host of the cluster, for the queue probe. None if it is this machine."""
+    def __init__(self, name, cluster_class, allocation, concurrent_nodes, queue_probe=None, cost_scale=1., cluster_kwargs=None, partition=None, host=None):
+        self.name = name
+        self.cluster_class = cluster_class
+        self.allocation = allocation
+        self.concurrent_nodes = concurrent_nodes
+        if queue_probe is None:
+            queue_probe = StaticProbe(0.)
+        self.queue_probe = queue_probe
+        self.cost_scale = cost_scale
+        self.cluster_kwargs = dict(cluster_kwargs) if cluster_kwargs is not None else {}
+        self.partition = partition
+        self.host = host
+
+    def queue_wait(self):
+        """Expected queue wait in hours."""
+        return self.queue_probe(self)
+
+class SuitePlacement(object):
+    """Assign the simulations of a suite to clusters and make them.
+    Arguments:
+        sims - list of SimulationICs objects (the cluster they were constructed with is replaced).
+        targets - list of ClusterTarget.
+        cost_model - object with a predict method giving node-hours for a simulation. By default costmodel.AnalyticCostModel."""
+    def __init__(self, sims, targets, cost_model=None):
+        assert len(targets) > 0
+        self.sims = sims
+        self.targets = targets
+        if cost_model is None:
+            cost_model = costmodel.AnalyticCostModel()
+        self.cost_model = cost_model
+        self.assignment = None
+        self.used = None
+        self.finish = None
+
+    def assign(self):
+        """Assign each simulation to a target, minimising the time at which the last target finishes.
+        Returns a dictionary from simulation directory to target name."""
+        costs = [self.cost_model.predict(sim) for sim in self.sims]
+        used = {tt.name: 0. for tt in self.targets}
+        finish = {tt.name: tt.queue_wait() for tt in self.targets}
+        self.assignment = {}
+        for ii in sorted(range(len(self.sims)), key=lambda ii: -costs[ii]):
+            best = None
+            for tt in self.targets:
+                cost = costs[ii] * tt.cost_scale
+                if used[tt.name] + cost > tt.allocation or finish[tt.name] == float('inf'):
+                    continue
+                end = finish[tt.name] + cost / tt.concurrent_nodes
+                if best is None or end < best[1]:
+                    best = (tt, end, cost)
+            if best is None:
+                raise ValueError("No reachable allocation left for "+self.sims[ii].outdir+", predicted cost "+str(costs[ii])+" node-hours")
+            (tt, end, cost) = best
+            used[tt.name] += cost
+            finish[tt.name] = end
+            self.assignment[self.sims[ii].outdir] = tt.name
+        self.used = used
+        self.finish = finish
+        return self.assignment
+
+    def make_suite(self, outdir, pkaccuracy=0.05, do_build=False):
+        """Make every simulation with the cluster class of its target, then write outdir/placement.json."""
+        if self.assignment is None:
+            self.assign()
+        targets = {tt.name: tt for tt in self.targets}
+        provenance.record_suite(outdir, gadget_dir=self.sims[0].gadget_dir if self.sims else None)
+        for sim in self.sims:
+            target = targets[self.assignment[sim.outdir]]
+            sim.set_cluster(target.cluster_class, **target.cluster_kwargs)
+            sim.make_simulation(pkaccuracy=pkaccuracy, do_build=do_build)
+        self.write_placement(outdir)
+
+    def write_placement(self, outdir):
+        """Record the assignment, and the predicted use and finish time of each target, in outdir/placement.json."""
+        placement = {"runs": self.assignment, "targets": {}}
+        for tt in self.targets:
+            placement["targets"][tt.name] = {"cluster_class": tt.cluster_class.__name__, "allocation": tt.allocation, "node_hours": self.used[tt.name], "finish_hours": self.finish[tt.name]}
+        with open(os.path.join(outdir, "placement.json"), 'w') as jsout:
+            json.dump(placement, jsout, indent=1)
+        return placement
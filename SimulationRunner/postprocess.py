@@ -0,0 +1,140 @@
+"""Module to post-process snapshots (for example, extract flux power spectra) as they are written.
+
+The scheduler polls the output directory of a simulation for new snapshots and runs a command on each
+complete snapshot in a bounded pool of worker threads. A marker file is written to output/postprocessed/
+when a snapshot is processed, so no snapshot is processed twice, even across restarts.
+
+It can run alongside the simulation (follow mode), in which case the newest snapshot is left alone
+until a later one appears or the simulation finishes, or as a packed job once the simulation has finished.
+Following stops if the simulation stops writing cpu.txt for a while (it crashed, was cancelled or is waiting in the queue):
+    python -m SimulationRunner.postprocess <simulation directory> [--follow]"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import os.path
+import subprocess
+import time
+from . import remake
+from . import integrity
+from . import jobchain
+
+class SnapshotProcessor(object):
+    """Run a command on every snapshot of a simulation, once.
+    Arguments:
+        outdir - simulation directory.
+        command - command template, run in outdir. {snapdir} is replaced by the snapshot path relative to outdir,
+                  and {snapnum} by the snapshot number.
+        nworkers - maximum number of commands running at once.
+        verify - if true, only process snapshots which pass the integrity checks.
+        retry_failed - if true, commands which failed before are run again."""
+    def __init__(self, outdir, command="python flux_power.py {snapdir}", nworkers=2, output_file="output", snap="PART_", verify=True, retry_failed=False, marker_dir="postprocessed"):
+        self.outdir = os.path.realpath(os.path.expanduser(outdir))
+        self.command = command
+        self.nworkers = nworkers
+        self.output_file = output_file
+        self.snap = snap
+        self.verify = verify
+        self.retry_failed = retry_failed
+        self.marker_dir = os.path.join(os.path.join(self.outdir, output_file), marker_dir)
+        self._queued = {}
+
+    def snapname(self, snapnum):
+        """Name of a snapshot directory."""
+        return self.snap+str(snapnum).rjust(3,'0')
+
+    def _marker(self, snapnum, kind):
+        """Path of a marker file for a snapshot."""
+        return os.path.join(self.marker_dir, self.snapname(snapnum)+"."+kind)
+
+    def processed(self, snapnum):
+        """True if the snapshot has been processed (or failed, unless we retry failures)."""
+        if os.path.exists(self._marker(snapnum, "done")):
+            return True
+        return not self.retry_failed and os.path.exists(self._marker(snapnum, "failed"))
+
+    def finished(self):
+        """True if the simulation has reached its final time."""
+        try:
+            return jobchain.last_time(self.outdir, self.output_file) >= jobchain.time_max(self.outdir)*(1-1e-6)
+        except IOError:
+            return False
+
+    def stalled(self, stall, since):
+        """True if cpu.txt has not been written for stall seconds, counting from since if it is older or missing."""
+        try:
+            last = max(since, os.stat(os.path.join(self.outdir, self.output_file, "cpu.txt")).st_mtime)
+        except FileNotFoundError:
+            last = since
+        return time.time() - last > stall
+
+    def pending(self, final=False):
+        """Snapshots ready to process which are not processed or queued.
+        Unless final is true, the newest snapshot is assumed to be still in progress."""
+        snapnums = remake._find_snaps(self.outdir, self.output_file, self.snap)
+        if not final:
+            snapnums = snapnums[:-1]
+        ready = []
+        for snapnum in snapnums:
+            if snapnum in self._queued or self.processed(snapnum):
+                continue
+            snapdir = os.path.join(os.path.join(self.outdir, self.output_file), self.snapname(snapnum))
+            if self.verify and not integrity.snapshot_ok(snapdir):
+                continue
+            ready.append(snapnum)
+        return ready
+
+    def process(self, snapnum):
+        """Run the command on a single snapshot and write the marker. Returns the exit status."""
+        snapdir = os.path.join(self.output_file, self.snapname(snapnum))
+        command = self.command.format(snapdir=snapdir, snapnum=snapnum)
+        start = time.time()
+        with open(self._marker(snapnum, "log"), 'w') as logfile:
+            status = subprocess.call(command, shell=True, cwd=self.outdir, stdout=logfile, stderr=subprocess.STDOUT)
+        record = {"command": command, "status": status, "walltime": time.time() - start}
+        kind = "done" if status == 0 else "failed"
+        with open(self._marker(snapnum, kind), 'w') as marker:
+            json.dump(record, marker)
+        return status
+
+    def run(self, follow=False, poll=60, timeout=None, stall=3*3600):
+        """Process all snapshots.
+        If follow is true, keep polling for new snapshots every poll seconds until the simulation finishes,
+        timeout seconds have passed, or the simulation has not written cpu.txt for stall seconds
+        (None to wait for ever). Otherwise process the snapshots present now and return.
+        Returns a dictionary from snapshot number to exit status for the snapshots processed."""
+        try:
+            os.makedirs(self.marker_dir)
+        except FileExistsError:
+            pass
+        start = time.time()
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nworkers) as pool:
+            while True:
+                final = not follow or self.finished() or (timeout is not None and time.time() - start > timeout) or (stall is not None and self.stalled(stall, start))
+                for snapnum in self.pending(final=final):
+                    self._queued[snapnum] = pool.submit(self.process, snapnum)
+                for (snapnum, future) in list(self._queued.items()):
+                    if future.done():
+                        results[snapnum] = future.result()
+                        del self._queued[snapnum]
+                if final:
+                    break
+                time.sleep(poll)
+            for (snapnum, future) in self._queued.items():
+                results[snapnum] = future.result()
+            self._queued = {}
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir', type=str, help='Simulation directory')
+    parser.add_argument('--command', type=str, default="python flux_power.py {snapdir}", help='Command to run on each snapshot', required=False)
+    parser.add_argument('--nworkers', type=int, default=2, help='Number of snapshots to process at once', required=False)
+    parser.add_argument('--follow', action='store_true', help='Keep processing new snapshots until the simulation finishes')
+    parser.add_argument('--poll', type=float, default=60, help='Seconds between checks for new snapshots', required=False)
+    parser.add_argument('--timeout', type=float, default=None, help='Stop following after this many seconds', required=False)
+    parser.add_argument('--stall', type=float, default=3*3600, help='Stop following if the simulation writes nothing to cpu.txt for this many seconds', required=False)
+    args = parser.parse_args()
+    SnapshotProcessor(args.outdir, command=args.command, nworkers=args.nworkers).run(follow=args.follow, poll=args.poll, timeout=args.timeout, stall=args.stall)
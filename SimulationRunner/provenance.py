@@ -0,0 +1,138 @@
+"""Module to record which versions of the codes made a simulation, cheaply.
+
+Git commit hashes are read directly from the .git directory (HEAD, loose refs and packed-refs),
+without running git, so this works on nodes without git and costs no fork.
+Results are cached per repository for the lifetime of the process.
+Package versions are read from the installed package metadata, without importing the package
+(with importlib.metadata, or pkg_resources on Python before 3.8).
+Versions which are the same for a whole suite are written once, to provenance.json in the suite directory."""
+
+import datetime
+import json
+import os
+import os.path
+import tempfile
+try:
+    import importlib.metadata as _metadata
+except ImportError:
+    _metadata = None
+
+_GIT_CACHE = {}
+_VERSION_CACHE = {}
+_SUITE_CACHE = {}
+
+def clear_cache():
+    """Forget all cached hashes and versions."""
+    _GIT_CACHE.clear()
+    _VERSION_CACHE.clear()
+    _SUITE_CACHE.clear()
+
+def find_git_dir(path):
+    """Find the git directory of the repository containing path, or None if it is not in a repository.
+    Handles .git files (worktrees and submodules) as well as .git directories."""
+    rpath = os.path.realpath(path)
+    if not os.path.isdir(rpath):
+        rpath = os.path.dirname(rpath)
+    while True:
+        dotgit = os.path.join(rpath, ".git")
+        if os.path.isdir(dotgit):
+            return dotgit
+        if os.path.isfile(dotgit):
+            with open(dotgit, 'r') as fh:
+                line = fh.read().strip()
+            if line.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(rpath, line[len("gitdir:"):].strip()))
+        parent = os.path.dirname(rpath)
+        if parent == rpath:
+            return None
+        rpath = parent
+
+def _common_dir(gitdir):
+    """Directory holding the shared refs: differs from gitdir for worktrees."""
+    try:
+        with open(os.path.join(gitdir, "commondir"), 'r') as fh:
+            return os.path.normpath(os.path.join(gitdir, fh.read().strip()))
+    except FileNotFoundError:
+        return gitdir
+
+def _resolve_ref(gitdir, ref):
+    """Find the commit a ref (eg, refs/heads/master) points to. Returns None if it cannot be found."""
+    for base in (gitdir, _common_dir(gitdir)):
+        try:
+            with open(os.path.join(base, ref), 'r') as fh:
+                value = fh.read().strip()
+            if value.startswith("ref:"):
+                return _resolve_ref(gitdir, value[4:].strip())
+            return value
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    try:
+        with open(os.path.join(_common_dir(gitdir), "packed-refs"), 'r') as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    except FileNotFoundError:
+        pass
+    return None
+
+def git_hash(path):
+    """Get the commit hash of the git repository containing path, or None if there is none."""
+    gitdir = find_git_dir(path)
+    if gitdir is None:
+        return None
+    if gitdir not in _GIT_CACHE:
+        _GIT_CACHE[gitdir] = _resolve_ref(gitdir, "HEAD")
+    return _GIT_CACHE[gitdir]
+
+def package_version(name):
+    """Version of an installed package, or None if it is not installed."""
+    if name not in _VERSION_CACHE:
+        _VERSION_CACHE[name] = _installed_version(name)
+    return _VERSION_CACHE[name]
+
+def _installed_version(name):
+    """Read the version of a package from its metadata."""
+    if _metadata is not None:
+        try:
+            return _metadata.version(name)
+        except _metadata.PackageNotFoundError:
+            return None
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:
+        return None
+
+def suite_provenance(gadget_dir=None, packages=("classylss", "nbodykit", "numpy", "scipy", "configobj")):
+    """Versions of everything which is the same for a whole suite.
+    Computed once per process for each gadget_dir, as every run of a suite asks for them."""
+    key = (gadget_dir, tuple(packages))
+    if key not in _SUITE_CACHE:
+        prov = {"SimulationRunner": git_hash(os.path.dirname(__file__)), "packages": {pp: package_version(pp) for pp in packages}}
+        if gadget_dir is not None:
+            prov["MP-Gadget"] = git_hash(os.path.expanduser(gadget_dir))
+        _SUITE_CACHE[key] = prov
+    return dict(_SUITE_CACHE[key])
+
+def record_suite(suitedir, gadget_dir=None, overwrite=False):
+    """Write provenance.json to a suite directory, unless it is already there. Returns the provenance.
+    The file is written to a temporary file and renamed, so a reader never sees it partly written."""
+    fname = os.path.join(suitedir, "provenance.json")
+    if not overwrite:
+        try:
+            with open(fname, 'r') as jsin:
+                return json.load(jsin)
+        except (FileNotFoundError, ValueError):
+            pass
+    prov = suite_provenance(gadget_dir)
+    prov["date"] = datetime.datetime.now().isoformat()
+    (fd, tmpname) = tempfile.mkstemp(dir=suitedir, prefix=".provenance")
+    try:
+        with os.fdopen(fd, 'w') as jsout:
+            json.dump(prov, jsout, indent=1)
+        os.replace(tmpname, fname)
+    except (OSError, TypeError, ValueError):
+        os.remove(tmpname)
+        raise
+    return prov
@@ -29,10 +29,20 @@ Format is:
  The Compton heating rate is *per electron* and has units of eV/s.
   z      HI_i     HI_h    HeI_i    HeI_h    HeII_i   HeII_h   Compton
 
+Modified tables (rescaled photoheating rates, moved reionization redshift) can be generated
+from the base tables in batches with uvb_variant_files. Each variant is written once, to a file named by a hash of its parameters
+and of the contents of the base table, so editing the base table makes new variants.
 """
+import hashlib
+import os
 import os.path
+import tempfile
 import numpy as np
 
+#Base tables, each read from disc only once.
+_UVB_TABLES = {}
+_UVB_HASHES = {}
+
 def format_HM12_UVB(HM_in_file, HM_out_file):
     """Alter an HM2012 file to have the format required by Gadget. This involves reordering the columns
     and changing the photoheating units."""
@@ -47,8 +57,8 @@ def format_HM12_UVB(HM_in_file, HM_out_file):
     photoion = np.array([hm_in_table[:,1],hm_in_table[:,3], hm_in_table[:,5]])
     #Make output table
     hm_out_table = np.vstack([hm_in_table[:,0], photoion, photoheat]).T
-    #Check shape
-    assert np.shape(hm_out_table) == (59,7)
+    #Check shape: any number of redshifts, 7 columns
+    assert np.shape(hm_out_table)[1] == 7
     #Check we did the conversion the right way
     assert np.max(hm_out_table[:,4:]) < 1e-23
     #(Do not check HeII ion rate as it overlaps heating rate)
@@ -93,3 +103,79 @@ def get_uvb_filename(uvb):
     else:
         raise ValueError("Unsupported UVB table")
     return fuvb
+
+def load_uvb_table(uvb):
+    """Load a UVB table (in gadget format) into an array, reading each file only once."""
+    if uvb not in _UVB_TABLES:
+        with open(get_uvb_filename(uvb), 'rb') as fh:
+            contents = fh.read()
+        table = np.loadtxt(contents.decode().splitlines())
+        table.flags.writeable = False
+        _UVB_TABLES[uvb] = table
+        _UVB_HASHES[uvb] = hashlib.sha1(contents).hexdigest()
+    return _UVB_TABLES[uvb]
+
+def base_table_hash(uvb):
+    """Hash of the contents of a UVB table, as loaded by load_uvb_table."""
+    load_uvb_table(uvb)
+    return _UVB_HASHES[uvb]
+
+def modify_uvb_tables(table, heat_amp, zreion, zpivot=6.):
+    """Make modified UVB tables, vectorized over arrays of parameters.
+    Arguments:
+        table - base table in gadget format.
+        heat_amp - factors multiplying the photoheating rates.
+        zreion - redshift at which the rates should start (the highest redshift with a non-zero HI photoionization rate).
+                 Redshifts above zpivot are stretched linearly so the start moves to zreion, as in the Sherwood table.
+                 NaN leaves the redshifts unchanged.
+    Returns an array of shape (number of parameter sets, number of redshifts, 7)."""
+    (heat_amp, zreion) = np.broadcast_arrays(np.atleast_1d(np.asarray(heat_amp, dtype=np.float64)), np.atleast_1d(np.asarray(zreion, dtype=np.float64)))
+    zz = 10**table[:,0] - 1
+    zstart = np.max(zz[table[:,1] > 0])
+    assert np.all(np.isnan(zreion) + (zreion > zpivot))
+    stretch = np.where(np.isnan(zreion), 1., (zreion - zpivot) / (zstart - zpivot))[:,np.newaxis]
+    znew = zpivot + (zz - zpivot) * stretch
+    tables = np.repeat(table[np.newaxis,:,:], np.size(heat_amp), axis=0)
+    #Only change the rows which move, to avoid round-off elsewhere
+    tables[:,:,0] = np.where((zz > zpivot) * (stretch != 1), np.log10(1 + znew), table[:,0])
+    tables[:,:,4:] *= heat_amp[:,np.newaxis,np.newaxis]
+    return tables
+
+def _variant_name(uvb, heat_amp, zreion, zpivot):
+    """File name of a modified table: a hash of the base table and parameters."""
+    key = repr((uvb, base_table_hash(uvb), float(heat_amp), None if np.isnan(zreion) else float(zreion), float(zpivot)))
+    return "TREECOOL_"+uvb+"_"+hashlib.sha1(key.encode()).hexdigest()[:12]
+
+def uvb_variant_files(uvb, heat_amp, zreion, cachedir, zpivot=6.):
+    """Get modified TREECOOL files for arrays of parameters (see modify_uvb_tables), writing those not already in cachedir.
+    zreion may be None to leave the redshifts unchanged. Each unique parameter set is generated once.
+    Returns the list of file names, one for each parameter set."""
+    if zreion is None:
+        zreion = np.nan
+    (heat_amp, zreion) = np.broadcast_arrays(np.atleast_1d(np.asarray(heat_amp, dtype=np.float64)), np.atleast_1d(np.asarray(zreion, dtype=np.float64)))
+    names = [os.path.join(cachedir, _variant_name(uvb, hh, zr, zpivot)) for (hh, zr) in zip(heat_amp, zreion)]
+    missing = {}
+    for (ii, name) in enumerate(names):
+        if not os.path.exists(name):
+            missing.setdefault(name, ii)
+    if missing:
+        try:
+            os.makedirs(cachedir)
+        except FileExistsError:
+            pass
+        index = np.array(list(missing.values()))
+        tables = modify_uvb_tables(load_uvb_table(uvb), heat_amp[index], zreion[index], zpivot=zpivot)
+        for (name, table) in zip(missing.keys(), tables):
+            #Write to a temporary file so a partly written table is never used.
+            #Its name is unique, so several processes filling the same cache do not write to the same file.
+            (fd, tmpname) = tempfile.mkstemp(dir=cachedir, prefix=".uvb")
+            try:
+                with os.fdopen(fd, 'wb') as fh:
+                    np.savetxt(fh, table, fmt="%1.6e")
+                #mkstemp makes the file private: the cache may be shared.
+                os.chmod(tmpname, 0o644)
+                os.replace(tmpname, name)
+            except:
+                os.remove(tmpname)
+                raise
+    return names
@@ -12,22 +12,29 @@ import os
 import os.path as path
 import distutils.spawn
 
-def rebuild_MP(rundir, codedir, config_file="Options.mk", binary=["gadget/MP-Gadget", "genic/MP-GenIC"]):
+def rebuild_MP(rundir, codedir, config_file="Options.mk", binary=["gadget/MP-Gadget", "genic/MP-GenIC"], asset_store=None):
     """rebuild, but with defaults appropriate for MP-Gadget."""
-    return rebuild(rundir, codedir,config_file=config_file, binary=binary)
+    return rebuild(rundir, codedir,config_file=config_file, binary=binary, asset_store=asset_store)
 
-def rebuild(rundir, codedir, config_file="Config.sh", binary=["P-Gadget3",]):
+def rebuild(rundir, codedir, config_file="Config.sh", binary=["P-Gadget3",], asset_store=None):
     """Rebuild all Gadget binaries in subdirectories of rundir.
     Arguments:
     rundir: Parent of simulation directories
     codedir: Location of the Makefile.
     binary: name of file to rebuild.
-    config_file: Name of configuration file which specifies compile flags. Should be within the rundir."""
+    config_file: Name of configuration file which specifies compile flags. Should be within the rundir.
+    asset_store: If not None, directory of a content-addressed store.
+    Binaries are then stored once and hard linked into each directory, rather than copied."""
     #Find all subdirs with config files.
     rundir = path.expanduser(rundir)
     codedir = path.expanduser(codedir)
     configs = glob.glob(path.join(path.join(rundir, "*"),config_file))
     configs += glob.glob(path.join(rundir,config_file))
+    store = None
+    if asset_store is not None:
+        #Imported here so the rest of this module does not need it.
+        from . import assets
+        store = assets.AssetStore(asset_store)
     #First run.
     first = True
     for cc in configs:
@@ -50,9 +57,17 @@ def rebuild(rundir, codedir, config_file="Config.sh", binary=["P-Gadget3",]):
             if make_retcode:
                 raise RuntimeError("make failed on ",cc)
             first = False
-        #Note that if dst is a symlink, this will overwrite the contents
-        #of the symlink instead of breaking it.
         for bi in binary:
+            #Identical binaries are only stored once.
+            if store is not None:
+                store.install(path.join(codedir, bi), path.join(directory, os.path.basename(bi)))
+                continue
+            #Note that if dst is a symlink, this will overwrite the contents
+            #of the symlink instead of breaking it.
+            #Hard links (eg, from an asset store) are broken so the other copies are not changed.
+            dest = path.join(directory, os.path.basename(bi))
+            if path.exists(dest) and not path.islink(dest) and os.stat(dest).st_nlink > 1:
+                os.remove(dest)
             shutil.copy2(path.join(codedir, bi), path.join(directory, os.path.basename(bi)))
     return configs
 
@@ -68,13 +83,109 @@ def detect_submit():
     #Otherwise not sure what to do.
     raise ValueError("Could not find sbatch or qsub")
 
-def resub(rundir, script_file="mpi_submit", submit_command=None):
-    """Submit all jobs in the emulator to the queueing system"""
+def directive_lines(text):
+    """The scheduler directives (SLURM or PBS) in the text of a submission script, without the job name.
+    Returns a tuple, so that scripts asking for the same resources can be grouped."""
+    directives = []
+    for line in text.splitlines():
+        if not re.match("#(SBATCH|PBS)", line):
+            continue
+        if re.search(r"--job-name|^#PBS +-N ", line):
+            continue
+        directives.append(line)
+    return tuple(directives)
+
+def detect_pbs_pro():
+    """True if the PBS scheduler here is PBS Pro (which has /etc/pbs.conf) rather than Torque."""
+    return path.exists("/etc/pbs.conf")
+
+def write_array_submit(rundir, odirs, directives, script_file="mpi_submit", array_file="mpi_submit_array", name=None, max_concurrent=None, pbs_pro=None):
+    """Write a job array script which runs script_file in each of odirs, one array index per directory.
+    directives are the scheduler directive lines of a single run, from directive_lines.
+    The directories are listed, one per line, in array_file+".dirs", and each array task runs
+    script_file with bash in its directory, so the directives in script_file are ignored.
+    The submission directory variables are set to the run directory, as scripts may cd to them.
+    If max_concurrent is not None, at most this many runs execute at once.
+    pbs_pro selects PBS Pro (-J) rather than Torque (-t) arrays for PBS directives. If None, it is detected.
+    Returns the path of the script, or None if there are no directories."""
+    if not odirs:
+        return None
+    rundir = path.expanduser(rundir)
+    if name is None:
+        name = path.basename(path.normpath(rundir))
+    table = path.join(rundir, array_file+".dirs")
+    with open(table, 'w') as fh:
+        for odir in odirs:
+            fh.write(path.abspath(path.expanduser(odir))+"\n")
+    indices = "0-"+str(len(odirs)-1)
+    script = path.join(rundir, array_file)
+    with open(script, 'w') as fh:
+        fh.write("#!/bin/bash\n")
+        for line in directives:
+            fh.write(line+"\n")
+        if any([line.startswith("#SBATCH") for line in directives]):
+            fh.write("#SBATCH --job-name="+name+"\n")
+            if max_concurrent is not None:
+                indices += "%"+str(max_concurrent)
+            fh.write("#SBATCH --array="+indices+"\n")
+        else:
+            fh.write("#PBS -N "+name+"\n")
+            if pbs_pro is None:
+                pbs_pro = detect_pbs_pro()
+            if pbs_pro:
+                fh.write("#PBS -J "+indices+"\n")
+                if max_concurrent is not None:
+                    fh.write("#PBS -W max_run_subjobs="+str(max_concurrent)+"\n")
+            else:
+                if max_concurrent is not None:
+                    indices += "%"+str(max_concurrent)
+                fh.write("#PBS -t "+indices+"\n")
+        #SLURM, Torque and PBS Pro name the array index differently.
+        fh.write("SR_INDEX=${SLURM_ARRAY_TASK_ID:-${PBS_ARRAYID:-$PBS_ARRAY_INDEX}}\n")
+        fh.write('cd "$(sed -n "$((SR_INDEX+1))p" '+table+')" || exit 1\n')
+        #The per-run scripts may cd to the submission directory, which is the suite directory for an array.
+        fh.write('export PBS_O_WORKDIR="$PWD" SLURM_SUBMIT_DIR="$PWD"\n')
+        fh.write("bash "+script_file+"\n")
+    return script
+
+def submit_array(rundir, odirs, script_file="mpi_submit", submit_command=None, max_concurrent=None, pbs_pro=None):
+    """Submit script_file in each of odirs as job arrays, rather than one job per directory.
+    All tasks of an array have the same resources, so there is one array for each distinct set
+    of directives in the scripts: usually only one. pbs_pro is passed to write_array_submit.
+    Returns the list of array scripts submitted."""
+    if submit_command is None:
+        submit_command = detect_submit()
+    rundir = path.expanduser(rundir)
+    groups = {}
+    order = []
+    for odir in odirs:
+        with open(path.join(odir, script_file), 'r') as fh:
+            directives = directive_lines(fh.read())
+        if directives not in groups:
+            groups[directives] = []
+            order.append(directives)
+        groups[directives].append(odir)
+    scripts = []
+    for (ii, directives) in enumerate(order):
+        array_file = script_file+"_array"
+        if len(order) > 1:
+            array_file += "_"+str(ii)
+        script = write_array_submit(rundir, groups[directives], directives, script_file=script_file, array_file=array_file, max_concurrent=max_concurrent, pbs_pro=pbs_pro)
+        print("Submitting array of ",len(groups[directives])," jobs: ",script)
+        subprocess.call([submit_command, array_file], cwd=rundir)
+        scripts.append(script)
+    return scripts
+
+def resub(rundir, script_file="mpi_submit", submit_command=None, array=False, max_concurrent=None):
+    """Submit all jobs in the emulator to the queueing system.
+    If array is True, submit them as job arrays (see submit_array)."""
     #Find all subdirs with config files.
     if submit_command is None:
         submit_command = detect_submit()
     rundir = path.expanduser(rundir)
     configs = glob.glob(path.join(path.join(rundir, "*"),script_file))
+    if array:
+        return submit_array(rundir, [path.dirname(cc) for cc in configs], script_file=script_file, submit_command=submit_command, max_concurrent=max_concurrent)
     for cc in configs:
         cdir = path.dirname(cc)
         subprocess.call([submit_command, script_file], cwd=cdir)
@@ -128,14 +239,29 @@ def _get_redshift_snapshot(snapshot):
                 return 1./float(m.groups()[0])-1
     raise IOError("No redshift in file")
 
-def _find_snap(outputs,output_file, snap="PART_"):
-    """Find the last written snapshot"""
-    written = glob.glob(path.join(path.join(outputs, output_file),snap+"[0-9][0-9][0-9]"))
-    if not written:
+def _find_snaps(outputs, output_file, snap="PART_"):
+    """Find the numbers of all written snapshots, in order."""
+    written = glob.glob(path.join(path.join(outputs, output_file),snap+"[0-9][0-9][0-9]*"))
+    #Snapshot numbers have at least three digits, more after snapshot 999.
+    matches = [re.match(re.escape(snap)+"([0-9]{3,})$",path.basename(wr)) for wr in written]
+    return sorted([int(mm.group(1)) for mm in matches if mm is not None])
+
+def _find_snap(outputs,output_file, snap="PART_", verify=False):
+    """Find the last written snapshot.
+    If verify is True, skip snapshots which were not completely written."""
+    snapnums = _find_snaps(outputs, output_file, snap)
+    if not snapnums:
         raise IOError("No snapshots for",outputs)
-    matches = [re.search(snap+"([0-9][0-9][0-9])",wr) for wr in written]
-    snapnums = [int(mm.group(1)) for mm in matches]
-    return sorted(snapnums)[-1]
+    if not verify:
+        return snapnums[-1]
+    #Imported here so the rest of this module does not need numpy.
+    from . import integrity
+    for snapnum in reversed(snapnums):
+        snapdir = path.join(path.join(outputs, output_file),snap+str(snapnum).rjust(3,'0'))
+        if integrity.snapshot_ok(snapdir):
+            return snapnum
+        print("Skipping incomplete snapshot: ",snapdir)
+    raise IOError("No complete snapshots for",outputs)
 
 def _get_regex(odir, output_file):
     """Determine which file type we are parsing: Gadget-3 or MP-Gadget."""
@@ -186,21 +312,24 @@ def print_status(rundir, output_file="output", endz=2.01):
         else:
             print("COMPLETE")
 
-def resub_not_complete(rundir, output_file="output", endz=2.01, script_file="mpi_submit", resub_command=None, paramfile="mpgadget.param", restart=1, snap="PART_"):
+def resub_not_complete(rundir, output_file="output", endz=2.01, script_file="mpi_submit", resub_command=None, paramfile="mpgadget.param", restart=1, snap="PART_", verify=False, array=False, max_concurrent=None):
     """Resubmit incomplete simulations to the queue.
-    We also edit the script file to add a RestartFlag"""
+    We also edit the script file to add a RestartFlag.
+    If verify is True and we restart from a snapshot, incompletely written snapshots are skipped.
+    If array is True, resubmit them as job arrays (see submit_array)."""
     if resub_command is None:
         resub_command = detect_submit()
     outputs, completes, _ = check_status(rundir, output_file, endz)
+    script_file_resub = script_file+"_resub"
+    resubmit = []
     #Pathnames for incomplete simulations
     for odir,cc in zip(outputs,completes):
         if cc:
             continue
         rest = " "+str(restart)
         if restart == 2:
-            snapnum = _find_snap(odir, output_file,snap=snap)
+            snapnum = _find_snap(odir, output_file,snap=snap, verify=verify)
             rest += " "+str(snapnum)
-        script_file_resub = script_file+"_resub"
         found = False
         with open(path.join(odir, script_file),'r') as ifile:
             with open(path.join(odir, script_file_resub),'w') as ofile:
@@ -215,27 +344,42 @@ def resub_not_complete(rundir, output_file="output", endz=2.01, script_file="mpi
                     #Write each line straight through to the output by default.
                     ofile.write(line)
                     line = ifile.readline()
-        if found:
+        if found and array:
+            resubmit.append(odir)
+        elif found:
             print("Re-submitting: ",path.join(odir, script_file_resub))
             subprocess.call([resub_command, script_file_resub], cwd=odir)
         else:
             print("ERROR: no change, not re-submitting: ",path.join(odir, script_file_resub))
+    if resubmit:
+        submit_array(rundir, resubmit, script_file=script_file_resub, submit_command=resub_command, max_concurrent=max_concurrent)
 
-def check_status_ics(rundir, icdir="ICS"):
-    """Get IC generation status for every directory in the suite."""
+def check_status_ics(rundir, icdir="ICS", verify=False):
+    """Get IC generation status for every directory in the suite.
+    If verify is True, also check that the ICs were completely written."""
     rundir = path.expanduser(rundir)
     odirs = glob.glob(path.join(rundir, "*"+os.path.sep))
     if not odirs:
         raise IOError(rundir +" is empty.")
     icex = lambda odir: bool(glob.glob(path.join(path.join(odir, icdir),"*/Header/attr-v2")))
+    if verify:
+        from . import integrity
+        icex = lambda odir: any([integrity.snapshot_ok(path.dirname(hh)) for hh in glob.glob(path.join(path.join(odir, icdir),"*/Header"))])
     exists = [icex(cc) for cc in odirs]
     return odirs, exists
 
-def resub_not_complete_genic(rundir, icdir="ICS", script_file="mpi_submit_genic", resub_command=None):
-    """Resubmit failed IC generations to the queue."""
+def resub_not_complete_genic(rundir, icdir="ICS", script_file="mpi_submit_genic", resub_command=None, verify=False, array=False, max_concurrent=None):
+    """Resubmit failed IC generations to the queue.
+    If verify is True, truncated ICs are also regenerated.
+    If array is True, resubmit them as job arrays (see submit_array)."""
     if resub_command is None:
         resub_command = detect_submit()
-    outputs, completes = check_status_ics(rundir, icdir)
+    outputs, completes = check_status_ics(rundir, icdir, verify=verify)
+    if array:
+        resubmit = [odir for (odir, cc) in zip(outputs, completes) if not cc]
+        if resubmit:
+            submit_array(rundir, resubmit, script_file=script_file, submit_command=resub_command, max_concurrent=max_concurrent)
+        return
     #Pathnames for incomplete simulations
     for odir,cc in zip(outputs,completes):
         if cc:
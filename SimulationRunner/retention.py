@@ -0,0 +1,189 @@
+"""Module to account for the disk used by a suite and to remove snapshots which are no longer needed.
+
+Disk usage is found by a parallel os.scandir walk, and reported per run, per snapshot and per block.
+Files hard linked into several runs (see assets.py) are only counted once per suite.
+
+The retention policy keeps:
+    - the snapshot nearest each required redshift (by default, the output_redshifts in SimulationICs.json),
+    - the latest complete snapshot, which is needed to restart the simulation,
+    - any snapshot which has not been post-processed (see postprocess.py).
+Other snapshots are deleted or compressed into a tar file. By default nothing is changed (dry run)."""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import os.path
+import shutil
+import tarfile
+import threading
+import numpy as np
+from . import remake
+from . import integrity
+
+class InodeSet(object):
+    """A set of (device, inode) pairs which may be shared between threads."""
+    def __init__(self):
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def add_new(self, key):
+        """Add an inode. Returns True if it was not already in the set."""
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            return True
+
+def tree_usage(path, seen=None):
+    """Total bytes in all files under path. Hard linked files whose inode is in seen (an InodeSet) are not counted again."""
+    if seen is None:
+        seen = InodeSet()
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += tree_usage(entry.path, seen)
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if st.st_nlink > 1 and not seen.add_new((st.st_dev, st.st_ino)):
+                    continue
+                total += st.st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+def snapshot_usage(snapdir):
+    """Bytes used by a snapshot. Returns a dictionary with the total and a dictionary of bytes per block (eg, '1/Position')."""
+    blocks = {}
+    for ptype in os.scandir(snapdir):
+        if not ptype.is_dir():
+            continue
+        for block in os.scandir(ptype.path):
+            if block.is_dir():
+                blocks[ptype.name+"/"+block.name] = tree_usage(block.path)
+    return {"total": tree_usage(snapdir), "blocks": blocks}
+
+def run_usage(odir, output_file="output", snap="PART_", seen=None):
+    """Bytes used by a single run: the total, and the usage of each snapshot.
+    Hard linked files already in seen are not counted in the total."""
+    outputs = os.path.join(odir, output_file)
+    snapshots = {}
+    for snapnum in remake._find_snaps(odir, output_file, snap):
+        name = snap+str(snapnum).rjust(3,'0')
+        snapshots[name] = snapshot_usage(os.path.join(outputs, name))
+    return {"total": tree_usage(odir, seen), "snapshots": snapshots}
+
+def suite_usage(rundir, output_file="output", snap="PART_", nworkers=8):
+    """Bytes used by every run in a suite, scanned in parallel. Returns a dictionary from run directory to run_usage.
+    A file hard linked into several runs is counted once, in the total of whichever run is scanned first."""
+    rundir = os.path.expanduser(rundir)
+    odirs = sorted([entry.path for entry in os.scandir(rundir) if entry.is_dir() and not entry.name.startswith(".")])
+    seen = InodeSet()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nworkers) as pool:
+        usage = pool.map(lambda odir: run_usage(odir, output_file, snap, seen), odirs)
+        return dict(zip(odirs, usage))
+
+def print_usage(usage, gb=2**30):
+    """Print a table of disk usage per run, in GB."""
+    total = 0
+    for (odir, uu) in sorted(usage.items()):
+        snaps = sum([ss["total"] for ss in uu["snapshots"].values()])
+        print(os.path.basename(odir), ": %.2f GB, %d snapshots (%.2f GB)" % (uu["total"]/gb, len(uu["snapshots"]), snaps/gb))
+        total += uu["total"]
+    print("Total: %.2f GB" % (total/gb))
+
+class RetentionPolicy(object):
+    """Decide which snapshots of a run can be removed.
+    Arguments:
+        output_redshifts - redshifts to keep. If None, read output_redshifts from SimulationICs.json in each run.
+        action - 'delete' or 'compress' (to a .tar.gz next to the snapshot) for snapshots not kept.
+        require_postprocessed - only remove snapshots with a done marker in output/postprocessed.
+        checksum - check checksums when finding the latest complete snapshot."""
+    def __init__(self, output_redshifts=None, action="delete", require_postprocessed=True, checksum=False, output_file="output", snap="PART_", marker_dir="postprocessed"):
+        assert action in ("delete", "compress")
+        self.output_redshifts = output_redshifts
+        self.action = action
+        self.require_postprocessed = require_postprocessed
+        self.checksum = checksum
+        self.output_file = output_file
+        self.snap = snap
+        self.marker_dir = marker_dir
+
+    def _required_redshifts(self, odir):
+        """Redshifts which must be kept for a run."""
+        if self.output_redshifts is not None:
+            return list(self.output_redshifts)
+        try:
+            with open(os.path.join(odir, "SimulationICs.json"), 'r') as jsin:
+                return list(json.load(jsin).get("output_redshifts", []))
+        except (IOError, ValueError):
+            return []
+
+    def plan(self, odir):
+        """Decide what to do with each snapshot in a run.
+        Returns a list of (snapshot directory, action, reason), where action is 'keep', 'delete' or 'compress'."""
+        outputs = os.path.join(odir, self.output_file)
+        snapnums = remake._find_snaps(odir, self.output_file, self.snap)
+        snapdirs = [os.path.join(outputs, self.snap+str(snapnum).rjust(3,'0')) for snapnum in snapnums]
+        redshifts = []
+        for snapdir in snapdirs:
+            try:
+                redshifts.append(1./integrity.read_header_attrs(snapdir)["Time"][0] - 1)
+            except (IOError, KeyError, IndexError):
+                redshifts.append(np.nan)
+        redshifts = np.array(redshifts)
+        keep = {}
+        for zz in self._required_redshifts(odir):
+            if np.any(np.isfinite(redshifts)):
+                keep[int(np.nanargmin(np.abs(redshifts - zz)))] = "required redshift "+str(zz)
+        #Snapshots newer than the latest complete one may still be being written: never remove them.
+        latest = -1
+        for ii in reversed(range(len(snapdirs))):
+            if integrity.snapshot_ok(snapdirs[ii], checksum=self.checksum):
+                keep.setdefault(ii, "latest restart")
+                latest = ii
+                break
+        for ii in range(latest+1, len(snapdirs)):
+            keep.setdefault(ii, "in progress")
+        plan = []
+        for (ii, snapdir) in enumerate(snapdirs):
+            marker = os.path.join(os.path.join(outputs, self.marker_dir), os.path.basename(snapdir)+".done")
+            if ii in keep:
+                plan.append((snapdir, "keep", keep[ii]))
+            elif self.require_postprocessed and not os.path.exists(marker):
+                plan.append((snapdir, "keep", "not post-processed"))
+            else:
+                plan.append((snapdir, self.action, "not needed"))
+        return plan
+
+    def apply(self, odir, dry_run=True):
+        """Delete or compress the snapshots not kept by plan. If dry_run, only print what would be done.
+        Returns the plan."""
+        plan = self.plan(odir)
+        for (snapdir, action, reason) in plan:
+            print(action, snapdir, ":", reason)
+            if dry_run or action == "keep":
+                continue
+            if action == "compress":
+                with tarfile.open(snapdir+".tar.gz", "w:gz") as tar:
+                    tar.add(snapdir, arcname=os.path.basename(snapdir))
+            shutil.rmtree(snapdir)
+        return plan
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rundir', type=str, help='Directory containing the simulation directories')
+    parser.add_argument('--apply', action='store_true', help='Actually remove snapshots, rather than a dry run')
+    parser.add_argument('--compress', action='store_true', help='Compress snapshots instead of deleting them')
+    parser.add_argument('--redshifts', type=float, nargs='*', default=None, help='Redshifts to keep (default: output_redshifts of each run)')
+    args = parser.parse_args()
+    suite = suite_usage(args.rundir)
+    print_usage(suite)
+    policy = RetentionPolicy(output_redshifts=args.redshifts, action="compress" if args.compress else "delete")
+    for rr in sorted(suite):
+        policy.apply(rr, dry_run=not args.apply)
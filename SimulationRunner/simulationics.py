@@ -1,20 +1,23 @@
 """Class to generate simulation ICS, separated out for clarity."""
 from __future__ import print_function
 import os.path
+import copy
 import math
+import shutil
 import subprocess
 import json
-import shutil
 #To do crazy munging of types for the storage format
 import importlib
 import numpy as np
 import configobj
-import classylss
-import classylss.binding as CLASS
 from . import utils
 from . import clusters
 from . import read_uvb_tab
-from . import cambpower
+from . import outputs
+from . import assets
+from . import classworker
+from . import growth
+from . import provenance
 
 class SimulationICs(object):
     """
@@ -43,8 +46,28 @@ class SimulationICs(object):
     ns - Scalar spectral index
     m_nu - neutrino mass
     unitary - if true, do not scatter modes, but use a unitary gaussian amplitude.
+    output_budget - if not None, disk budget in bytes for this run (ICs and snapshots).
+                    Output times are then chosen to fit the budget.
+    output_redshifts - redshifts at which a snapshot must be written, whatever the budget.
+    asset_store - if not None, directory of a content-addressed store shared by the suite.
+                  TREECOOL, cambpower.py and the binaries are then linked from it rather than copied.
+                  If True, use a store called .assets in the parent of outdir.
+    telemetry - if true, the submission scripts record wall time, nodes, exit status and memory of each job.
+    chain - if > 0, Gadget jobs which hit the wall time limit resubmit themselves with the restart flag, up to chain times.
+    paired - if true, make_simulation also makes a partner simulation in outdir+"_inv", identical but with the phases of the initial modes inverted.
+             Combined with unitary this gives paired-and-fixed initial conditions.
+    cost_model - if not None, an object with a predict method giving node-hours for a simulation (see costmodel.py).
+                 The time limit and node count of the submission script are then set from the prediction.
+    safety - factor by which to multiply the predicted cost when setting the time limit.
+    max_nodes - if not None, the node count may be increased up to this so the run fits in the cluster time limit.
+    uvb_heat_amp - factor multiplying the photoheating rates of the UVB table.
+    uvb_zreion - if not None, the UVB table is stretched so that it starts at this redshift.
+                 Modified tables are generated once, in uvb_cache.
+    uvb_cache - directory for modified UVB tables. By default .uvb in outdir: suites may pass a directory of their own to share the tables.
+    rescale_growth - if true, CLASS output at the output redshifts is derived by rescaling with the growth factor,
+                     and checked at one redshift, rather than extracted at each (see growth.py).
     """
-    def __init__(self, *, outdir, box, npart, seed = 9281110, redshift=99, redend=0, separate_gas=True, omega0=0.288, omegab=0.0472, hubble=0.7, scalar_amp=2.427e-9, ns=0.97, rscatter=False, m_nu=0, nu_hierarchy='degenerate', uvb="pu", cluster_class=clusters.StampedeClass, nu_acc=1e-5, unitary=True):
+    def __init__(self, *, outdir, box, npart, seed = 9281110, redshift=99, redend=0, separate_gas=True, omega0=0.288, omegab=0.0472, hubble=0.7, scalar_amp=2.427e-9, ns=0.97, rscatter=False, m_nu=0, nu_hierarchy='degenerate', uvb="pu", cluster_class=clusters.StampedeClass, nu_acc=1e-5, unitary=True, output_budget=None, output_redshifts=(), asset_store=None, telemetry=False, chain=0, paired=False, cost_model=None, safety=1.2, max_nodes=None, rescale_growth=False, uvb_heat_amp=1., uvb_zreion=None, uvb_cache=None):
         #Check that input is reasonable and set parameters
         #In Mpc/h
         assert box < 20000
@@ -68,11 +91,25 @@ class SimulationICs(object):
         assert ns > 0 and ns < 2
         self.ns = ns
         self.unitary = unitary
+        #Paired simulations, with inverted phases
+        self.paired = paired
+        self.invert_phase = False
+        #Cost prediction, to set job resources
+        self._cost_model = cost_model
+        self.safety = safety
+        self.max_nodes = max_nodes
+        #Disk budget for outputs
+        self.output_budget = output_budget
+        self.output_redshifts = list(output_redshifts)
         #Neutrino accuracy for CLASS
         self.nu_acc = nu_acc
+        self.rescale_growth = rescale_growth
         #UVB? Only matters if gas
         self.uvb = uvb
         assert self.uvb == "hm" or self.uvb == "fg" or self.uvb == "sh" or self.uvb == "pu"
+        self.uvb_heat_amp = uvb_heat_amp
+        self.uvb_zreion = uvb_zreion
+        self.uvb_cache = uvb_cache
         self.rscatter = rscatter
         outdir = os.path.realpath(os.path.expanduser(outdir))
         #Make the output directory: will fail if parent does not exist
@@ -91,12 +128,21 @@ class SimulationICs(object):
         self.m_nu = m_nu
         self.nu_hierarchy = nu_hierarchy
         self.outdir = outdir
+        if asset_store is True:
+            asset_store = os.path.join(os.path.dirname(outdir), ".assets")
+        self.asset_store = asset_store
         self._set_default_paths()
-        self._cluster = cluster_class(gadget=self.gadgetexe, param=self.gadgetparam, genic=self.genicexe, genicparam=self.genicout)
+        self._cluster = cluster_class(gadget=self.gadgetexe, param=self.gadgetparam, genic=self.genicexe, genicparam=self.genicout, telemetry=telemetry, chain=chain)
         #For repeatability, we store git hashes of Gadget, GenIC, CAMB and ourselves
         #at time of running.
         self.simulation_git = utils.get_git_hash(os.path.dirname(__file__))
 
+    def set_cluster(self, cluster_class, **kwargs):
+        """Change the cluster this simulation will run on. Telemetry and chaining settings are kept.
+        Extra arguments are passed to cluster_class."""
+        old = self._cluster
+        self._cluster = cluster_class(gadget=self.gadgetexe, param=self.gadgetparam, genic=self.genicexe, genicparam=self.genicout, telemetry=old.telemetry, chain=old.chain, **kwargs)
+
     def _set_default_paths(self):
         """Default paths and parameter names."""
         #Default parameter file names
@@ -111,8 +157,8 @@ class SimulationICs(object):
         self.gadgetconfig = "Options.mk"
         self.gadget_dir = os.path.expanduser("~/codes/MP-Gadget/")
 
-    def cambfile(self):
-        """Generate the IC power spectrum using classylss."""
+    def class_params(self):
+        """The CLASS parameters for this simulation, and the redshifts at which CLASS output is needed."""
         #Load high precision defaults
         pre_params = {'tol_background_integration': 1e-9, 'tol_perturb_integration' : 1.e-7, 'tol_thermo_integration':1.e-5, 'k_per_decade_for_pk': 50,'k_bao_width': 8, 'k_per_decade_for_bao':  200, 'neglect_CMB_sources_below_visibility' : 1.e-30, 'transfer_neglect_late_source': 3000., 'l_max_g' : 50, 'l_max_ur':150, 'extra metric transfer functions': 'y'}
         #Set the neutrino density and subtract it from omega0
@@ -153,7 +199,10 @@ class SimulationICs(object):
         #At which redshifts should we produce CAMB output: we want the start and end redshifts of the simulation,
         #but we also want some other values for checking purposes
         camb_zz = np.concatenate([[self.redshift,], 1/self.generate_times()-1,[self.redend,]])
+        return (pre_params, camb_zz)
 
+    def _write_class_params(self, pre_params, camb_zz):
+        """Save the CLASS parameters, so they can be inspected and rerun."""
         cambpars = os.path.join(self.outdir, "_class_params.ini")
         classconf = configobj.ConfigObj()
         classconf.filename = cambpars
@@ -161,8 +210,15 @@ class SimulationICs(object):
         classconf['z_pk'] = camb_zz
         classconf.write()
 
-        engine = CLASS.ClassEngine(pre_params)
-        powspec = CLASS.Spectra(engine)
+    def cambfile(self):
+        """Generate the IC power spectrum using classylss."""
+        (pre_params, camb_zz) = self.class_params()
+        self._write_class_params(pre_params, camb_zz)
+        #Uses the CLASS worker if one is running
+        if self.rescale_growth:
+            (linear, self.growth_rescaled) = growth.rescaled_linear(pre_params, camb_zz, massive_nu=self.m_nu > 0)
+        else:
+            linear = classworker.compute_linear(pre_params, camb_zz)
         #Save directory
         camb_output = "camb_linear/"
         camb_outdir = os.path.join(self.outdir,camb_output)
@@ -172,13 +228,9 @@ class SimulationICs(object):
             pass
         #Save directory
         #Get and save the transfer functions
-        for zz in camb_zz:
-            trans = powspec.get_transfer(z=zz)
-            #fp-roundoff
-            trans['k'][-1] *= 0.9999
+        for (zz, (trans, pk_lin)) in zip(camb_zz, linear):
             transferfile = os.path.join(camb_outdir, "ics_transfer_"+self._camb_zstr(zz)+".dat")
             save_transfer(trans, transferfile)
-            pk_lin = powspec.get_pklin(k=trans['k'], z=zz)
             pkfile = os.path.join(camb_outdir, "ics_matterpow_"+self._camb_zstr(zz)+".dat")
             np.savetxt(pkfile, np.vstack([trans['k'], pk_lin]).T)
 
@@ -212,6 +264,8 @@ class SimulationICs(object):
         config['ProduceGas'] = int(self.separate_gas)
         #Suppress Gaussian mode scattering
         config['UnitaryAmplitude'] = int(self.unitary)
+        if self.invert_phase:
+            config['InvertPhase'] = 1
         #The 2LPT correction is computed for one fluid. It is not clear
         #what to do with a second particle species, so turn it off.
         #Even for CDM alone there are corrections from radiation:
@@ -275,6 +329,8 @@ class SimulationICs(object):
         self._really_types = []
         cc = self._cluster
         self._cluster = 0
+        cm = self._cost_model
+        self._cost_model = None
         for nn, val in self.__dict__.items():
             #Convert arrays to lists
             if isinstance(val, np.ndarray):
@@ -289,14 +345,17 @@ class SimulationICs(object):
         #Turn the changed types back.
         self._fromarray()
         self._cluster = cc
+        self._cost_model = cm
 
     def load_txt_description(self):
         """Load the text file describing the parameters of the code that generated a simulation."""
         cc = self._cluster
+        cm = self._cost_model
         with open(os.path.join(self.outdir, "SimulationICs.json"), 'r') as jsin:
             self.__dict__ = json.load(jsin)
         self._fromarray()
         self._cluster = cc
+        self._cost_model = cm
 
     def gadget3config(self, prefix="OPT += -D"):
         """Generate a config Options file for Yu Feng's MP-Gadget.
@@ -366,7 +425,7 @@ class SimulationICs(object):
         #FOF
         config['SnapshotWithFOF'] = 1
         config['FOFHaloLinkingLength'] = 0.2
-        config['OutputList'] =  ','.join([str(t) for t in self.generate_times()])
+        config['OutputList'] =  ','.join([str(t) for t in self.output_times()])
         #These are only used for gas, but must be set anyway
         config['MinGasTemp'] = 100
         #In equilibrium with the CMB at early times.
@@ -417,10 +476,59 @@ class SimulationICs(object):
         assert np.size(times[ii]) > 0
         return times[ii]
 
+    def required_output_times(self):
+        """Output times which must be written, whatever the disk budget."""
+        astart = 1./(1+self.redshift)
+        aend = 1./(1+self.redend)
+        times = 1./(1.+np.array(self.output_redshifts, dtype=np.float64))
+        return times[np.where((times > astart)*(times < aend))]
+
+    def output_times(self):
+        """Output times actually written to the parameter file.
+        These are the times from generate_times, thinned to fit in output_budget if it is set."""
+        required = self.required_output_times()
+        if self.output_budget is None:
+            return np.unique(np.concatenate([self.generate_times(), required]))
+        budget = self.output_budget - self.ics_bytes()
+        return outputs.plan_outputs(self.generate_times(), self.snapshot_bytes(), budget, required_times=required, astart=1./(1+self.redshift), aend=1./(1+self.redend))
+
+    def _nu_ngrid(self):
+        """Cube root of the number of neutrino particles."""
+        return 0
+
+    def snapshot_bytes(self):
+        """Estimated size of a single snapshot in bytes."""
+        return outputs.snapshot_bytes(self.npart, separate_gas=self.separate_gas, nu_ngrid=self._nu_ngrid())
+
+    def ics_bytes(self):
+        """Estimated size of the initial conditions in bytes."""
+        return outputs.ics_bytes(self.npart, separate_gas=self.separate_gas, nu_ngrid=self._nu_ngrid())
+
+    def storage_report(self):
+        """Projected disk usage of this simulation."""
+        nsnap = np.size(self.output_times())
+        report = {'snapshot_bytes': self.snapshot_bytes(), 'ics_bytes': self.ics_bytes(), 'nsnap': nsnap}
+        report['total_bytes'] = report['ics_bytes'] + nsnap * report['snapshot_bytes']
+        return report
+
+    def check_storage(self):
+        """Check the projected disk usage before the submission scripts are written.
+        Raises ValueError if it exceeds output_budget, and warns if it exceeds the free space on the disk."""
+        total = self.storage_report()['total_bytes']
+        if self.output_budget is not None and total > self.output_budget:
+            raise ValueError("Projected storage "+str(total)+" bytes exceeds output_budget "+str(self.output_budget))
+        free = shutil.disk_usage(self.outdir).free
+        if total > free:
+            print("Warning: projected storage ",total," bytes exceeds free disk space ",free," in ",self.outdir)
+        return total
+
     def _copy_uvb(self):
         """The UVB amplitude for Gadget is specified in a file named TREECOOL in the same directory as the gadget binary."""
         fuvb = read_uvb_tab.get_uvb_filename(self.uvb)
-        shutil.copy(fuvb, os.path.join(self.outdir,"TREECOOL"))
+        if self.uvb_heat_amp != 1 or self.uvb_zreion is not None:
+            cachedir = self.uvb_cache if self.uvb_cache is not None else os.path.join(self.outdir, ".uvb")
+            fuvb = read_uvb_tab.uvb_variant_files(self.uvb, self.uvb_heat_amp, self.uvb_zreion, cachedir)[0]
+        assets.install_file(fuvb, os.path.join(self.outdir,"TREECOOL"), self.asset_store)
 
     def do_gadget_build(self, gadget_config):
         """Make a gadget build and check it succeeded."""
@@ -444,7 +552,7 @@ class SimulationICs(object):
             raise
         #Check that the last-changed time of the binary has actually changed..
         assert g_mtime != os.stat(gadget_binary).st_mtime
-        shutil.copy(gadget_binary, os.path.join(os.path.dirname(gadget_config),self.gadgetexe))
+        assets.install_file(gadget_binary, os.path.join(os.path.dirname(gadget_config),self.gadgetexe), self.asset_store)
 
     def generate_mpi_submit(self, genicout):
         """Generate a sample mpi_submit file.
@@ -454,20 +562,109 @@ class SimulationICs(object):
         #Generate an mpi_submit for genic
         zstr = self._camb_zstr(self.redshift)
         check_ics = "python cambpower.py "+genicout+" --czstr "+zstr+" --mnu "+str(self.m_nu)
+        #The power spectrum of inverted ICs is the same as that of their partner, which is already checked.
+        if self.invert_phase:
+            check_ics = None
         self._cluster.generate_mpi_submit_genic(self.outdir, extracommand=check_ics)
         #Copy the power spectrum routine
-        shutil.copy(os.path.join(os.path.dirname(__file__),"cambpower.py"), os.path.join(self.outdir,"cambpower.py"))
+        assets.install_file(os.path.join(os.path.dirname(__file__),"cambpower.py"), os.path.join(self.outdir,"cambpower.py"), self.asset_store)
 
-    def make_simulation(self, pkaccuracy=0.05, do_build=False):
-        """Wrapper function to make the simulation ICs."""
+    def copy_cambfile(self, class_dir):
+        """Copy the CLASS output from another simulation, instead of running CLASS again.
+        The other simulation must have the same cosmology and output times, and at least the same maximum k
+        (the same box and the same or more particles).
+        Files are copied, not linked, as _alter_power may change them."""
+        camb_output = "camb_linear/"
+        camb_outdir = os.path.join(self.outdir,camb_output)
+        try:
+            os.mkdir(camb_outdir)
+        except FileExistsError:
+            pass
+        fnames = os.listdir(class_dir)
+        for fname in fnames:
+            #Copy the unaltered CLASS output, so _alter_power is not applied twice.
+            if fname+".orig" in fnames:
+                continue
+            shutil.copy2(os.path.join(class_dir, fname), os.path.join(camb_outdir, fname.replace(".orig","")))
+        classpars = os.path.join(os.path.dirname(os.path.normpath(class_dir)), "_class_params.ini")
+        if os.path.exists(classpars):
+            shutil.copy2(classpars, os.path.join(self.outdir, "_class_params.ini"))
+        return camb_output
+
+    def paired_simulation(self):
+        """The partner of a paired simulation: identical, but in outdir+"_inv" and with inverted phases."""
+        partner = copy.copy(self)
+        partner.outdir = os.path.normpath(self.outdir)+"_inv"
+        partner.paired = False
+        partner.invert_phase = True
+        if not os.path.exists(partner.outdir):
+            os.mkdir(partner.outdir)
+        return partner
+
+    def _run_genic(self, genic_param):
+        """Run MP-GenIC to make the ICs."""
+        subprocess.check_call([os.path.join(os.path.join(self.gadget_dir, "genic"),self.genicexe), genic_param],cwd=self.outdir)
+
+    def fill_class(self, class_dir=None):
+        """Write the CLASS output of a simulation made with make_simulation(dry_run=True), and change it with _alter_power.
+        If class_dir is not None, it is copied instead of running CLASS, as in make_simulation.
+        The partner of a paired simulation is filled from our output.
+        This object need not be the one which made the simulation: the saved description is updated, not rewritten."""
+        if class_dir is None:
+            camb_output = self.cambfile()
+        else:
+            camb_output = self.copy_cambfile(class_dir)
+        self._alter_power(os.path.join(self.outdir,camb_output))
+        self.class_pending = False
+        self.camb_git = provenance.package_version("classylss")
+        descfile = os.path.join(self.outdir, "SimulationICs.json")
+        with open(descfile, 'r') as jsin:
+            desc = json.load(jsin)
+        desc.update({"class_pending": False, "camb_git": self.camb_git})
+        if hasattr(self, "growth_rescaled"):
+            desc["growth_rescaled"] = self.growth_rescaled
+        with open(descfile, 'w') as jsout:
+            json.dump(desc, jsout)
+        if self.paired:
+            self.paired_simulation().fill_class(class_dir=os.path.join(self.outdir,camb_output))
+        return camb_output
+
+    def make_simulation(self, pkaccuracy=0.05, do_build=False, class_dir=None, dry_run=False):
+        """Wrapper function to make the simulation ICs.
+        If class_dir is not None, it is the camb_linear directory of a matching simulation, which is copied instead of running CLASS.
+        If paired is set, the partner simulation is also made, sharing the CLASS output, IC check and Gadget build.
+        If dry_run is true and class_dir is None, CLASS is not run: the parameter files and submission scripts are written,
+        referring to the CLASS output which fill_class (or classfill.fill_suite, for a whole suite) writes later.
+        This needs neither classylss nor nbodykit."""
+        if dry_run and do_build:
+            raise ValueError("Cannot make the ICs of a dry run before its CLASS output is filled")
         #First generate the input files for CAMB
-        camb_output = self.cambfile()
+        self.class_pending = False
+        if class_dir is not None:
+            camb_output = self.copy_cambfile(class_dir)
+        elif dry_run:
+            camb_output = "camb_linear/"
+            self._write_class_params(*self.class_params())
+            self.class_pending = True
+        else:
+            camb_output = self.cambfile()
         #Then run CAMB
-        self.camb_git = classylss.__version__
+        self.camb_git = provenance.package_version("classylss")
         #Change the power spectrum file on disc if we want to do that
-        self._alter_power(os.path.join(self.outdir,camb_output))
+        if not self.class_pending:
+            self._alter_power(os.path.join(self.outdir,camb_output))
         #Now generate the GenIC parameters
         (genic_output, genic_param) = self.genicfile(camb_output)
+        #Versions of the codes, saved in SimulationICs.json. Found once per process, and written once per suite to provenance.json by suite builders.
+        self.provenance = provenance.suite_provenance(gadget_dir=self.gadget_dir)
+        #Projected disk usage, so it can be checked before submission.
+        self.projected_storage = self.storage_report()
+        self.check_storage()
+        #Set the job time limit and nodes from the predicted cost.
+        #Before the Gadget parameters, as TimeLimitCPU depends on the time limit.
+        if self._cost_model is not None:
+            self.predicted_node_hours = self._cost_model.predict(self)
+            self._cluster.set_resources(self.predicted_node_hours, safety=self.safety, max_nodes=self.max_nodes)
         #Save a json of ourselves.
         self.txt_description()
         #Check that the ICs have the right power spectrum
@@ -478,12 +675,24 @@ class SimulationICs(object):
         self.gadget3params(genic_output)
         #Generate mpi_submit file
         self.generate_mpi_submit(genic_output)
+        partner = None
+        if self.paired:
+            partner = self.paired_simulation()
+            if self.class_pending:
+                partner.make_simulation(do_build=False, dry_run=True)
+            else:
+                partner.make_simulation(do_build=False, class_dir=os.path.join(self.outdir,camb_output))
         #Run MP-GenIC
         if do_build:
-            subprocess.check_call([os.path.join(os.path.join(self.gadget_dir, "genic"),self.genicexe), genic_param],cwd=self.outdir)
+            self._run_genic(genic_param)
             zstr = self._camb_zstr(self.redshift)
+            #Imported here so that configuration files can be written without nbodykit.
+            from . import cambpower
             cambpower.check_ic_power_spectra(genic_output, camb_zstr=zstr, m_nu=self.m_nu, outdir=self.outdir, accuracy=pkaccuracy)
             self.do_gadget_build(gadget_config)
+            if partner is not None:
+                partner._run_genic(os.path.join(partner.outdir, partner.genicout))
+                assets.install_file(os.path.join(self.outdir, self.gadgetexe), os.path.join(partner.outdir, self.gadgetexe), self.asset_store)
         return gadget_config
 
 def save_transfer(transfer, transferfile):
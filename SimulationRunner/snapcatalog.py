@@ -0,0 +1,134 @@
+"""Module to catalog the snapshots of a run, or a whole suite, from their BigFile headers.
+
+All PART (particle) and PIG (FOF group) headers in an output directory are read in one pass,
+in a pool of threads, and every attribute (Time, TotNumPart, MassTable, ...) is kept.
+The catalog is cached in output/.snapcatalog.json, keyed by the modification time of each header,
+so only new or rewritten snapshots are read again. Queries:
+    cat = SnapshotCatalog("~/data/run1")
+    cat.nearest(3.0) - the PART snapshot nearest z=3.
+    cat.in_range(2.2, 4.2) - all PART snapshots with 2.2 <= z <= 4.2."""
+
+import concurrent.futures
+import json
+import os
+import os.path
+import re
+import numpy as np
+from . import integrity
+
+_CACHE_NAME = ".snapcatalog.json"
+
+def _tojson(value):
+    """Convert an attribute to something JSON can store."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+class SnapshotCatalog(object):
+    """Catalog of the snapshots in one run.
+    Arguments:
+        odir - simulation directory.
+        kinds - snapshot name prefixes to catalog.
+        nworkers - number of threads reading headers.
+        use_cache - if true, read and update the cache file."""
+    def __init__(self, odir, output_file="output", kinds=("PART_", "PIG_"), nworkers=8, use_cache=True):
+        self.outputs = os.path.join(os.path.expanduser(odir), output_file)
+        self.kinds = kinds
+        self.nworkers = nworkers
+        self.use_cache = use_cache
+        self.entries = []
+        self.refresh()
+
+    def _scan(self):
+        """Find all snapshots and the modification times of their headers."""
+        found = []
+        regex = re.compile("^("+"|".join([re.escape(kk) for kk in self.kinds])+")([0-9]{3,})$")
+        try:
+            dirents = list(os.scandir(self.outputs))
+        except FileNotFoundError:
+            return found
+        for entry in dirents:
+            mm = regex.match(entry.name)
+            if mm is None or not entry.is_dir():
+                continue
+            try:
+                mtime = os.stat(os.path.join(entry.path, "Header", "attr-v2")).st_mtime
+            except FileNotFoundError:
+                continue
+            found.append((entry.name, mm.group(1), int(mm.group(2)), mtime))
+        return found
+
+    def _load_cache(self):
+        """Load the cache file, or return an empty cache."""
+        if not self.use_cache:
+            return {}
+        try:
+            with open(os.path.join(self.outputs, _CACHE_NAME), 'r') as jsin:
+                return json.load(jsin)
+        except (IOError, ValueError):
+            return {}
+
+    def _read(self, name):
+        """Read the attributes of a snapshot header.
+        Returns None if the header has vanished or is still being written (it has no Time yet)."""
+        try:
+            attrs = integrity.read_header_attrs(os.path.join(self.outputs, name))
+        except (IOError, ValueError):
+            return None
+        if "Time" not in attrs:
+            return None
+        return attrs
+
+    def refresh(self):
+        """Rescan the output directory, reading only headers which are new or have changed.
+        Headers which cannot be read are left out, and are read again next time."""
+        cache = self._load_cache()
+        found = self._scan()
+        stale = [ff for ff in found if ff[0] not in cache or cache[ff[0]]["mtime"] != ff[3]]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.nworkers) as pool:
+            attrs = list(pool.map(lambda ff: self._read(ff[0]), stale))
+        for (ff, att) in zip(stale, attrs):
+            if att is None:
+                cache.pop(ff[0], None)
+                continue
+            cache[ff[0]] = {"mtime": ff[3], "attrs": {kk: _tojson(vv) for (kk, vv) in att.items()}}
+        found = [ff for ff in found if ff[0] in cache]
+        names = set([ff[0] for ff in found])
+        cache = {nn: cc for (nn, cc) in cache.items() if nn in names}
+        if self.use_cache and stale:
+            try:
+                with open(os.path.join(self.outputs, _CACHE_NAME), 'w') as jsout:
+                    json.dump(cache, jsout)
+            except IOError:
+                pass
+        self.entries = []
+        for (name, kind, snapnum, _) in sorted(found, key=lambda ff: (ff[1], ff[2])):
+            attrs = {kk: (np.array(vv) if isinstance(vv, list) else vv) for (kk, vv) in cache[name]["attrs"].items()}
+            time = float(np.ravel(attrs["Time"])[0]) if "Time" in attrs else np.nan
+            self.entries.append({"name": name, "kind": kind, "snapnum": snapnum, "path": os.path.join(self.outputs, name), "time": time, "redshift": 1./time - 1, "attrs": attrs})
+        return self.entries
+
+    def snapshots(self, kind="PART_"):
+        """All snapshots of a kind, in order of snapshot number."""
+        return [ee for ee in self.entries if ee["kind"] == kind]
+
+    def redshifts(self, kind="PART_"):
+        """Redshifts of all snapshots of a kind."""
+        return np.array([ee["redshift"] for ee in self.snapshots(kind)])
+
+    def nearest(self, redshift, kind="PART_"):
+        """The snapshot nearest a redshift, or None if there are none."""
+        snaps = self.snapshots(kind)
+        if not snaps:
+            return None
+        return snaps[int(np.argmin(np.abs(self.redshifts(kind) - redshift)))]
+
+    def in_range(self, zmin, zmax, kind="PART_"):
+        """All snapshots with zmin <= z <= zmax, in order of snapshot number."""
+        return [ee for ee in self.snapshots(kind) if zmin <= ee["redshift"] <= zmax]
+
+def suite_catalog(rundir, output_file="output", kinds=("PART_", "PIG_"), nworkers=8):
+    """Catalogs for every run in a suite. Returns a dictionary from run directory to SnapshotCatalog."""
+    rundir = os.path.expanduser(rundir)
+    odirs = sorted([entry.path for entry in os.scandir(rundir) if entry.is_dir() and os.path.isdir(os.path.join(entry.path, output_file))])
+    return {odir: SnapshotCatalog(odir, output_file=output_file, kinds=kinds, nworkers=nworkers) for odir in odirs}
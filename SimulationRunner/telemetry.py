@@ -0,0 +1,111 @@
+"""Module containing a stand-alone script which records the cost of each job, and routines to collect the records for a suite.
+
+The submission scripts generated with telemetry on call this script after the MPI program exits,
+passing the start and end times and the exit status. It writes one JSON record per job to telemetry/ in the run directory,
+with the scheduler job ID, node, task and thread counts read from the environment and, under SLURM, the peak memory from sacct."""
+import argparse
+import glob
+import json
+import os
+import os.path
+import socket
+import subprocess
+import numpy as np
+
+def _env_int(names):
+    """Get the first of a list of environment variables which is set, as an integer."""
+    for nn in names:
+        try:
+            return int(os.environ[nn])
+        except (KeyError, ValueError):
+            continue
+    return None
+
+def _job_id():
+    """Get the scheduler job ID, if any."""
+    for nn in ("SLURM_JOB_ID", "PBS_JOBID", "JOB_ID"):
+        if nn in os.environ:
+            return os.environ[nn]
+    return None
+
+def _slurm_max_rss(jobid):
+    """Peak resident memory of any task in a SLURM job, in bytes, from sacct. None if not available."""
+    try:
+        output = subprocess.check_output(["sacct", "-j", jobid, "--format=MaxRSS", "--noheader", "--parsable2"], universal_newlines=True, stderr=subprocess.DEVNULL, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    maxrss = None
+    for line in output.split():
+        try:
+            if line[-1] in units:
+                rss = float(line[:-1]) * units[line[-1]]
+            else:
+                rss = float(line)
+        except (ValueError, IndexError):
+            continue
+        maxrss = rss if maxrss is None else max(maxrss, rss)
+    return maxrss
+
+def record(outdir, stage, start, end, status, nproc=None):
+    """Write a JSON record of a job to outdir/telemetry/. Returns the record."""
+    jobid = _job_id()
+    rec = {"stage": stage, "start": start, "end": end, "walltime": end - start, "status": status, "jobid": jobid, "host": socket.gethostname()}
+    rec["nodes"] = _env_int(("SLURM_JOB_NUM_NODES", "SLURM_NNODES", "PBS_NUM_NODES"))
+    rec["tasks"] = _env_int(("SLURM_NTASKS", "PBS_NP"))
+    if rec["tasks"] is None:
+        rec["tasks"] = nproc
+    rec["threads"] = _env_int(("OMP_NUM_THREADS",))
+    rec["max_rss"] = None
+    if "SLURM_JOB_ID" in os.environ:
+        rec["max_rss"] = _slurm_max_rss(jobid)
+    teldir = os.path.join(outdir, "telemetry")
+    try:
+        os.mkdir(teldir)
+    except FileExistsError:
+        pass
+    with open(os.path.join(teldir, stage+"_"+str(jobid)+"_"+str(int(start))+".json"), 'w') as jsout:
+        json.dump(rec, jsout)
+    return rec
+
+def collect(rundir):
+    """Load the telemetry records for every run in a suite.
+    Each record has an extra 'rundir' key."""
+    rundir = os.path.expanduser(rundir)
+    records = []
+    for fname in sorted(glob.glob(os.path.join(rundir, "*", "telemetry", "*.json"))):
+        with open(fname, 'r') as jsin:
+            rec = json.load(jsin)
+        rec["rundir"] = os.path.dirname(os.path.dirname(fname))
+        records.append(rec)
+    return records
+
+def suite_table(records):
+    """Convert a list of records into a table: a dictionary from column name to array.
+    Missing values are NaN. Includes a node_hours column (nodes taken as 1 if unknown)."""
+    table = {}
+    for col in ("rundir", "stage", "jobid"):
+        table[col] = np.array([str(rec.get(col)) for rec in records])
+    for col in ("start", "end", "walltime", "status", "nodes", "tasks", "threads", "max_rss"):
+        table[col] = np.array([np.nan if rec.get(col) is None else rec[col] for rec in records], dtype=np.float64)
+    table["node_hours"] = table["walltime"] / 3600. * np.where(np.isfinite(table["nodes"]), table["nodes"], 1)
+    return table
+
+def suite_cost(rundir):
+    """Total node-hours used by each run in a suite. Returns a dictionary from run directory to node-hours."""
+    table = suite_table(collect(rundir))
+    cost = {}
+    for (rr, nh) in zip(table["rundir"], table["node_hours"]):
+        cost[str(rr)] = cost.get(str(rr), 0.) + nh
+    return cost
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stage', type=str, help='Name of the program which was run', required=True)
+    parser.add_argument('--start', type=float, help='Start time (unix seconds)', required=True)
+    parser.add_argument('--end', type=float, help='End time (unix seconds)', required=True)
+    parser.add_argument('--status', type=int, help='Exit status of the program', required=True)
+    parser.add_argument('--nproc', type=int, default=None, help='Number of processes requested', required=False)
+    parser.add_argument('--outdir', type=str, default=".", help='Run directory', required=False)
+    args = parser.parse_args()
+    record(args.outdir, args.stage, args.start, args.end, args.status, nproc=args.nproc)
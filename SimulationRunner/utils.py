@@ -1,13 +1,8 @@
 """Module to store some utility functions."""
-import glob
 import os
 import os.path
-import subprocess
+from . import provenance
 
 def get_git_hash(path):
-    """Get the git hash of a file."""
-    rpath = os.path.realpath(path)
-    if not os.path.isdir(rpath):
-        rpath = os.path.dirname(rpath)
-    commit_hash = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd = rpath, universal_newlines=True)
-    return commit_hash
+    """Get the git hash of a file. Read from the .git directory and cached, see provenance.py."""
+    return provenance.git_hash(path)
@@ -0,0 +1,57 @@
+"""Tests for the content-addressed asset store"""
+import os
+import tempfile
+from SimulationRunner import assets
+
+def test_asset_store():
+    """Check that identical files are stored once and that broken links are found."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "TREECOOL")
+        with open(src, 'w') as fh:
+            fh.write("0.0 1e-12 1e-12 1e-14 1e-24 1e-24 1e-26\n")
+        store = assets.AssetStore(os.path.join(tmpdir, ".assets"))
+        dests = []
+        for ii in range(3):
+            rundir = os.path.join(tmpdir, "run"+str(ii))
+            os.mkdir(rundir)
+            dests.append(store.install(src, os.path.join(rundir, "TREECOOL")))
+        objects = [ff for (_, _, ffs) in os.walk(os.path.join(store.root, "objects")) for ff in ffs]
+        assert objects == [assets.file_hash(src)]
+        assert all(os.stat(dd).st_ino == os.stat(dests[0]).st_ino for dd in dests)
+        assert store.verify() == []
+        assert assets.verify_links(tmpdir, store) == []
+        #Installing again replaces the existing file
+        store.install(src, dests[0])
+        #Break a symlink and modify a stored object in place
+        os.symlink(os.path.join(tmpdir, "missing"), os.path.join(tmpdir, "run0", "MP-Gadget"))
+        with open(dests[1], 'a') as fh:
+            fh.write("corrupt\n")
+        problems = dict(assets.verify_links(tmpdir, store))
+        assert problems[os.path.join(tmpdir, "run0", "MP-Gadget")] == "broken symlink"
+        assert len(store.verify()) == 1
+
+def test_install_over_store_link():
+    """Copying over a run's link into the store leaves the store intact, and verify sees in-place corruption."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, "TREECOOL")
+        with open(src, 'w') as fh:
+            fh.write("old\n")
+        store = assets.AssetStore(os.path.join(tmpdir, ".assets"))
+        linked = [os.path.join(tmpdir, "run"+str(ii)) for ii in range(2)]
+        for run in linked:
+            os.mkdir(run)
+            store.install(src, os.path.join(run, "TREECOOL"))
+        new = os.path.join(tmpdir, "TREECOOL_new")
+        with open(new, 'w') as fh:
+            fh.write("new\n")
+        assets.install_file(new, os.path.join(linked[0], "TREECOOL"))
+        with open(os.path.join(linked[1], "TREECOOL")) as fh:
+            assert fh.read() == "old\n"
+        assert store.verify() == []
+        #Same size, same modification time: the cached hash would miss this.
+        obj = store.add(src)
+        st = os.stat(obj)
+        with open(obj, 'w') as fh:
+            fh.write("bad\n")
+        os.utime(obj, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert store.verify() == [obj]
@@ -0,0 +1,89 @@
+"""Tests for the power spectrum checking module"""
+import os
+import tempfile
+import numpy as np
+import scipy.interpolate as interp
+from SimulationRunner import cambpower
+
+def _loop_rebin(kk, pk, modes, pkc, minmodes=250, ndesired=200):
+    """Reference implementation: accumulate bins one k value at a time."""
+    logkk = np.log10(kk)
+    mdlogk = (np.max(logkk) - np.min(logkk))/ndesired
+    istart = iend = 1
+    count = 0
+    pk_div = pk / pkc(kk)
+    k_list = [kk[0]]
+    pk_list = [pk_div[0]]
+    targetlogk = mdlogk+logkk[istart]
+    while iend < np.size(logkk)-1:
+        count += modes[iend]
+        iend += 1
+        if count >= minmodes and logkk[iend-1] >= targetlogk:
+            k_list.append(np.sum(modes[istart:iend]*kk[istart:iend])/count)
+            pk_list.append(np.sum(modes[istart:iend]*pk_div[istart:iend])/count)
+            istart = iend
+            targetlogk = mdlogk+logkk[istart]
+            count = 0
+    k_list = np.array(k_list)
+    return (k_list, np.array(pk_list) * pkc(k_list))
+
+def test_modecount_rebin():
+    """Check the vectorized rebinning gives the same bins as accumulating one k at a time."""
+    pkc = lambda k: k**-1.5
+    for (nk, minmodes, ndesired) in ((1000, 50, 20), (20000, 250, 200), (5000, 1000, 300)):
+        kk = np.sort(np.random.uniform(0.01, 10, nk))
+        modes = np.random.randint(0, 50, nk)
+        pk = np.random.uniform(1, 2, nk) * pkc(kk)
+        (k_ref, pk_ref) = _loop_rebin(kk, pk, modes, pkc, minmodes=minmodes, ndesired=ndesired)
+        (k_new, pk_new) = cambpower.modecount_rebin(kk, pk, modes, pkc, minmodes=minmodes, ndesired=ndesired)
+        assert np.shape(k_new) == np.shape(k_ref)
+        assert np.all(np.abs(k_new/k_ref - 1) < 1e-10)
+        assert np.all(np.abs(pk_new/pk_ref - 1) < 1e-10)
+        #Several spectra at once
+        (k_multi, pk_multi, ratio) = cambpower.modecount_rebin_multi(kk, {0: pk, 1: 2*pk}, modes, {0: pkc, 1: pkc}, minmodes=minmodes, ndesired=ndesired)
+        assert np.all(k_multi == k_new)
+        assert np.all(np.abs(pk_multi[1]/pk_new - 2) < 1e-10)
+        assert np.all(np.abs(ratio[0] - pk_new/pkc(k_new)) < 1e-10)
+
+def _write_class_tables(tmpdir, amp=1.):
+    """Write a smooth CLASS-format matter power spectrum and transfer function table."""
+    kk = np.logspace(-3, 1, 400)
+    pk = amp * kk / (1 + (kk/0.02)**2)**1.4
+    tk = np.zeros((np.size(kk), 7))
+    tk[:,0] = kk
+    tk[:,2] = 1/(1+(kk/0.5)**2)
+    tk[:,3] = 1/(1+(kk/0.6)**2)
+    matter = os.path.join(tmpdir, "matterpow_%g.dat" % amp)
+    transfer = os.path.join(tmpdir, "transfer_%g.dat" % amp)
+    np.savetxt(matter, np.vstack([kk, pk]).T)
+    np.savetxt(transfer, tk)
+    return (matter, transfer)
+
+def test_class_power_lazy():
+    """The lazily built log space interpolators match eager interpolation of the tables, and are shared between instances."""
+    cambpower.clear_cache()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        (matter, transfer) = _write_class_tables(tmpdir)
+        pk_camb = np.loadtxt(matter)
+        tk_camb = np.loadtxt(transfer)
+        cpow = cambpower.CLASSPowerSpectrum(matter, transfer, omega0=0.3, omegab=0.05)
+        kk = np.logspace(-2.9, 0.9, 200)
+        eager = interp.interp1d(pk_camb[:,0], pk_camb[:,1], kind='cubic')
+        assert np.all(np.abs(cpow.dpk(kk)/eager(kk) - 1) < 1e-3)
+        ttot = (0.05*tk_camb[:,2] + 0.25*tk_camb[:,3])/0.3
+        eager = interp.interp1d(tk_camb[:,0], pk_camb[:,1]*(tk_camb[:,3]/ttot)**2, kind='cubic')
+        assert np.all(np.abs(cpow.get_class_power(species=1)(kk)/eager(kk) - 1) < 1e-3)
+        #A second instance reading the same contents reuses the cached interpolators
+        other = cambpower.CLASSPowerSpectrum(matter, transfer, omega0=0.3, omegab=0.05)
+        assert other.dpk is cpow.dpk
+        assert other.dtk[1] is cpow.dtk[1]
+        assert len(cambpower._TABLE_CACHE) == 2
+        #No neutrino transfer function: zero power is interpolated without taking its log
+        zero = cambpower.LogInterpolator(pk_camb[:,0], 0*pk_camb[:,1])
+        assert np.all(zero(kk) == 0)
+        #The caches are bounded
+        for amp in range(2, 3+cambpower._CACHE_SIZE):
+            cambpower.CLASSPowerSpectrum(*_write_class_tables(tmpdir, amp=amp), omega0=0.3, omegab=0.05).get_class_power(species=0)
+        assert len(cambpower._TABLE_CACHE) == cambpower._CACHE_SIZE
+        assert len(cambpower._INTERP_CACHE) == cambpower._CACHE_SIZE
+    cambpower.clear_cache()
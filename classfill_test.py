@@ -0,0 +1,49 @@
+"""Tests for dry runs and filling in their CLASS output"""
+import os
+import json
+import tempfile
+import configobj
+import pytest
+from SimulationRunner import simulationics
+from SimulationRunner import classfill
+
+def test_dry_run():
+    """A dry run writes every parameter file, but no CLASS output."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "run")
+        sim = simulationics.SimulationICs(outdir=outdir, box=20, npart=32, redshift=49, redend=2, separate_gas=False, paired=True)
+        sim.make_simulation(dry_run=True)
+        for ff in ("_class_params.ini", "_genic_params.ini", "mpgadget.param", "Options.mk", "mpi_submit", "mpi_submit_genic", "SimulationICs.json"):
+            assert os.path.exists(os.path.join(outdir, ff))
+        assert not os.path.exists(os.path.join(outdir, "camb_linear", "ics_matterpow_49.dat"))
+        config = configobj.ConfigObj(os.path.join(outdir, "_genic_params.ini"))
+        assert config['FileWithInputSpectrum'] == "camb_linear/ics_matterpow_49.dat"
+        assert classfill.is_pending(outdir)
+        assert classfill.is_pending(outdir+"_inv")
+        with pytest.raises(ValueError):
+            sim.make_simulation(dry_run=True, do_build=True)
+
+def test_group_by_class():
+    """Runs differing only in resolution and seed share CLASS output, the highest resolution run computing it."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        common = {"box": 20, "redshift": 49, "redend": 2, "separate_gas": False}
+        sims = [simulationics.SimulationICs(outdir=os.path.join(tmpdir, str(ii)), npart=npart, ns=ns, seed=ii, **common) for (ii, (npart, ns)) in enumerate([(32, 0.95), (64, 0.95), (32, 0.99)])]
+        groups = sorted(classfill.group_by_class(sims), key=len)
+        assert [len(gg) for gg in groups] == [1, 2]
+        assert groups[0][0].ns == 0.99
+        assert [sim.npart for sim in groups[1]] == [64, 32]
+
+def test_fill_suite():
+    """Filling a dry run writes the CLASS output once and copies it to the other run."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        common = {"box": 20, "redshift": 49, "redend": 2, "separate_gas": False}
+        sims = [simulationics.SimulationICs(outdir=os.path.join(tmpdir, str(npart)), npart=npart, **common) for npart in (32, 64)]
+        for sim in sims:
+            sim.make_simulation(dry_run=True)
+        status = classfill.fill_suite(sims)
+        assert set(status.values()) == set(["done"])
+        for sim in sims:
+            assert os.path.exists(os.path.join(sim.outdir, "camb_linear", "ics_matterpow_49.dat"))
+            assert not classfill.is_pending(sim.outdir)
+            with open(os.path.join(sim.outdir, "SimulationICs.json")) as jsin:
+                assert json.load(jsin)["npart"] == sim.npart
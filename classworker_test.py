@@ -0,0 +1,79 @@
+"""Tests for the CLASS worker service"""
+import os
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import numpy as np
+import pytest
+from SimulationRunner import classworker
+
+def _start_worker(address, timeout=30):
+    """Start a worker in a thread and wait until it answers, failing the test if it does not start."""
+    thread = threading.Thread(target=classworker.serve, args=(address, 2), daemon=True)
+    thread.start()
+    deadline = time.time() + timeout
+    while not classworker.ping(address):
+        assert thread.is_alive(), "CLASS worker exited during startup"
+        assert time.time() < deadline, "CLASS worker did not start"
+        time.sleep(0.05)
+    return thread
+
+def test_worker_lifecycle():
+    """The worker answers pings and stops on request."""
+    address = os.path.join(tempfile.mkdtemp(), "class.sock")
+    assert not classworker.ping(address)
+    thread = _start_worker(address)
+    classworker.shutdown(address)
+    thread.join(timeout=30)
+    assert not thread.is_alive()
+    assert not classworker.ping(address)
+
+def test_worker_authentication():
+    """A client without the key is rejected, and the worker keeps serving others."""
+    address = os.path.join(tempfile.mkdtemp(), "class.sock")
+    thread = _start_worker(address)
+    try:
+        assert stat.S_IMODE(os.stat(classworker.key_file(address)).st_mode) == 0o600
+        with pytest.raises(AuthenticationError):
+            Client(address, family="AF_UNIX", authkey=b"wrong")
+        assert classworker.ping(address)
+    finally:
+        classworker.shutdown(address)
+        thread.join(timeout=30)
+    assert not os.path.exists(classworker.key_file(address))
+
+def test_shared_directory():
+    """The worker refuses to use a socket in a directory other users can write to."""
+    tmpdir = tempfile.mkdtemp()
+    os.chmod(tmpdir, 0o777)
+    address = os.path.join(tmpdir, "class.sock")
+    with pytest.raises(PermissionError):
+        classworker.serve(address, 1)
+    with pytest.raises(PermissionError):
+        classworker.ping(address)
+    #Nor a socket other users could connect to
+    os.chmod(tmpdir, 0o700)
+    open(address, 'w').close()
+    os.chmod(address, 0o666)
+    with pytest.raises(PermissionError):
+        classworker.ping(address)
+
+def test_worker():
+    """The worker gives the same linear theory as an in-process computation, and stops on request."""
+    address = os.path.join(tempfile.mkdtemp(), "class.sock")
+    assert not classworker.ping(address)
+    params = {'h': 0.7, 'Omega_cdm': 0.24, 'Omega_b': 0.047, 'n_s': 0.97, 'A_s': 2.4e-9, 'output': 'dTk vTk mPk', 'P_k_max_h/Mpc': 10, 'z_max_pk': 10}
+    local = classworker.compute_linear(params, [9, 0], address=address)
+    thread = _start_worker(address)
+    try:
+        remote = classworker.compute_linear(params, [9, 0], address=address)
+    finally:
+        classworker.shutdown(address)
+        thread.join(timeout=30)
+    assert not os.path.exists(address)
+    for ((tl, pl), (tr, pr)) in zip(local, remote):
+        assert np.all(tl['k'] == tr['k'])
+        assert np.allclose(pl, pr, rtol=1e-10)
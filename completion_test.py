@@ -0,0 +1,69 @@
+"""Tests for the time-to-completion estimator"""
+import os
+import tempfile
+import numpy as np
+from SimulationRunner import completion
+from SimulationRunner import clusters
+
+#Wall time per e-fold of the scale factor, in seconds
+RATE = 3600.
+
+def _write_run(odir, atimes, waits=None, timelimit=7200):
+    """Write a run with snapshots at the given scale factors, written at a constant rate per e-fold.
+    waits is a dictionary from snapshot index to a queue wait (in seconds) before it was written."""
+    outputs = os.path.join(odir, "output")
+    os.makedirs(outputs)
+    with open(os.path.join(odir, "mpgadget.param"), 'w') as fh:
+        fh.write("TimeMax = 1.0\nTimeLimitCPU = "+str(timelimit)+"\n")
+    start = 1.5e9
+    wait = 0.
+    for (ii, aa) in enumerate(atimes):
+        if waits is not None:
+            wait += waits.get(ii, 0.)
+        header = os.path.join(outputs, "PART_"+str(ii).rjust(3, '0'), "Header")
+        os.makedirs(header)
+        fname = os.path.join(header, "attr-v2")
+        with open(fname, 'w') as fh:
+            fh.write("Time #HUMANE [ "+repr(aa)+" ]\n")
+        mtime = start + wait + RATE * np.log(aa / atimes[0])
+        os.utime(fname, (mtime, mtime))
+
+def test_fit_rate():
+    """A history with a constant rate per e-fold gives that rate."""
+    atime = np.linspace(0.1, 0.5, 20)
+    assert abs(completion.fit_rate(atime, RATE * np.log(atime / atime[0])) / RATE - 1) < 1e-10
+    assert np.isnan(completion.fit_rate(atime, np.zeros_like(atime)))
+
+def test_count_nodes():
+    """Nodes are read from the directives of each cluster."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for (cluster, nodes) in [(clusters.BIOClass(nproc=256), 8), (clusters.MARCCClass(nproc=48), 2), (clusters.StampedeClass(nproc=2), 2), (clusters.HipatiaClass(nproc=32), 2), (clusters.HypatiaClass(nproc=64), 1), (clusters.ClusterClass(), 1)]:
+            cluster.generate_mpi_submit(tmpdir)
+            assert completion.count_nodes(tmpdir) == nodes
+        assert completion.count_nodes(os.path.join(tmpdir, "missing")) == 1
+
+def test_queue_wait():
+    """A long queue wait between snapshots does not inflate the estimated rate."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        atimes = [0.2, 0.25, 0.3, 0.4, 0.5]
+        _write_run(os.path.join(tmpdir, "run1"), atimes, waits={3: 10 * 86400.})
+        (atime, wall) = completion.snapshot_history(os.path.join(tmpdir, "run1"), max_gap=7200)
+        assert np.allclose(wall, RATE * np.log(atime / atime[0]))
+        (_, rawwall) = completion.snapshot_history(os.path.join(tmpdir, "run1"))
+        assert rawwall[-1] > 10 * 86400
+        est = completion.estimate_completion(os.path.join(tmpdir, "run1"), nodes=4)
+        assert abs(est["remaining"] / (RATE * np.log(1 / 0.5)) - 1) < 1e-6
+        assert abs(est["node_hours"] - 4 * est["remaining"] / 3600.) < 1e-6
+        assert est["jobs"] == 1
+
+def test_estimate_suite():
+    """Suite totals add the runs which can be estimated, and count the others."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_run(os.path.join(tmpdir, "run1"), [0.2, 0.3, 0.5])
+        _write_run(os.path.join(tmpdir, "run2"), [0.2, 0.3, 0.5, 1.0])
+        _write_run(os.path.join(tmpdir, "run3"), [0.2])
+        (estimates, totals) = completion.estimate_suite(tmpdir)
+        assert len(estimates) == 3
+        assert estimates[os.path.join(tmpdir, "run2")+os.path.sep]["remaining"] == 0
+        assert totals["unknown"] == 1
+        assert abs(totals["node_hours"] - RATE * np.log(2) / 3600.) < 1e-6
@@ -0,0 +1,61 @@
+"""Tests for the simulation cost models"""
+import json
+import os
+import tempfile
+import numpy as np
+from SimulationRunner import costmodel
+from SimulationRunner import clusters
+
+def _write_run(odir, params, node_hours, nodes=2):
+    """Write the files of a finished simulation which took node_hours."""
+    os.makedirs(os.path.join(odir, "output"))
+    with open(os.path.join(odir, "SimulationICs.json"), 'w') as jsout:
+        json.dump(params, jsout)
+    timemax = 1./(1+params["redend"])
+    with open(os.path.join(odir, "mpgadget.param"), 'w') as fh:
+        fh.write("TimeMax = %g\nTimeLimitCPU = 86100\n" % timemax)
+    with open(os.path.join(odir, "mpi_submit"), 'w') as fh:
+        fh.write("#!/bin/bash\n#SBATCH --nodes=%d\n" % nodes)
+    atimes = np.exp(np.linspace(np.log(1./(1+params["redshift"])), np.log(timemax), 20))
+    elapsed = node_hours * 3600. / nodes * np.linspace(0, 1, 20)
+    with open(os.path.join(odir, "output", "cpu.txt"), 'w') as fh:
+        for (ii, (aa, ee)) in enumerate(zip(atimes, elapsed)):
+            fh.write("Step %d, Time: %.10g, MPIs: 4 Threads: 2 Elapsed: %.10g\n" % (ii, aa, ee))
+            fh.write("%-26s  %10.2f %4.1f%%  %10.2f %4.1f%%\n" % ("/", ee, 100., ee, 100.))
+        #The last block is only complete when the next one starts
+        fh.write("Step %d, Time: %.10g, MPIs: 4 Threads: 2 Elapsed: %.10g\n" % (20, timemax, elapsed[-1]))
+
+def test_fitted_model():
+    """A model trained on runs which cost three times the analytic prediction learns the factor."""
+    analytic = costmodel.AnalyticCostModel()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for (ii, npart) in enumerate((64, 96, 128, 160)):
+            params = {"npart": npart, "separate_gas": ii % 2 == 0, "redshift": 99, "redend": 2, "box": 20, "m_nu": 0}
+            _write_run(os.path.join(tmpdir, "run"+str(ii)), params, 3*analytic.predict(dict(params, nu_ngrid=0)))
+        data = costmodel.training_data([tmpdir])
+        assert len(data) == 4
+        model = costmodel.FittedCostModel(data, ridge=1e-4)
+        test = {"npart": 112, "separate_gas": True, "redshift": 99, "redend": 2, "box": 20, "m_nu": 0, "nu_ngrid": 0}
+        assert np.abs(model.predict(test) / analytic.predict(test) / 3 - 1) < 0.05
+        #Without training data the fitted model is the analytic model
+        assert costmodel.FittedCostModel().predict(test) == analytic.predict(test)
+
+def test_set_resources():
+    """The time limit shrinks to fit the predicted cost, and nodes are added when it would not fit."""
+    cluster = clusters.BIOClass(nproc=64, timelimit=24)
+    assert cluster.nodes() == 2
+    assert cluster.set_resources(10., safety=1.2) == (2, 6.)
+    cluster = clusters.BIOClass(nproc=64, timelimit=2)
+    assert cluster.set_resources(10., safety=1., max_nodes=4) == (4, 2)
+    assert cluster.nproc == 128
+
+def test_set_resources_cluster_cap():
+    """The cluster's own node limit caps the node count, even when no limit is passed."""
+    cluster = clusters.HypatiaClass(nproc=512, timelimit=2)
+    assert cluster.set_resources(10., safety=1.) == (1, 2)
+    assert cluster.nproc == 256
+    cluster = clusters.HypatiaClass(nproc=256, timelimit=2)
+    assert cluster.set_resources(10., safety=1., max_nodes=4) == (1, 2)
+    #A cluster with no limit of its own only grows when asked to
+    cluster = clusters.BIOClass(nproc=64, timelimit=2)
+    assert cluster.set_resources(10., safety=1.) == (2, 2)
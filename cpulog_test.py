@@ -0,0 +1,68 @@
+"""Tests for the cpu.txt parser"""
+import os
+import tempfile
+import numpy as np
+from SimulationRunner import cpulog
+
+def _write_step(fh, step, time, elapsed):
+    """Write a cpu.txt block in the MP-Gadget format"""
+    fh.write("Step %d, Time: %g, MPIs: 4 Threads: 2 Elapsed: %g\n" % (step, time, elapsed))
+    fh.write("%-26s  %10.2f %4.1f%%  %10.2f %4.1f%%\n" % ("/", elapsed, 100., elapsed, 100.))
+    fh.write("%-26s  %10.2f %4.1f%%  %10.2f %4.1f%%\n" % ("/PM", elapsed/2., 50., elapsed/2., 50.))
+    fh.write("%-26s  %10.2f %4.1f%%  %10.2f %4.1f%%\n" % ("/Tree/Walk1", elapsed/4., 25., elapsed/4., 25.))
+
+def test_incremental():
+    """Check that incremental parsing gives the same answer as parsing the whole file."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "cpu.txt")
+        log = cpulog.CpuLog(fname)
+        assert log.update() == 0
+        with open(fname, 'w') as fh:
+            for ii in range(3):
+                _write_step(fh, ii, 0.01*(ii+1), 10.*(ii+1))
+        log.update()
+        assert len(log) == 3
+        #Append some more steps, including a restart which resets the timers,
+        #and a partially written line.
+        with open(fname, 'a') as fh:
+            _write_step(fh, 3, 0.04, 40.)
+            _write_step(fh, 3, 0.04, 5.)
+            fh.write("Step 4, Time: 0.05")
+        log.update()
+        assert np.all(log.step == [0, 1, 2, 3, 3])
+        assert np.all(np.abs(log.time - [0.01, 0.02, 0.03, 0.04, 0.04]) < 1e-12)
+        assert np.all(log.mpis == 4)
+        assert np.all(np.abs(log.wallclock() - [10., 20., 30., 40., 45.]) < 1e-12)
+        totals = log.phase_totals()
+        assert np.abs(totals["pm"] - 22.5) < 1e-6
+        assert np.abs(totals["total"] - 45.) < 1e-6
+        assert np.all(np.isnan(log.sections["/Tree/Walk1"]) == False)
+        #Save and reload the state, then finish the file.
+        statefile = os.path.join(tmpdir, "state.json")
+        log.save_state(statefile)
+        log2 = cpulog.CpuLog.load_state(statefile)
+        full = cpulog.CpuLog(fname)
+        with open(fname, 'a') as fh:
+            fh.write(", MPIs: 4 Threads: 2 Elapsed: 6\n/ 6 100.0%\n")
+        log2.update()
+        full.update()
+        assert np.all(log2.step == full.step)
+        assert np.all(log2.elapsed == full.elapsed)
+        assert len(full) == 6
+
+def test_unparsed_final_block():
+    """A final block which cannot yet be parsed does not cause the complete block before it to be dropped."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "cpu.txt")
+        with open(fname, 'w') as fh:
+            _write_step(fh, 0, 0.01, 10.)
+            _write_step(fh, 1, 0.02, 20.)
+            fh.write("Step 2, Time: 0.03\n")
+        log = cpulog.CpuLog(fname)
+        assert log.update() == 2
+        assert log.update() == 0
+        assert np.all(log.step == [0, 1])
+        with open(fname, 'a') as fh:
+            _write_step(fh, 3, 0.04, 40.)
+        log.update()
+        assert np.all(log.step == [0, 1, 3])
@@ -0,0 +1,40 @@
+"""Tests for rescaling transfer functions with the growth factor"""
+import numpy as np
+from SimulationRunner import growth
+
+def _transfer(kk, amp, vamp):
+    """A fake transfer function with a few CLASS columns"""
+    trans = np.zeros(np.size(kk), dtype=[('k', 'f8'), ('d_cdm', 'f8'), ('d_g', 'f8'), ('t_cdm', 'f8'), ('phi', 'f8')])
+    trans['k'] = kk
+    trans['d_cdm'] = -amp * kk**2
+    trans['d_g'] = np.cos(kk)
+    trans['t_cdm'] = vamp * kk**2
+    trans['phi'] = amp
+    return trans
+
+def test_rescale():
+    """Columns scale by the right factor, and the power by the density factor squared."""
+    kk = np.logspace(-2, 1, 20)
+    trans = _transfer(kk, 1., 1.)
+    back = {"z": np.array([3., 1.]), "D": np.array([0.3, 0.6]), "f": np.array([1., 0.8]), "E": np.array([5., 2.])}
+    ratios = growth.growth_ratios(back, 3., 1.)
+    assert np.abs(ratios["density"] - 0.5) < 1e-12
+    assert np.abs(ratios["potential"] - (0.3 * 4) / (0.6 * 2)) < 1e-12
+    assert np.abs(ratios["velocity"] - 0.3 * 1. * 0.25 * 5 / (0.6 * 0.8 * 0.5 * 2)) < 1e-12
+    (new, pk) = growth.rescale(trans, kk**-1, ratios)
+    assert np.allclose(new['k'], kk)
+    assert np.allclose(new['d_cdm'], 0.5 * trans['d_cdm'])
+    assert np.allclose(new['d_g'], trans['d_g'])
+    assert np.allclose(new["phi"], 1.)
+    assert np.allclose(pk, 0.25 / kk)
+
+def test_interpolate():
+    """Interpolation with a k-dependent exponent is exact for power-law growth."""
+    kk = np.logspace(-2, 1, 20)
+    slope = 1 - 0.1 * kk / 10.
+    anchor1 = (_transfer(kk, 1., 1.), np.ones(20))
+    anchor2 = (_transfer(kk, 2.**slope, 2.**slope), 4.**slope)
+    (new, pk) = growth.interpolate(anchor1, anchor2, 0.5)
+    assert np.allclose(new['d_cdm'], -2.**(0.5*slope) * kk**2)
+    assert np.allclose(pk, 2.**slope)
+    assert np.allclose(new['k'], kk)
@@ -0,0 +1,45 @@
+"""Tests for the snapshot integrity checks"""
+import os
+import tempfile
+import bigfile
+import numpy as np
+from SimulationRunner import integrity
+from SimulationRunner import remake
+
+def _write_snapshot(snapdir, npart=100):
+    """Write a small BigFile snapshot"""
+    with bigfile.File(snapdir, create=True) as ff:
+        header = ff.create('Header')
+        header.attrs['Time'] = np.array([0.25])
+        header.attrs['TotNumPart'] = np.array([0, npart, 0, 0, 0, 0], dtype='u8')
+        pos = ff.create('1/Position', dtype=('f8', 3), size=npart, Nfile=2)
+        pos.write(0, np.random.random((npart, 3)))
+        ids = ff.create('1/ID', dtype='u8', size=npart, Nfile=1)
+        ids.write(0, np.arange(npart, dtype='u8'))
+
+def test_integrity():
+    """Check that truncated and corrupted snapshots are detected and skipped on restart."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "output")
+        os.mkdir(outdir)
+        for snap in ("PART_000", "PART_001", "PART_002"):
+            _write_snapshot(os.path.join(outdir, snap))
+        attrs = integrity.read_header_attrs(os.path.join(outdir, "PART_000"))
+        assert attrs["TotNumPart"][1] == 100
+        assert attrs["Time"][0] == 0.25
+        for snap in ("PART_000", "PART_001", "PART_002"):
+            assert integrity.verify_snapshot(os.path.join(outdir, snap), checksum=True) == []
+        #Truncate the last snapshot
+        with open(os.path.join(outdir, "PART_002/1/Position/000001"), 'r+b') as fh:
+            fh.truncate(100)
+        #Flip some bytes in the middle one without changing the size
+        with open(os.path.join(outdir, "PART_001/1/ID/000000"), 'r+b') as fh:
+            fh.seek(8)
+            fh.write(b"\xff\xff")
+        assert not integrity.snapshot_ok(os.path.join(outdir, "PART_002"))
+        assert integrity.snapshot_ok(os.path.join(outdir, "PART_001"))
+        assert not integrity.snapshot_ok(os.path.join(outdir, "PART_001"), checksum=True)
+        assert remake._find_snap(tmpdir, "output") == 2
+        #The cached checksum failure means PART_001 is also skipped
+        assert remake._find_snap(tmpdir, "output", verify=True) == 0
+        assert os.path.exists(os.path.join(outdir, ".integrity.json"))
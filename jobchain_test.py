@@ -0,0 +1,71 @@
+"""Tests for chaining jobs through the queue"""
+import os
+import stat
+import subprocess
+import tempfile
+from SimulationRunner import clusters
+from SimulationRunner import jobchain
+
+def _fake_binary(fname, body):
+    """Write an executable shell script"""
+    with open(fname, 'w') as fh:
+        fh.write("#!/bin/bash\n"+body+"\n")
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IEXEC)
+
+def test_chain():
+    """Run a fake simulation which needs several jobs to reach TimeMax, using the fake scheduler."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bindir = os.path.join(tmpdir, "bin")
+        os.mkdir(bindir)
+        #mpirun -np N prog args -> ./prog args
+        _fake_binary(os.path.join(bindir, "mpirun"), "shift 2; prog=$1; shift; exec ./$prog \"$@\"")
+        rundir = os.path.join(tmpdir, "run")
+        os.makedirs(os.path.join(rundir, "output"))
+        with open(os.path.join(rundir, "mpgadget.param"), 'w') as fh:
+            fh.write("TimeMax = 0.5\nTimeLimitCPU = 100\n")
+        #Each job advances the simulation by 0.1 in scale factor and writes a snapshot.
+        #The arguments are recorded so we can check the restart flag.
+        _fake_binary(os.path.join(rundir, "MP-Gadget"), """echo "$@" >> args
+n=$(ls -d output/PART_* 2>/dev/null | wc -l)
+mkdir output/PART_00$n
+echo "Step $n, Time: 0.$((n+1)), MPIs: 1 Threads: 1 Elapsed: 1" >> output/cpu.txt""")
+        cluster = clusters.ClusterClass(chain=3)
+        cluster.generate_mpi_submit(rundir)
+        assert os.path.exists(os.path.join(rundir, "jobchain.py"))
+        oldpath = os.environ["PATH"]
+        os.environ["PATH"] = bindir+os.pathsep+oldpath
+        try:
+            ran = jobchain.run_fake_queue(rundir)
+        finally:
+            os.environ["PATH"] = oldpath
+        #First job plus three chained jobs, then the limit is hit.
+        assert ran == ["mpi_submit", "mpi_submit_chain", "mpi_submit_chain", "mpi_submit_chain"]
+        assert jobchain.chain_count(rundir) == 3
+        with open(os.path.join(rundir, "args")) as fh:
+            args = fh.read().split("\n")
+        assert args[0] == "mpgadget.param"
+        assert args[1] == "mpgadget.param 2 0"
+        assert args[3] == "mpgadget.param 2 2"
+        assert abs(jobchain.last_time(rundir) - 0.4) < 1e-6
+        #Resetting the count lets the chain finish, and no job is submitted once TimeMax is reached.
+        os.remove(os.path.join(rundir, ".chain_count"))
+        os.environ["PATH"] = bindir+os.pathsep+oldpath
+        try:
+            ran = jobchain.run_fake_queue(rundir, script_file="mpi_submit_chain")
+        finally:
+            os.environ["PATH"] = oldpath
+        assert ran == ["mpi_submit_chain",]
+        assert abs(jobchain.last_time(rundir) - 0.5) < 1e-6
+        assert jobchain.chain(rundir, max_chain=10, submit_command="fake") == "finished"
+
+def test_chain_failure_status():
+    """A chained job whose program fails is not resubmitted, and exits with the status of the program."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _fake_binary(os.path.join(tmpdir, "mpirun"), "exit 5")
+        cluster = clusters.ClusterClass(chain=3)
+        cluster.generate_mpi_submit(tmpdir)
+        with open(os.path.join(tmpdir, "mpi_submit")) as fh:
+            assert fh.read().endswith("fi\nexit $SR_STATUS\n")
+        env = dict(os.environ, PATH=tmpdir+os.pathsep+os.environ["PATH"], SR_SUBMIT="fake")
+        assert subprocess.call(["bash", "mpi_submit"], cwd=tmpdir, env=env) == 5
+        assert jobchain.chain_count(tmpdir) == 0
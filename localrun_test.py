@@ -0,0 +1,58 @@
+"""Tests for running simulations locally"""
+import os
+import stat
+import tempfile
+from SimulationRunner import localrun
+
+def _fake_binary(fname, body):
+    """Write an executable shell script"""
+    with open(fname, 'w') as fh:
+        fh.write("#!/bin/bash\n"+body+"\n")
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IEXEC)
+
+def test_local_executor():
+    """Run some fake simulations within a core budget."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        #Each fake binary records how many runs are active at once.
+        active = os.path.join(tmpdir, "active")
+        os.mkdir(active)
+        body = "touch "+active+"/$$; echo $1; ls "+active+" | wc -l >> "+tmpdir+"/concurrent; sleep 0.2; rm "+active+"/$$"
+        _fake_binary(os.path.join(tmpdir, "genic"), body)
+        _fake_binary(os.path.join(tmpdir, "gadget"), body)
+        rundirs = [os.path.join(tmpdir, "run"+str(ii)) for ii in range(5)]
+        for rr in rundirs:
+            os.mkdir(rr)
+        #This one fails
+        _fake_binary(os.path.join(rundirs[-1], "MP-Gadget"), "exit 3")
+        executor = localrun.LocalExecutor(2, mpirun=None, genic=os.path.join(tmpdir, "genic"), stages=("genic", "gadget"))
+        for rr in rundirs[:-1]:
+            _fake_binary(os.path.join(rr, "MP-Gadget"), body)
+        status = executor.run(rundirs, nproc=1)
+        assert all(status[rr] == "done" for rr in rundirs[:-1])
+        assert status[rundirs[-1]] == "failed: gadget"
+        with open(os.path.join(tmpdir, "concurrent")) as fh:
+            concurrent = [int(line) for line in fh]
+        assert len(concurrent) == 9
+        assert max(concurrent) <= 2
+        with open(os.path.join(rundirs[0], "local_run.log")) as fh:
+            log = fh.read()
+        assert "_genic_params.ini" in log and "mpgadget.param" in log
+
+def test_check_stage_cores():
+    """The serial IC check holds one core, so two checks run at once when each simulation needs the whole budget."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        active = os.path.join(tmpdir, "active")
+        os.mkdir(active)
+        body = "touch "+active+"/$$; ls "+active+" | wc -l >> "+tmpdir+"/concurrent; sleep 0.3; rm "+active+"/$$"
+        _fake_binary(os.path.join(tmpdir, "check"), body)
+        rundirs = [os.path.join(tmpdir, "run"+str(ii)) for ii in range(2)]
+        for rr in rundirs:
+            os.mkdir(rr)
+        executor = localrun.LocalExecutor(2, mpirun=None, stages=("check",))
+        executor.commands = lambda rundir, nproc: [("check", [os.path.join(tmpdir, "check")])]
+        status = executor.run(rundirs, nproc=2)
+        assert set(status.values()) == set(["done"])
+        with open(os.path.join(tmpdir, "concurrent")) as fh:
+            assert max(int(line) for line in fh) == 2
+        #Cancelling once the loop has closed does nothing
+        executor.cancel()
@@ -0,0 +1,73 @@
+"""Tests for preparing a suite with MPI"""
+import os
+import json
+import tempfile
+from SimulationRunner import mpiprep
+from SimulationRunner import clusters
+
+def test_slices():
+    """Every point is prepared by exactly one rank."""
+    points = sorted(sum([mpiprep.my_slice(10, rank, 3) for rank in range(3)], []))
+    assert points == list(range(10))
+    assert mpiprep.my_slice(2, 3, 4) == []
+
+def test_prepare_suite():
+    """Prepare a small suite serially, with one broken point, and write a submit script."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        design = {"outdir": os.path.join(tmpdir, "suite"), "common": {"box": 20, "npart": 32, "redshift": 49, "redend": 2, "separate_gas": False},
+                  "points": [{"ns": 0.95, "name": "low"}, {"ns": 0.99}, {"ns": 5}]}
+        designfile = os.path.join(tmpdir, "design.json")
+        with open(designfile, 'w') as jsout:
+            json.dump(design, jsout)
+        status = mpiprep.prepare_suite(mpiprep.load_design(designfile))
+        assert status[os.path.join(design["outdir"], "low")] == "done"
+        assert status[os.path.join(design["outdir"], "1")] == "done"
+        assert status[os.path.join(design["outdir"], "2")].startswith("failed")
+        assert os.path.exists(os.path.join(design["outdir"], "low", "mpgadget.param"))
+        with open(os.path.join(design["outdir"], "prep_status.json")) as jsin:
+            assert json.load(jsin) == status
+        clusters.BIOClass(nproc=64).generate_prep_submit(tmpdir, "design.json")
+        with open(os.path.join(tmpdir, "mpi_submit_prep")) as fh:
+            assert "SimulationRunner.mpiprep design.json" in fh.read()
+
+class FakeComm(object):
+    """A communicator for one rank of a fake MPI job. On the root, gather returns this rank's part and the given parts of the other ranks."""
+    def __init__(self, rank, size, others=()):
+        self.rank = rank
+        self.size = size
+        self.others = list(others)
+
+    def Get_rank(self):
+        """This rank"""
+        return self.rank
+
+    def Get_size(self):
+        """Number of ranks"""
+        return self.size
+
+    def Barrier(self):
+        """Nothing to wait for"""
+        return
+
+    def gather(self, value, root=0):
+        """Gather on the root"""
+        if self.rank != root:
+            return None
+        return [value,] + self.others
+
+def test_prepare_suite_ranks():
+    """Each rank prepares its slice (as dry runs, so without CLASS) and rank 0 gathers the status of all of them."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        design = {"outdir": os.path.join(tmpdir, "suite"), "common": {"box": 20, "npart": 32, "redshift": 49, "redend": 2, "separate_gas": False},
+                  "points": [{"ns": 0.95}, {"ns": 0.97}, {"ns": 0.99}]}
+        os.makedirs(design["outdir"])
+        assert mpiprep.prepare_suite(design, comm=FakeComm(1, 2), dry_run=True) is None
+        with open(os.path.join(design["outdir"], "1", "SimulationICs.json")) as jsin:
+            part1 = {os.path.join(design["outdir"], "1"): "done"}
+            assert json.load(jsin)["ns"] == 0.97
+        assert not os.path.exists(os.path.join(design["outdir"], "0"))
+        status = mpiprep.prepare_suite(design, comm=FakeComm(0, 2, others=[part1]), dry_run=True)
+        assert status == {os.path.join(design["outdir"], str(ii)): "done" for ii in range(3)}
+        assert os.path.exists(os.path.join(design["outdir"], "provenance.json"))
+        with open(os.path.join(design["outdir"], "prep_status.json")) as jsin:
+            assert json.load(jsin) == status
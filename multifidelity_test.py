@@ -0,0 +1,55 @@
+"""Tests for the multi-fidelity budget allocator."""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+from SimulationRunner import multifidelity
+from SimulationRunner import costmodel
+from SimulationRunner import simulationics
+from SimulationRunner import neutrinosimulation
+
+def test_farthest_point_order():
+    """The first point is central, the next ones the corners."""
+    points = [[0.5, 0.5], [0, 0], [1, 1], [0.1, 0.1], [1, 0]]
+    order = multifidelity.farthest_point_order(points)
+    assert sorted(order) == list(range(5))
+    assert order[0] == 0
+    assert set(order[1:4]) == set([1, 2, 4])
+    assert order[4] == 3
+
+def test_allocate_budget():
+    """High resolution points are added until the budget runs out."""
+    low = np.ones(4)
+    high = 8*np.ones(4)
+    (hh, total) = multifidelity.allocate_budget(low, high, [2, 0, 1, 3], 21)
+    assert hh == [2, 0]
+    assert total == 20
+    with pytest.raises(ValueError):
+        multifidelity.allocate_budget(low, high, [0, 1, 2, 3], 3)
+
+def test_cost_model():
+    """Cost scales with particle number and e-folds."""
+    model = costmodel.AnalyticCostModel()
+    ref = dict(costmodel.REFERENCE)
+    assert np.abs(model.predict(ref) / ref["node_hours"] - 1) < 1e-12
+    ref2 = dict(ref)
+    ref2["npart"] = 2*ref["npart"]
+    assert np.abs(model.predict(ref2) / model.predict(ref) - 8) < 1e-12
+
+def test_allocate_pure():
+    """Allocation writes nothing, and predicts the same costs as the simulations which are later made."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "suite")
+        design = [{"ns": 0.95}, {"ns": 0.97}, {"ns": 0.99}]
+        for sim_class in (simulationics.SimulationICs, neutrinosimulation.NeutrinoPartICs):
+            suite = multifidelity.MultiFidelitySuite(outdir=outdir, design=design, npart_low=32, npart_high=64, budget=5., sim_class=sim_class, box=20, redend=2)
+            high = suite.allocate()
+            assert not os.path.exists(outdir)
+            assert np.sum(suite.low_costs) + np.sum(suite.high_costs[high]) <= 5.
+            os.mkdir(outdir)
+            for ii in range(len(design)):
+                for hh in (False, True):
+                    sim = suite._make_sim(ii, hh)
+                    assert suite.cost_params(ii, hh) == costmodel.sim_params(sim)
+            shutil.rmtree(outdir)
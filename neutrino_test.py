@@ -1,9 +1,11 @@
 """Integration tests for the neutrinosimulation module"""
 
 import os
+import tempfile
 import bigfile
 import numpy as np
 import configobj
+import pytest
 from SimulationRunner import simulationics
 from SimulationRunner import neutrinosimulation as nus
 
@@ -84,3 +86,38 @@ def test_neutrino_mass_spec():
     assert np.abs(numass[0]+numass[1]+numass[2] - 0.11) < 1e-4
     assert np.abs(numass[0]**2 - numass[1]**2 + M32n) < 1e-4
     assert np.abs(numass[1]**2 - numass[2]**2 - M21) < 1e-4
+
+def test_hybrid_model():
+    """The hybrid error model is calibrated from measured errors, and the cheapest parameters meeting the tolerance are chosen."""
+    assert abs(nus.slow_fraction(1e6, 0.3) - 1) < 1e-6
+    assert nus.slow_fraction(300, 0.3) < nus.slow_fraction(850, 0.3)
+    true_model = {"v_nl": 600., "lin": 2., "late": 0.5, "shot": 0.1}
+    runs = []
+    for (npartnufac, vcrit, zz_transition) in [(0.5, 300, 1), (1, 850, 0), (0.25, 2000, 4), (0.5, 500, 2), (1, 1200, 0.5)]:
+        run = {"m_nu": 0.3, "box": 256, "npart": 128, "npartnufac": npartnufac, "vcrit": vcrit, "zz_transition": zz_transition}
+        run["error"] = nus.hybrid_error(error_model=true_model, **run)
+        runs.append(run)
+    fitted = nus.fit_error_model(runs, v_nl=600.)
+    for key in ("lin", "late", "shot"):
+        assert abs(fitted[key] / true_model[key] - 1) < 1e-6
+    #Neutrino particles made later are cheaper
+    early = nus.hybrid_cost(128, 0.5, 4, memory_per_particle=300)
+    late = nus.hybrid_cost(128, 0.5, 1)
+    assert early["runtime"] > late["runtime"] > 1
+    assert early["nu_particles"] == 64**3
+    assert early["memory"] == 300 * (128**3 + 64**3)
+    assert late["memory"] is None
+    best = nus.select_hybrid_params(0.3, 256, 128, fitted, tolerance=2e-3)
+    assert best["error"] <= 2e-3
+    for (npartnufac, vcrit, zz_transition) in [(0.25, 300, 0), (0.5, 850, 1), (1, 2000, 4)]:
+        if nus.hybrid_error(0.3, 256, 128, npartnufac, vcrit, zz_transition, fitted) <= 2e-3:
+            assert best["runtime"] <= nus.hybrid_cost(128, npartnufac, zz_transition)["runtime"]
+    with pytest.raises(ValueError):
+        nus.select_hybrid_params(0.3, 256, 128, fitted, tolerance=1e-12)
+
+def test_neutrino_part_npartnufac():
+    """Particle neutrino runs may use fewer neutrino than CDM particles."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Sim = nus.NeutrinoPartICs(outdir=os.path.join(tmpdir, "nu"), box=256, npart=128, m_nu=0.3, npartnufac=0.5)
+        assert Sim._genicfile_child_options({})['NgridNu'] == 64
+        assert Sim.snapshot_bytes() < nus.NeutrinoPartICs(outdir=os.path.join(tmpdir, "nu2"), box=256, npart=128, m_nu=0.3).snapshot_bytes()
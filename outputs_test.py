@@ -0,0 +1,37 @@
+"""Tests for planning snapshot outputs to fit a disk budget"""
+import os
+import tempfile
+import numpy as np
+import pytest
+from SimulationRunner import outputs
+from SimulationRunner import simulationics
+
+def test_plan_outputs():
+    """Outputs fit the budget, always include the required times, and are spread in log a."""
+    times = np.array([0.1, 0.2, 0.25, 0.3333, 0.5, 0.66667, 0.83333])
+    assert np.all(outputs.plan_outputs(times, 10, 100) == times)
+    chosen = outputs.plan_outputs(times, 10, 30, required_times=[0.25], astart=0.01, aend=1)
+    assert np.size(chosen) == 3
+    assert 0.25 in chosen
+    #The required time is not counted twice
+    assert np.size(outputs.plan_outputs(times, 10, 70, required_times=[0.25])) == 7
+    with pytest.raises(ValueError):
+        outputs.plan_outputs(times, 10, 15, required_times=[0.25, 0.5])
+
+def test_suite_outputs():
+    """A suite budget is shared so every run fits, counting outputs which are both required and candidates once."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sims = [simulationics.SimulationICs(outdir=os.path.join(tmpdir, str(ii)), box=20, npart=npart, separate_gas=False, output_redshifts=[1.]) for (ii, npart) in enumerate((32, 64))]
+        #z=1 is also one of the default output times
+        assert np.size(sims[0].output_times()) == np.size(sims[0].generate_times())
+        full = sum([sim.storage_report()['total_bytes'] for sim in sims])
+        budget = full - sims[1].snapshot_bytes()
+        reports = outputs.plan_suite_outputs(sims, budget)
+        assert sum([rr['total_bytes'] for rr in reports.values()]) <= budget
+        for sim in sims:
+            assert 0.5 in sim.output_times()
+            assert sim.check_storage() <= sim.output_budget
+            report = sim.storage_report()
+            assert report['total_bytes'] == report['ics_bytes'] + report['nsnap'] * report['snapshot_bytes']
+        with pytest.raises(ValueError):
+            outputs.plan_suite_outputs(sims, sims[0].ics_bytes())
@@ -0,0 +1,53 @@
+"""Tests for placing a suite on several clusters"""
+import types
+import pytest
+from SimulationRunner import placement
+from SimulationRunner import clusters
+
+class _FixedCost(object):
+    """Cost model with a known cost for each simulation"""
+    def predict(self, sim):
+        """Cost stored on the simulation"""
+        return sim.cost
+
+def test_assign():
+    """Runs are balanced between targets, respecting queue waits and allocations."""
+    sims = [types.SimpleNamespace(outdir="run"+str(ii), cost=cc) for (ii, cc) in enumerate((100, 80, 60, 40, 20))]
+    bio = placement.ClusterTarget("bio", clusters.BIOClass, allocation=1000, concurrent_nodes=10)
+    stampede = placement.ClusterTarget("stampede", clusters.StampedeClass, allocation=1000, concurrent_nodes=10, queue_probe=placement.StaticProbe(5.))
+    place = placement.SuitePlacement(sims, [bio, stampede], cost_model=_FixedCost())
+    assignment = place.assign()
+    #Stampede has a 5 hour wait, so bio gets the largest run and more of the work.
+    assert assignment["run0"] == "bio"
+    assert place.used["bio"] + place.used["stampede"] == 300
+    assert place.used["bio"] > place.used["stampede"]
+    assert max(place.finish.values()) < 300/10.
+    #Not enough allocation
+    bio.allocation = 50
+    stampede.allocation = 50
+    with pytest.raises(ValueError):
+        place.assign()
+
+def test_slurm_hours():
+    """SLURM time limits are parsed"""
+    assert placement._slurm_hours("1-02:30:00") == 26.5
+    assert placement._slurm_hours("30:00") == 0.5
+
+def test_slurm_probe_failure():
+    """The probe queries each target's partition and host, and a target whose queue cannot be probed is never used."""
+    probe = placement.SlurmProbe()
+    bio = placement.ClusterTarget("bio", clusters.BIOClass, allocation=1000, concurrent_nodes=10, partition="short", host="bio.example.org")
+    command = probe.command(bio)
+    assert command[:4] == ["ssh", "-o", "BatchMode=yes", "bio.example.org"]
+    assert command[-2:] == ["-p", "short"]
+    assert placement.SlurmProbe(partition="long").command(bio)[-1] == "long"
+    #A command which does not exist, as when squeue is missing
+    probe.command = lambda target: ["/nonexistent/squeue"]
+    assert probe(bio) == float('inf')
+    bio.queue_probe = probe
+    stampede = placement.ClusterTarget("stampede", clusters.StampedeClass, allocation=1000, concurrent_nodes=10, queue_probe=placement.StaticProbe(50.))
+    sims = [types.SimpleNamespace(outdir="run"+str(ii), cost=cc) for (ii, cc) in enumerate((100, 80))]
+    place = placement.SuitePlacement(sims, [bio, stampede], cost_model=_FixedCost())
+    assert set(place.assign().values()) == set(["stampede"])
+    with pytest.raises(ValueError):
+        placement.SuitePlacement(sims, [bio], cost_model=_FixedCost()).assign()
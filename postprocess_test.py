@@ -0,0 +1,70 @@
+"""Tests for the streaming snapshot post-processing"""
+import os
+import tempfile
+import time
+import bigfile
+import numpy as np
+from SimulationRunner import postprocess
+
+def _write_snapshot(snapdir, npart=10):
+    """Write a small BigFile snapshot"""
+    with bigfile.File(snapdir, create=True) as ff:
+        header = ff.create('Header')
+        header.attrs['TotNumPart'] = np.array([0, npart, 0, 0, 0, 0], dtype='u8')
+        pos = ff.create('1/Position', dtype=('f8', 3), size=npart, Nfile=1)
+        pos.write(0, np.random.random((npart, 3)))
+
+def test_postprocess():
+    """Each snapshot is processed once, and the newest is left alone while the simulation runs."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "output")
+        os.mkdir(outdir)
+        for snap in ("PART_000", "PART_001"):
+            _write_snapshot(os.path.join(outdir, snap))
+        with open(os.path.join(tmpdir, "mpgadget.param"), 'w') as fh:
+            fh.write("TimeMax = 0.5\n")
+        with open(os.path.join(outdir, "cpu.txt"), 'w') as fh:
+            fh.write("Step 1, Time: 0.1, MPIs: 1 Threads: 1 Elapsed: 1\n")
+        proc = postprocess.SnapshotProcessor(tmpdir, command="echo {snapnum} >> {snapdir}.txt", nworkers=2)
+        #Simulation is running, so the newest snapshot may be incomplete.
+        assert not proc.finished()
+        assert proc.pending() == [0]
+        with open(os.path.join(outdir, "cpu.txt"), 'a') as fh:
+            fh.write("Step 2, Time: 0.5, MPIs: 1 Threads: 1 Elapsed: 2\n")
+        assert proc.finished()
+        assert proc.run(follow=True, poll=0.01) == {0: 0, 1: 0}
+        assert os.path.exists(os.path.join(outdir, "postprocessed/PART_000.done"))
+        #Nothing left to do
+        assert proc.run() == {}
+        _write_snapshot(os.path.join(outdir, "PART_002"))
+        assert proc.run() == {2: 0}
+        for snap in ("PART_000", "PART_001", "PART_002"):
+            with open(os.path.join(outdir, snap+".txt")) as fh:
+                assert len(fh.readlines()) == 1
+
+def test_follow_stopped_run():
+    """Following stops when a simulation which has not finished stops writing cpu.txt, or after the timeout."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "output")
+        os.mkdir(outdir)
+        for snap in ("PART_000", "PART_001"):
+            _write_snapshot(os.path.join(outdir, snap))
+        with open(os.path.join(tmpdir, "mpgadget.param"), 'w') as fh:
+            fh.write("TimeMax = 0.5\n")
+        cputxt = os.path.join(outdir, "cpu.txt")
+        with open(cputxt, 'w') as fh:
+            fh.write("Step 1, Time: 0.1, MPIs: 1 Threads: 1 Elapsed: 1\n")
+        proc = postprocess.SnapshotProcessor(tmpdir, command="true", nworkers=1)
+        assert not proc.finished()
+        #The run is still writing: only the timeout stops us.
+        start = time.time()
+        assert proc.run(follow=True, poll=0.01, timeout=0.2, stall=60) == {0: 0, 1: 0}
+        assert time.time() - start < 30
+        #The run died an hour ago: following stops at once.
+        _write_snapshot(os.path.join(outdir, "PART_002"))
+        os.utime(cputxt, (time.time() - 3600, time.time() - 3600))
+        assert proc.stalled(60, time.time() - 3600)
+        assert not proc.stalled(60, time.time())
+        start = time.time()
+        assert proc.run(follow=True, poll=0.01, stall=0.1) == {2: 0}
+        assert time.time() - start < 30
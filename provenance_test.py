@@ -0,0 +1,87 @@
+"""Tests for reading git hashes and package versions without running git"""
+import os
+import subprocess
+import tempfile
+import json
+from SimulationRunner import provenance
+from SimulationRunner import simulationics
+
+def _git(cwd, *args):
+    """Run git in a directory"""
+    return subprocess.check_output(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=cwd, universal_newlines=True).strip()
+
+def test_git_hash():
+    """Hashes match git rev-parse for loose refs, packed refs and detached heads."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _git(tmpdir, "init", "-q")
+        os.mkdir(os.path.join(tmpdir, "sub"))
+        with open(os.path.join(tmpdir, "sub", "file"), 'w') as fh:
+            fh.write("test")
+        _git(tmpdir, "add", "sub/file")
+        _git(tmpdir, "commit", "-q", "-m", "first")
+        head = _git(tmpdir, "rev-parse", "HEAD")
+        provenance.clear_cache()
+        assert provenance.git_hash(os.path.join(tmpdir, "sub", "file")) == head
+        _git(tmpdir, "commit", "-q", "--allow-empty", "-m", "second")
+        #Cached
+        assert provenance.git_hash(tmpdir) == head
+        provenance.clear_cache()
+        head = _git(tmpdir, "rev-parse", "HEAD")
+        _git(tmpdir, "pack-refs", "--all", "--prune")
+        assert provenance.git_hash(tmpdir) == head
+        _git(tmpdir, "checkout", "-q", "HEAD~1")
+        provenance.clear_cache()
+        assert provenance.git_hash(tmpdir) == _git(tmpdir, "rev-parse", "HEAD")
+    assert provenance.git_hash("/") is None
+
+def test_record_suite():
+    """Suite provenance is written once."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        prov = provenance.record_suite(tmpdir)
+        assert prov["packages"]["numpy"] is not None
+        assert provenance.package_version("not-a-real-package") is None
+        with open(os.path.join(tmpdir, "provenance.json")) as jsin:
+            assert json.load(jsin) == prov
+        assert provenance.record_suite(tmpdir) == prov
+
+def test_suite_provenance_cached():
+    """Suite provenance is found once per process, and package versions are found without importlib.metadata."""
+    provenance.clear_cache()
+    calls = []
+    git_hash = provenance.git_hash
+    metadata = provenance._metadata
+    provenance.git_hash = lambda path: calls.append(path) or git_hash(path)
+    try:
+        prov = provenance.suite_provenance(gadget_dir="/")
+        assert provenance.suite_provenance(gadget_dir="/") == prov
+        assert len(calls) == 2
+        provenance.clear_cache()
+        provenance._metadata = None
+        assert provenance.package_version("numpy") == prov["packages"]["numpy"]
+        assert provenance.package_version("not-a-real-package") is None
+    finally:
+        provenance.git_hash = git_hash
+        provenance._metadata = metadata
+        provenance.clear_cache()
+
+def test_record_suite_partial():
+    """A truncated provenance file is rewritten rather than raising."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "provenance.json"), 'w') as fh:
+            fh.write('{"SimulationRunner": ')
+        prov = provenance.record_suite(tmpdir)
+        with open(os.path.join(tmpdir, "provenance.json")) as jsin:
+            assert json.load(jsin) == prov
+        assert [ff for ff in os.listdir(tmpdir) if ff != "provenance.json"] == []
+
+def test_standalone_provenance():
+    """A stand-alone run records the code versions in its own description, not in its parent directory."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "run")
+        sim = simulationics.SimulationICs(outdir=outdir, box=20, npart=32, redshift=49, redend=2, separate_gas=False)
+        sim.make_simulation(dry_run=True)
+        assert not os.path.exists(os.path.join(tmpdir, "provenance.json"))
+        with open(os.path.join(outdir, "SimulationICs.json")) as jsin:
+            prov = json.load(jsin)["provenance"]
+        assert prov["packages"]["numpy"] is not None
+        assert "SimulationRunner" in prov
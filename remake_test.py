@@ -0,0 +1,78 @@
+"""Tests for submitting a suite as job arrays"""
+import os
+import subprocess
+import tempfile
+from SimulationRunner import remake
+from SimulationRunner import clusters
+
+def _make_suite(tmpdir, nprocs):
+    """Make run directories with Gadget and GenIC submission scripts."""
+    odirs = []
+    for (ii, nproc) in enumerate(nprocs):
+        odir = os.path.join(tmpdir, "run"+str(ii))
+        os.mkdir(odir)
+        cluster = clusters.BIOClass(nproc=nproc)
+        cluster.generate_mpi_submit(odir)
+        cluster.generate_mpi_submit_genic(odir)
+        odirs.append(odir)
+    return odirs
+
+def test_array_submit():
+    """Runs with the same resources share one array, whatever their job names."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odirs = _make_suite(tmpdir, [256, 256, 512])
+        scripts = remake.resub(tmpdir, submit_command="true", array=True, max_concurrent=2)
+        assert len(scripts) == 2
+        with open(scripts[0]) as fh:
+            text = fh.read()
+        assert "#SBATCH --array=0-1%2\n" in text
+        assert "#SBATCH --nodes=8\n" in text
+        assert text.count("--job-name") == 1
+        assert text.endswith("bash mpi_submit\n")
+        with open(scripts[0]+".dirs") as fh:
+            assert sorted(fh.read().split()) == odirs[:2]
+        #Every run lacks ICs, so every GenIC job is resubmitted
+        remake.resub_not_complete_genic(tmpdir, resub_command="true", array=True)
+        with open(os.path.join(tmpdir, "mpi_submit_genic_array_1.dirs")) as fh:
+            assert fh.read().split() == odirs[2:]
+
+def test_cluster_array_submit():
+    """A PBS cluster writes a PBS array."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odirs = [os.path.join(tmpdir, "run"+str(ii)) for ii in range(3)]
+        script = clusters.HipatiaClass().generate_array_submit(tmpdir, odirs, script_file="mpi_submit_genic", timelimit=0.5)
+        with open(script) as fh:
+            text = fh.read()
+        assert "#PBS -t 0-2\n" in text
+        assert "#PBS -l walltime=0:30:00\n" in text
+        assert "bash mpi_submit_genic\n" in text
+
+def test_pbs_task_directory():
+    """A PBS array task runs its script in its own run directory, even if the script changes to $PBS_O_WORKDIR."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odirs = [os.path.join(tmpdir, "run"+str(ii)) for ii in range(2)]
+        for odir in odirs:
+            os.mkdir(odir)
+            with open(os.path.join(odir, "mpi_submit"), 'w') as fh:
+                fh.write("#!/bin/bash\n#PBS -l nodes=1:ppn=16\ncd $PBS_O_WORKDIR\npwd > where.txt\n")
+        script = remake.write_array_submit(tmpdir, odirs, remake.directive_lines("#PBS -l nodes=1:ppn=16\n"), pbs_pro=True, max_concurrent=1)
+        with open(script) as fh:
+            text = fh.read()
+        assert "#PBS -J 0-1\n" in text
+        assert "#PBS -W max_run_subjobs=1\n" in text
+        env = dict(os.environ, PBS_ARRAY_INDEX="1", PBS_O_WORKDIR=tmpdir)
+        subprocess.check_call(["bash", script], cwd=tmpdir, env=env)
+        with open(os.path.join(odirs[1], "where.txt")) as fh:
+            assert fh.read().strip() == os.path.realpath(odirs[1])
+        assert not os.path.exists(os.path.join(tmpdir, "where.txt"))
+        assert remake.write_array_submit(tmpdir, [], ()) is None
+        assert clusters.HipatiaClass().generate_array_submit(tmpdir, []) is None
+
+def test_find_snaps():
+    """Snapshots are found and ordered by number, including those after 999."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in ("PART_998", "PART_999", "PART_1000", "PART_1001", "PART_01", "PART_1000.tar.gz", "PIG_1002"):
+            os.makedirs(os.path.join(tmpdir, "output", name))
+        assert remake._find_snaps(tmpdir, "output") == [998, 999, 1000, 1001]
+        assert remake._find_snap(tmpdir, "output") == 1001
+        assert remake._find_snaps(tmpdir, "output", snap="PIG_") == [1002]
@@ -0,0 +1,74 @@
+"""Tests for the disk usage scanner and snapshot retention policy"""
+import os
+import tempfile
+import bigfile
+import numpy as np
+from SimulationRunner import retention
+
+def _write_snapshot(snapdir, time, npart=10):
+    """Write a small BigFile snapshot"""
+    with bigfile.File(snapdir, create=True) as ff:
+        header = ff.create('Header')
+        header.attrs['Time'] = np.array([time])
+        header.attrs['TotNumPart'] = np.array([0, npart, 0, 0, 0, 0], dtype='u8')
+        pos = ff.create('1/Position', dtype=('f8', 3), size=npart, Nfile=1)
+        pos.write(0, np.random.random((npart, 3)))
+
+def test_retention():
+    """Required, latest and unprocessed snapshots are kept; others removed only when not a dry run."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odir = os.path.join(tmpdir, "run1")
+        outdir = os.path.join(odir, "output")
+        os.makedirs(os.path.join(outdir, "postprocessed"))
+        for (ii, time) in enumerate((0.2, 0.25, 0.3333, 0.5)):
+            _write_snapshot(os.path.join(outdir, "PART_00"+str(ii)), time)
+            if ii != 2:
+                open(os.path.join(outdir, "postprocessed/PART_00"+str(ii)+".done"), 'w').close()
+        usage = retention.suite_usage(tmpdir)
+        run = usage[odir]
+        posdir = os.path.join(outdir, "PART_000/1/Position")
+        assert run["snapshots"]["PART_000"]["blocks"]["1/Position"] == sum([os.stat(os.path.join(posdir, ff)).st_size for ff in os.listdir(posdir)])
+        assert run["total"] >= sum([ss["total"] for ss in run["snapshots"].values()])
+        policy = retention.RetentionPolicy(output_redshifts=[3.0])
+        plan = policy.apply(odir, dry_run=True)
+        actions = [pp[1] for pp in plan]
+        assert actions == ["delete", "keep", "keep", "keep"]
+        assert os.path.exists(os.path.join(outdir, "PART_000"))
+        policy = retention.RetentionPolicy(output_redshifts=[3.0], action="compress")
+        policy.apply(odir, dry_run=False)
+        assert not os.path.exists(os.path.join(outdir, "PART_000"))
+        assert os.path.exists(os.path.join(outdir, "PART_000.tar.gz"))
+        assert os.path.exists(os.path.join(outdir, "PART_001"))
+
+def test_incomplete_latest():
+    """A snapshot newer than the latest complete one may still be being written, and is kept even without post-processing checks."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odir = os.path.join(tmpdir, "run1")
+        outdir = os.path.join(odir, "output")
+        os.makedirs(outdir)
+        for (ii, time) in enumerate((0.2, 0.25, 0.3333)):
+            _write_snapshot(os.path.join(outdir, "PART_00"+str(ii)), time)
+        #The newest snapshot is only partly written
+        posdir = os.path.join(outdir, "PART_002/1/Position")
+        for ff in os.listdir(posdir):
+            if ff != "header" and ff != "attr-v2":
+                open(os.path.join(posdir, ff), 'w').close()
+        policy = retention.RetentionPolicy(output_redshifts=[], require_postprocessed=False)
+        plan = policy.apply(odir, dry_run=False)
+        assert [pp[1:] for pp in plan] == [("delete", "not needed"), ("keep", "latest restart"), ("keep", "in progress")]
+        assert os.path.exists(os.path.join(outdir, "PART_002"))
+        assert not os.path.exists(os.path.join(outdir, "PART_000"))
+
+def test_hard_links_counted_once():
+    """A file hard linked into two runs is counted once in the suite total."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for run in ("run1", "run2"):
+            os.mkdir(os.path.join(tmpdir, run))
+        shared = os.path.join(tmpdir, "run1", "MP-Gadget")
+        with open(shared, 'wb') as fh:
+            fh.write(b"x" * 1000)
+        os.link(shared, os.path.join(tmpdir, "run2", "MP-Gadget"))
+        with open(os.path.join(tmpdir, "run2", "own"), 'wb') as fh:
+            fh.write(b"y" * 10)
+        usage = retention.suite_usage(tmpdir, nworkers=2)
+        assert sum([uu["total"] for uu in usage.values()]) == 1010
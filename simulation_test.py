@@ -29,3 +29,18 @@ def test_only_DM():
     assert Sim2.box == Sim.box
     assert Sim2.hubble == Sim.hubble
     #shutil.rmtree(outdir)
+
+def test_paired():
+    """Create a paired simulation and check the partner has inverted phases and shares the CLASS output"""
+    outdir = os.path.join(os.path.dirname(__file__),"tests/test3")
+    Sim = simulationics.SimulationICs(outdir=outdir, box = 256, npart = 96, redshift = 99, separate_gas=False, redend=0, paired=True)
+    Sim.make_simulation(pkaccuracy=0.07)
+    partner = outdir+"_inv"
+    for ff in ("camb_linear/ics_matterpow_99.dat", "mpi_submit", "mpi_submit_genic", "mpgadget.param", "_genic_params.ini"):
+        assert os.path.exists(os.path.join(partner, ff))
+    config = configobj.ConfigObj(os.path.join(partner, "_genic_params.ini"))
+    assert config['InvertPhase'] == '1'
+    assert config['Seed'] == configobj.ConfigObj(os.path.join(outdir, "_genic_params.ini"))['Seed']
+    assert 'InvertPhase' not in configobj.ConfigObj(os.path.join(outdir, "_genic_params.ini"))
+    with open(os.path.join(partner, "mpi_submit_genic")) as fh:
+        assert "cambpower.py" not in fh.read()
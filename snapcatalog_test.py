@@ -0,0 +1,66 @@
+"""Tests for the snapshot catalog"""
+import os
+import shutil
+import tempfile
+import bigfile
+import numpy as np
+from SimulationRunner import snapcatalog
+from SimulationRunner import integrity
+
+def _write_header(snapdir, time, npart=10):
+    """Write a BigFile snapshot with just a header"""
+    with bigfile.File(snapdir, create=True) as ff:
+        header = ff.create('Header')
+        header.attrs['Time'] = np.array([time])
+        header.attrs['TotNumPart'] = np.array([0, npart, 0, 0, 0, 0], dtype='u8')
+        header.attrs['MassTable'] = np.array([0, 0.5, 0, 0, 0, 0])
+
+def test_catalog():
+    """Queries by redshift, and the cache is used and updated."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        odir = os.path.join(tmpdir, "run1")
+        outdir = os.path.join(odir, "output")
+        os.makedirs(outdir)
+        for (ii, zz) in enumerate((4.2, 3.0, 2.2)):
+            _write_header(os.path.join(outdir, "PART_00"+str(ii)), 1./(1+zz))
+            _write_header(os.path.join(outdir, "PIG_00"+str(ii)), 1./(1+zz))
+        cat = snapcatalog.SnapshotCatalog(odir)
+        assert len(cat.snapshots()) == 3
+        assert len(cat.snapshots("PIG_")) == 3
+        assert np.allclose(cat.redshifts(), [4.2, 3.0, 2.2])
+        assert cat.nearest(3.1)["name"] == "PART_001"
+        assert [ee["snapnum"] for ee in cat.in_range(2.1, 3.5)] == [1, 2]
+        assert cat.nearest(3.1)["attrs"]["MassTable"][1] == 0.5
+        assert os.path.exists(os.path.join(outdir, ".snapcatalog.json"))
+        #New snapshot, and the cached catalog of the old ones is reused.
+        _write_header(os.path.join(outdir, "PART_003"), 1./3.)
+        read = []
+        read_header_attrs = integrity.read_header_attrs
+        integrity.read_header_attrs = lambda snapdir: read.append(os.path.basename(snapdir)) or read_header_attrs(snapdir)
+        try:
+            suite = snapcatalog.suite_catalog(tmpdir)
+        finally:
+            integrity.read_header_attrs = read_header_attrs
+        assert read == ["PART_003"]
+        assert list(suite.keys()) == [odir]
+        assert suite[odir].nearest(1.9)["snapnum"] == 3
+        assert np.all(suite[odir].snapshots()[0]["attrs"]["TotNumPart"] == [0, 10, 0, 0, 0, 0])
+
+def test_incomplete_headers():
+    """Headers still being written are skipped and read again later, and snapshot numbers may exceed 999."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = os.path.join(tmpdir, "output")
+        os.makedirs(outdir)
+        _write_header(os.path.join(outdir, "PART_999"), 0.25)
+        _write_header(os.path.join(outdir, "PART_1000"), 0.5)
+        #A header with no attributes yet
+        os.makedirs(os.path.join(outdir, "PART_1001", "Header"))
+        with open(os.path.join(outdir, "PART_1001", "Header", "attr-v2"), 'w') as fh:
+            fh.write("")
+        cat = snapcatalog.SnapshotCatalog(tmpdir)
+        assert [ee["snapnum"] for ee in cat.snapshots()] == [999, 1000]
+        shutil.rmtree(os.path.join(outdir, "PART_1001"))
+        _write_header(os.path.join(outdir, "PART_1001"), 0.75)
+        cat.refresh()
+        assert [ee["snapnum"] for ee in cat.snapshots()] == [999, 1000, 1001]
+        assert np.allclose(cat.redshifts(), [3, 1, 1./3])
@@ -0,0 +1,59 @@
+"""Tests for per-job telemetry"""
+import os
+import stat
+import subprocess
+import tempfile
+import numpy as np
+from SimulationRunner import clusters
+from SimulationRunner import telemetry
+
+def test_record_collect():
+    """Records are written per job, collected for a suite and tabulated."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for run in ("run0", "run1"):
+            os.mkdir(os.path.join(tmpdir, run))
+        oldenv = dict(os.environ)
+        try:
+            for nn in ("SLURM_JOB_ID", "PBS_JOBID", "SLURM_JOB_NUM_NODES", "SLURM_NNODES", "SLURM_NTASKS", "PBS_NP"):
+                os.environ.pop(nn, None)
+            os.environ["PBS_JOBID"] = "123.server"
+            os.environ["PBS_NUM_NODES"] = "4"
+            rec = telemetry.record(os.path.join(tmpdir, "run0"), "gadget", 100., 100.+7200, 0, nproc=64)
+            os.environ.pop("PBS_NUM_NODES")
+            telemetry.record(os.path.join(tmpdir, "run1"), "genic", 50., 50.+1800, 1, nproc=64)
+        finally:
+            os.environ.clear()
+            os.environ.update(oldenv)
+        assert rec["jobid"] == "123.server"
+        assert rec["nodes"] == 4
+        assert rec["tasks"] == 64
+        records = telemetry.collect(tmpdir)
+        assert len(records) == 2
+        table = telemetry.suite_table(records)
+        assert np.all(table["stage"] == np.array(["gadget", "genic"]))
+        assert np.isnan(table["nodes"][1])
+        assert np.allclose(table["node_hours"], [8., 0.5])
+        cost = telemetry.suite_cost(tmpdir)
+        assert abs(cost[os.path.join(tmpdir, "run0")] - 8) < 1e-12
+
+def test_instrumented_script():
+    """The instrumented script records the job and exits with the status of the program."""
+    with tempfile.TemporaryDirectory() as suitedir:
+        tmpdir = os.path.join(suitedir, "run")
+        os.mkdir(tmpdir)
+        cluster = clusters.ClusterClass(nproc=4, telemetry=True)
+        cluster.generate_mpi_submit(tmpdir)
+        with open(os.path.join(tmpdir, "mpi_submit")) as fh:
+            text = fh.read()
+        assert "SR_START=$(date +%s.%N)\n" in text
+        assert "python telemetry.py --stage gadget" in text
+        assert text.endswith("exit $SR_STATUS\n")
+        assert os.path.exists(os.path.join(tmpdir, "telemetry.py"))
+        #A failing program
+        mpirun = os.path.join(tmpdir, "mpirun")
+        with open(mpirun, 'w') as fh:
+            fh.write("#!/bin/bash\nexit 3\n")
+        os.chmod(mpirun, os.stat(mpirun).st_mode | stat.S_IEXEC)
+        env = dict(os.environ, PATH=tmpdir+os.pathsep+os.environ["PATH"])
+        assert subprocess.call(["bash", "mpi_submit"], cwd=tmpdir, env=env) == 3
+        assert [rr["status"] for rr in telemetry.collect(suitedir)] == [3]
@@ -0,0 +1,52 @@
+"""Tests for generating modified UVB tables"""
+import os
+import tempfile
+import numpy as np
+from SimulationRunner import read_uvb_tab
+from SimulationRunner import simulationics
+
+def test_modify():
+    """Heating is rescaled, and the start of reionization moved, without changing low redshift."""
+    base = read_uvb_tab.load_uvb_table("fg")
+    tables = read_uvb_tab.modify_uvb_tables(base, [1., 2.], [np.nan, 8.])
+    assert np.shape(tables) == (2,) + np.shape(base)
+    assert np.all(tables[0] == base)
+    assert np.allclose(tables[1][:,4:], 2*base[:,4:])
+    assert np.all(tables[1][:,1:4] == base[:,1:4])
+    zz = 10**tables[1][:,0] - 1
+    assert np.abs(np.max(zz[tables[1][:,1] > 0]) - 8) < 1e-10
+    low = 10**base[:,0] - 1 <= 6
+    assert np.all(tables[1][low,0] == base[low,0])
+    assert np.all(np.diff(tables[1][:,0]) > 0)
+
+def test_variant_files():
+    """Each unique table is written once, and reused."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        heat = np.repeat(np.linspace(0.5, 2, 50), 4)
+        zreion = np.tile([7., 8., 9., 10.], 50)
+        names = read_uvb_tab.uvb_variant_files("pu", heat, zreion, tmpdir)
+        assert len(names) == 200
+        assert len(os.listdir(tmpdir)) == 200
+        again = read_uvb_tab.uvb_variant_files("pu", [2., 2.], [10., 10.], tmpdir)
+        assert again[0] == again[1] == names[-1]
+        table = np.loadtxt(names[-1])
+        assert np.allclose(table[:,4:], 2*read_uvb_tab.load_uvb_table("pu")[:,4:], rtol=1e-5)
+        assert read_uvb_tab.uvb_variant_files("pu", 1., None, tmpdir)[0] not in names
+
+def test_variant_base_table():
+    """Variants of an edited base table are not reused, and a simulation keeps its variants in its own directory."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        name = read_uvb_tab.uvb_variant_files("pu", 2., None, tmpdir)[0]
+        real = read_uvb_tab.base_table_hash("pu")
+        read_uvb_tab._UVB_HASHES["pu"] = "edited"
+        try:
+            assert read_uvb_tab.uvb_variant_files("pu", 2., None, tmpdir)[0] != name
+        finally:
+            read_uvb_tab._UVB_HASHES["pu"] = real
+        assert read_uvb_tab.uvb_variant_files("pu", 2., None, tmpdir)[0] == name
+        outdir = os.path.join(tmpdir, "sims", "run")
+        os.makedirs(os.path.dirname(outdir))
+        sim = simulationics.SimulationICs(outdir=outdir, box=20, npart=32, uvb_heat_amp=2.)
+        sim._copy_uvb()
+        assert os.listdir(os.path.dirname(outdir)) == ["run"]
+        assert len(os.listdir(os.path.join(outdir, ".uvb"))) == 1